@@ -74,6 +74,10 @@ typedef struct {
     long int offset;
     unsigned int num_tracks;
     track_t tracks[MAX_TRACKS];
+    /* batch mode: checksums at all offsets in [min_offset, max_offset] */
+    bool batch;
+    long int min_offset;
+    long int max_offset;
 } opts_t;
 
 /* util.c */
@@ -90,6 +94,8 @@ sndbuff_t fill_sndbuf(const soundfile_t soundfile,
 sndbuff_t fill_sndbuf_offset(const soundfile_t soundfile,
                              const samplenum_t start, const samplenum_t len,
                              const samplenum_t offset);
+/* batch.c */
+int checksum_batch(const soundfile_t soundfile, const opts_t * const opts);
 
 /* calculate version 1 and version 2 checksum of PCM_s16le data */
 int accuraterip_checksum(
@@ -0,0 +1,225 @@
+#include "accuraterip.h"
+
+#include <stdio.h>
+
+/* Batch mode: the checksums of all tracks at all offsets in a range, in a single pass over the file.
+ *
+ * The v1 checksum at file shift k is sum((j+1) * x[start+k+j]) over the samples j of the track (excluding the
+ * skipped samples of the first and last track).  Going from shift k to k+1 only shifts the weights by one, so
+ * the checksum at k+1 follows from the one at k and the plain sum of the window:
+ *   S(k+1) = S(k) - T(k) - a*x[k+a] + b*x[k+b]
+ *   T(k+1) = T(k) - x[k+a] + x[k+b]
+ * where [a, b) is the range of samples in the track that is included in the checksum.  So we only need S and T
+ * at the lowest shift, and the samples at both edges of the window.
+ * The v2 checksum adds the high 32 bits of every product, which don't shift along with the weights, so those are
+ * summed per shift (which makes v2 the expensive part for wide ranges).
+ *
+ * The file is read in chunks of CHUNK_SAMPLES; every track only keeps state for the range of shifts, so memory
+ * use doesn't depend on the length of the tracks.  Samples outside of the file count as silence.
+ */
+
+#define CHUNK_SAMPLES (SAMPLES_PER_SECOND)
+
+typedef struct {
+    samplenum_t start;      /* position of the track in the file */
+    samplenum_t a, b;       /* range of samples in the track that are included in the checksum */
+    samplenum_t win_start;  /* range of samples in the file needed for all shifts */
+    samplenum_t win_end;
+    uint32_t sum_weighted;  /* weighted and plain sum of the window at the lowest shift */
+    uint32_t sum;
+    uint32_t *head;         /* samples that enter and leave the window when rolling to the highest shift */
+    uint32_t *tail;
+    uint32_t *high;         /* sum of the high words of the products, per shift */
+    bool done;
+} batch_track_t;
+
+
+static void *alloc_zero(const size_t num, const size_t size)
+{
+    void *p = calloc(num > 0 ? num : 1, size);
+    if (p == NULL) {
+        fprintf(stderr, "Failed to allocate %zu bytes\n", num * size);
+        exit(1);
+    }
+    return p;
+}
+
+static void batch_track_alloc(batch_track_t * const bt, const samplenum_t range)
+{
+    bt->head = alloc_zero(range, sizeof(uint32_t));
+    bt->tail = alloc_zero(range, sizeof(uint32_t));
+    bt->high = alloc_zero(range + 1, sizeof(uint32_t));
+}
+
+static void batch_track_free(batch_track_t * const bt)
+{
+    free(bt->head);
+    free(bt->tail);
+    free(bt->high);
+    bt->head = bt->tail = bt->high = NULL;
+    bt->done = true;
+}
+
+static void batch_track_init(batch_track_t * const bt, const track_t * const track,
+                             const samplenum_t frames, const samplenum_t kmin, const samplenum_t kmax)
+{
+    memset(bt, 0, sizeof(*bt));
+    bt->start = track->sample_start;
+    /* no length (or -1) means: until the end of the file, as in fill_sndbuf_offset() */
+    const samplenum_t length = track->sample_length > 0 ? track->sample_length : frames - track->sample_start;
+
+    bt->a = is_first_track(track->track_type) ? 5*SAMPLES_PER_FRAME-1 : 0;
+    bt->b = is_last_track(track->track_type) ? length - 5*SAMPLES_PER_FRAME : length;
+    if (bt->b < bt->a)
+        bt->b = bt->a;
+
+    bt->win_start = bt->start + kmin + bt->a;
+    bt->win_end   = bt->start + kmax + bt->b;
+}
+
+/* feed samples [pos, pos+num) of the file to a track */
+static void batch_track_update(batch_track_t * const bt, const uint32_t * const samples,
+                               const samplenum_t pos, const samplenum_t num,
+                               const samplenum_t kmin, const samplenum_t kmax)
+{
+    const samplenum_t range = kmax - kmin;
+    samplenum_t lo = pos > bt->win_start ? pos : bt->win_start;
+    samplenum_t hi = pos + num < bt->win_end ? pos + num : bt->win_end;
+
+    for (samplenum_t p = lo; p < hi; p++) {
+        const uint32_t x = samples[p - pos];
+        const samplenum_t rel = p - bt->start;  /* position in the track */
+
+        /* the window at the lowest shift */
+        if (rel >= kmin + bt->a && rel < kmin + bt->b) {
+            bt->sum_weighted += (uint32_t) ((uint64_t) x * (uint64_t) (rel - kmin + 1));
+            bt->sum += x;
+        }
+
+        /* edges of the window */
+        const samplenum_t head = rel - (kmin + bt->a);
+        if (head >= 0 && head < range)
+            bt->head[head] = x;
+        const samplenum_t tail = rel - (kmin + bt->b);
+        if (tail >= 0 && tail < range)
+            bt->tail[tail] = x;
+
+        /* v2: all shifts k for which this sample is in the window, so a <= rel-k < b */
+        samplenum_t k_lo = rel - bt->b + 1;
+        samplenum_t k_hi = rel - bt->a;
+        if (k_lo < kmin) k_lo = kmin;
+        if (k_hi > kmax) k_hi = kmax;
+        for (samplenum_t k = k_lo; k <= k_hi; k++) {
+            const uint64_t product = (uint64_t) x * (uint64_t) (rel - k + 1);
+            bt->high[k - kmin] += (uint32_t) (product >> 32U);
+        }
+    }
+}
+
+/* print the checksums of a track at all offsets, in order of offset (offset == -shift) */
+static void batch_track_print(const batch_track_t * const bt, const unsigned track_num,
+                              const samplenum_t kmin, const samplenum_t kmax)
+{
+    const samplenum_t range = kmax - kmin;
+    const uint32_t a = (uint32_t) bt->a;
+    const uint32_t b = (uint32_t) bt->b;
+
+    /* v1 at every shift, by rolling from the lowest one */
+    uint32_t *crc_v1 = alloc_zero(range + 1, sizeof(uint32_t));
+    uint32_t crc = bt->sum_weighted;
+    uint32_t sum = bt->sum;
+    crc_v1[0] = crc;
+    for (samplenum_t i = 0; i < range; i++) {
+        crc = crc - sum - a * bt->head[i] + b * bt->tail[i];
+        sum = sum - bt->head[i] + bt->tail[i];
+        crc_v1[i + 1] = crc;
+    }
+
+    for (samplenum_t k = kmax; k >= kmin; k--) {
+        const uint32_t v1 = crc_v1[k - kmin];
+        const uint32_t v2 = v1 + bt->high[k - kmin];
+        printf("track%02u %+6"PRId64" %08x %08x\n", track_num, -k, v1, v2);
+    }
+
+    free(crc_v1);
+}
+
+int checksum_batch(const soundfile_t soundfile, const opts_t * const opts)
+{
+    const samplenum_t frames = soundfile.info.frames;
+    const unsigned num_tracks = opts->num_tracks;
+    /* a positive offset means the drive reads samples too soon, so the track is found earlier in the file */
+    const samplenum_t kmin = -opts->max_offset;
+    const samplenum_t kmax = -opts->min_offset;
+    const samplenum_t range = kmax - kmin;
+
+    batch_track_t tracks[MAX_TRACKS];
+    samplenum_t first = frames;
+    samplenum_t last = 0;
+    for (unsigned i = 0; i < num_tracks; i++) {
+        batch_track_init(&tracks[i], &opts->tracks[i], frames, kmin, kmax);
+        if (tracks[i].win_start < first) first = tracks[i].win_start;
+        if (tracks[i].win_end > last) last = tracks[i].win_end;
+    }
+    if (first < 0) first = 0;
+    if (last > frames) last = frames;
+
+    debug("Batch: offsets %ld..%ld, reading samples %"PRId64"..%"PRId64"\n",
+          opts->min_offset, opts->max_offset, first, last);
+
+    int16_t *buf = alloc_zero(CHUNK_SAMPLES * soundfile.info.channels, sizeof(int16_t));
+    uint32_t *samples = alloc_zero(CHUNK_SAMPLES, sizeof(uint32_t));
+
+    if (first < last && sf_seek(soundfile.fd, first, SEEK_SET) < 0) {
+        fprintf(stderr, "Error while seeking to sample %"PRId64"\n", first);
+        exit(1);
+    }
+
+    /* tracks are printed in order, as soon as they (and all tracks before them) are done; only the tracks whose
+     * window overlaps the current chunk have state */
+    unsigned next_print = 0;
+    for (samplenum_t pos = first; pos < last; pos += CHUNK_SAMPLES) {
+        const samplenum_t num = last - pos < CHUNK_SAMPLES ? last - pos : CHUNK_SAMPLES;
+        const sf_count_t num_read = sf_readf_short(soundfile.fd, buf, num);
+        if (num_read != num) {
+            fprintf(stderr, "Could read only %"PRId64" of %"PRId64" samples at %"PRId64"\n",
+                    (samplenum_t) num_read, num, pos);
+            exit(1);
+        }
+        for (samplenum_t i = 0; i < num; i++) {
+            const uint32_t left  = (uint16_t) buf[2*i];
+            const uint32_t right = (uint16_t) buf[2*i+1];
+            samples[i] = (right << 16U) | left;
+        }
+
+        for (unsigned t = next_print; t < num_tracks; t++) {
+            batch_track_t * const bt = &tracks[t];
+            if (bt->done || bt->win_start >= pos + num)
+                continue;
+            if (bt->head == NULL)
+                batch_track_alloc(bt, range);
+            batch_track_update(bt, samples, pos, num, kmin, kmax);
+        }
+
+        while (next_print < num_tracks && tracks[next_print].win_end <= pos + num) {
+            if (tracks[next_print].head == NULL)
+                batch_track_alloc(&tracks[next_print], range);
+            batch_track_print(&tracks[next_print], next_print + 1, kmin, kmax);
+            batch_track_free(&tracks[next_print]);
+            next_print++;
+        }
+    }
+
+    /* the rest of the windows are beyond the end of the file (or the tracks are entirely outside of it) */
+    for (; next_print < num_tracks; next_print++) {
+        batch_track_t * const bt = &tracks[next_print];
+        if (bt->head == NULL)
+            batch_track_alloc(bt, range);
+        batch_track_print(bt, next_print + 1, kmin, kmax);
+        batch_track_free(bt);
+    }
+
+    free(samples);
+    free(buf);
+    return 0;
+}
@@ -21,12 +21,14 @@ int help(const char * const error, ...)
 
         printf("\n\n");
     }
-    printf("Syntax: accuraterip [-v] [-f] [-l] [-o <samples>] <filename.wav> [<start1>[,<length1>] [<start2>[,<length2>] ...]] \n");
+    printf("Syntax: accuraterip [-v] [-f] [-l] [-o <samples> | -r <min>:<max>] <filename.wav> [<start1>[,<length1>] [<start2>[,<length2>] ...]] \n");
     printf("\n");
     printf("Available options:\n");
     printf("  --first (-f)   : track is first on disc (first 5 frames are ignored)\n");
     printf("  --last (-l)    : track is last on disc (final 5 frames are ignored)\n");
     printf("  --offset (-o)  : adjust offset of samples in audiofile (to correct for cd player offsets)\n");
+    printf("  --range (-r)   : batch mode: checksums at all offsets from <min> to <max>, in a single pass over the file\n");
+    printf("                   (output: track, offset, v1, v2)\n");
     printf("  --verbose (-v) : show verbose output\n");
     printf("\n");
     printf("<startN>  :  start time of Nth track in file (default: start of file)\n");
@@ -45,9 +47,9 @@ int help(const char * const error, ...)
 }
 
 opts_t parse_args(const int argc, char ** argv) {
-    opts_t opts = {NULL, 0L, 1, {{0, -1, NORMAL_TRACK}}};
+    opts_t opts = {NULL, 0L, 1, {{0, -1, NORMAL_TRACK}}, false, 0L, 0L};
 
-    const char *const short_options = "hvflo:";
+    const char *const short_options = "hvflo:r:";
     const struct option long_options[] =
             {
                     {"help",    no_argument,       NULL, 'h'},
@@ -55,6 +57,7 @@ opts_t parse_args(const int argc, char ** argv) {
                     {"first",   no_argument,       NULL, 'f'},
                     {"last",    no_argument,       NULL, 'l'},
                     {"offset",  required_argument, NULL, 'o'},
+                    {"range",   required_argument, NULL, 'r'},
                     {NULL, 0, NULL, 0},
             };
 
@@ -83,6 +86,20 @@ opts_t parse_args(const int argc, char ** argv) {
                 if (labs(opts.offset)>MAX_OFFSET)
                     help("Maximum supported offset is %li\n", MAX_OFFSET);
                 break;
+            case 'r':
+            {
+                char *sep;
+                opts.batch = true;
+                opts.min_offset = strtol(optarg, &sep, 10);
+                if (*sep != ':')
+                    help("Offset range should be <min>:<max>");
+                opts.max_offset = strtol(sep+1, NULL, 10);
+                if (labs(opts.min_offset)>MAX_OFFSET || labs(opts.max_offset)>MAX_OFFSET)
+                    help("Maximum supported offset is %li\n", MAX_OFFSET);
+                if (opts.min_offset>opts.max_offset)
+                    help("Offset range %li:%li is empty", opts.min_offset, opts.max_offset);
+                break;
+            }
             /* note: specifying -f/-l and multiple tracks doesn't make sens;
              * this is handled below, after parsing all arguments */
             case 'f':
@@ -95,6 +112,9 @@ opts_t parse_args(const int argc, char ** argv) {
                 help("Unknown option specified");
         }
     }
+    if (opts.batch && opts.offset != 0)
+        help("Specifying both -o and -r doesn't make sense");
+
     int args_left = argc - optind;
 
     if (args_left < 1) help("Too few arguments");
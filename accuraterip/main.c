@@ -8,6 +8,11 @@ int main(const int argc, char **argv)
 
     soundfile_t soundfile = open_sndfile(options.filename);
 
+    if (options.batch) {
+        int result = checksum_batch(soundfile, &options);
+        close_sndfile(&soundfile);
+        return result;
+    }
 
     for (unsigned i=0; i<options.num_tracks; i++) {
         track_t track = options.tracks[i];
@@ -57,6 +57,29 @@ int main(void)
 
 	sf_close(outfile);
 
+
+	/* 20 seconds of noise, for the batch mode test; any change in the samples shows up in the checksums */
+	if(!(outfile = sf_open("noise.wav", SFM_WRITE, &sfinfo)))
+	{
+		printf("Error : could not open file : %s\n", "noise.wav");
+		puts(sf_strerror(NULL));
+		return 1;
+	}
+
+	unsigned int state = 1;
+	for (int s=0; s<20*44100; s++)
+	{
+		short buf[2];
+		for (int c=0; c<2; c++)
+		{
+			state = state * 1103515245u + 12345u;
+			buf[c] = (short) (state >> 16);
+		}
+		sf_write_short(outfile, buf, 2);
+	}
+
+	sf_close(outfile);
+
 	printf("ok\n");
 
 	return 0;
@@ -33,6 +33,11 @@ SHORT3_V1_LAST=ab7b4804
 SHIFTED_V2_NORMAL=671a7f47
 SHIFTED_V1_NORMAL=9496fdd7
 
+# offsets at which batch mode is checked against single-offset runs
+RANGE=20
+
+FAILED=0
+
 
 function comp() {
 	MSG=$1
@@ -47,14 +52,50 @@ function comp() {
 		echo "FAILED"
 		echo " - v1: expected $OK1, got $CHK1"
 		echo " - v2: expected $OK2, got $CHK2"
+		FAILED=$((FAILED+1))
 	else
 		echo "OK"
 	fi
 }
 
+# compare the output of batch mode (-r) with that of a single run (-o) at every offset in the range
+function comp_batch() {
+	MSG=$1
+	FLAGS=$2
+	TRACKS=$3
+
+	echo -n "Test for ${MSG}... "
+	batch=$(../accuraterip -r-${RANGE}:${RANGE} $FLAGS noise.wav $TRACKS | awk '{print $1, $2+0, $3, $4}' | sort)
+	single=$(for o in $(seq -$RANGE $RANGE)
+		do
+			../accuraterip -o$o $FLAGS noise.wav $TRACKS | awk -v o=$o '{print $1, o, $4, $5}'
+		done | sort)
+	if [ -z "$batch" ] || [ "$batch" != "$single" ]
+	then
+		echo "FAILED"
+		diff <(echo "$single") <(echo "$batch") | head -n 10
+		FAILED=$((FAILED+1))
+	else
+		echo "OK"
+	fi
+}
+
+function finish() {
+	echo "Finished"
+	if [ $FAILED -gt 0 ]
+	then
+		echo "$FAILED tests FAILED"
+		exit 1
+	fi
+	exit 0
+}
+
+
+# generate the test files that aren't made from the ogg file
+[ -e noise.wav ] || make -s -C .. -f Makefile.linux test/noise.wav || exit 1
 
 # check wav files
-sha256sum --check <<EOF
+sha256sum --quiet --check --ignore-missing <<EOF || exit 1
 e5f2b25ae2761e36505aff0c467106868a17ed1e856a9c1f26b0726e936bb3e2  full.wav
 f5b265107db66510d89b6a18c04f55dec0dfbee0f7f729a6634c0cab3e51979e  shifted.wav
 20d0d5e7de68e998eb336f190ed4891b20c114c37a289611119b14794d28c3b6  short2.wav
@@ -62,9 +103,30 @@ f5b265107db66510d89b6a18c04f55dec0dfbee0f7f729a6634c0cab3e51979e  shifted.wav
 0e47251cc80f9eab0756afc4f7c6736b7046b8b9f974cb88d0848c1d0c6a7fa1  short.wav
 150331e03842a8362ae6656f3e543d4ff58899181d357a549be74c9d0646be87  test1.wav
 c6c3bc34db4462079ea9a9f7734ad70ea0f328a36e7e7942734081c67acfb33f  test2.wav
+014b1adf4fa1287c3ec334d20341ca287969ae1ac271d50ab07e8da6ebf2ed19  noise.wav
 EOF
 
 
+# check batch mode against single-offset runs
+comp_batch "noise.wav (batch, middle track)" "" ""
+comp_batch "noise.wav (batch, first track)" "-f" ""
+comp_batch "noise.wav (batch, last track)" "-l" ""
+comp_batch "noise.wav (batch, single track)" "-f -l" ""
+comp_batch "noise.wav (batch, three tracks)" "" "2,5 7,6 13"
+comp_batch "noise.wav (batch, tracks at both ends of the file)" "" "0,6 6,7 13,7"
+
+
+# the rest of the tests need the files that are made from the ogg file
+for f in full.wav short.wav short2.wav short3.wav shifted.wav
+do
+	if ! [ -e $f ]
+	then
+		echo "$f not found, skipping the tests on the ogg file (they are made from it with flac, sox and ffmpeg)"
+		finish
+	fi
+done
+
+
 # check full file
 chksums=($(../accuraterip full.wav | awk '{print $4, $5}'))
 comp "full.wav (middle track)... " $FULL_V1_NORMAL $FULL_V2_NORMAL ${chksums[@]}
@@ -124,5 +186,17 @@ chksums=($(../accuraterip -o48 shifted.wav | awk '{print $4, $5}'))
 comp "shifted.wav (middle track, shifted by 48)... " $FULL_V1_NORMAL $FULL_V2_NORMAL ${chksums[@]}
 
 
+# check batch mode
+chksums=($(../accuraterip -r0:48 shifted.wav | awk '$2==0 {print $3, $4}'))
+comp "shifted.wav (batch, offset 0)... " $SHIFTED_V1_NORMAL $SHIFTED_V2_NORMAL ${chksums[@]}
+
+chksums=($(../accuraterip -r0:48 shifted.wav | awk '$2==48 {print $3, $4}'))
+comp "shifted.wav (batch, offset 48)... " $FULL_V1_NORMAL $FULL_V2_NORMAL ${chksums[@]}
+
+chksums=($(../accuraterip -r-5:5 full.wav 30,20 50,25 75,30 | awk '$2==0 {print $3, $4}'))
+comp "subset of full.wav (batch, track 1)... " $SHORT_V1_FIRST   $SHORT_V2_FIRST   ${chksums[@]:0:2}
+comp "subset of full.wav (batch, track 2)... " $SHORT2_V1_NORMAL $SHORT2_V2_NORMAL ${chksums[@]:2:2}
+comp "subset of full.wav (batch, track 3)... " $SHORT3_V1_LAST   $SHORT3_V2_LAST   ${chksums[@]:4:2}
+
 
-echo "Finished"
+finish
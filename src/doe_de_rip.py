@@ -3,18 +3,20 @@
 from __future__ import annotations
 
 # import pyudev
-import sys
+import argparse
+import asyncio
 # import time
+from concurrent.futures import Executor, ProcessPoolExecutor
 # import json
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 from pprint import pprint
-from typing import Optional, List
-import csv
-import readline  # for input
-
-import filelock
+from typing import Optional, List, Tuple
+import os
+import shutil
+import sys
+import tempfile
 
 import voidrip
 from pathlib import Path
@@ -24,26 +26,53 @@ from pathlib import Path
 from voidrip import cd
 
 
-@dataclass
-class Options:
-    cdrom: Path
+ACCURATERIP_CACHE = Path("/data/cdrip/cache/accuraterip")
+DRIVE_OFFSETS = Path("/data/cdrip/config/drive_offsets.json")
+# the published list from accuraterip.com
+ACCURATERIP_OFFSETS = Path("/data/cdrip/config/DriveOffsets.bin")
 
 
-readline.read_init_file()
+@dataclass
+class Options:
+    cdroms: List[Path]
+    offline: bool = False
+    stream: bool = False
+    keep_wav: bool = True
+    jobs: Optional[int] = None
+    calibrate: Optional[int] = None
 
 
 def parse_args() -> Options:
-    if len(sys.argv) < 2:
-        print("Please specify cdrom number")
-        sys.exit(1)
-    try:
-        num = int(sys.argv[1])
-    except ValueError:
-        print("Please specify the cdrom number (0<=n<5)")
-        sys.exit(1)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cdrom", type=int, nargs="*",
+                        help="cdrom numbers (0<=n<5); all drives are used if none are specified")
+    parser.add_argument("--offline", action="store_true",
+                        help="don't use the network for accuraterip lookups, only the local cache")
+    parser.add_argument("--stream", action="store_true",
+                        help="checksum and encode the audio while ripping, instead of afterwards")
+    parser.add_argument("--no-wav", action="store_true",
+                        help="in streaming mode, don't keep a wav copy of the rip")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of tracks to encode at the same time (default: number of cpus)")
+    parser.add_argument("--calibrate", type=int, metavar="N", default=None,
+                        help="don't rip, but measure the read offset of the drives, on at least N discs that are in "
+                             "accuraterip")
+    args = parser.parse_args()
+
+    if args.cdrom:
+        cdroms = [Path(f"/dev/cdrom{n}") for n in args.cdrom]
+    else:
+        cdroms = sorted(p for p in Path("/dev").glob("cdrom*") if p.name[5:].isdigit())
+    if not cdroms:
+        parser.error("no cdrom drives found")
 
     return Options(
-        cdrom=Path(f"/dev/cdrom{num}")
+        cdroms=cdroms,
+        offline=args.offline,
+        stream=args.stream,
+        keep_wav=not args.no_wav,
+        jobs=args.jobs,
+        calibrate=args.calibrate
     )
 
 
@@ -63,6 +92,8 @@ class RipStatus:
         RipStatusCode.DONE:     Path("/data/cdrip/work/4_done"),
         "status": Path("/data/cdrip/status")
     }
+    # the state of all rips, shared by all RipStatus objects in this process
+    _states: Optional[voidrip.RipStateStore] = None
 
     def __init__(self, cdplayer: voidrip.CDPlayer):
         for p in self.dir.values():
@@ -76,16 +107,21 @@ class RipStatus:
     def id_to_name(id_num: int) -> Path:
         return Path(f"cd_{id_num:05d}")
 
+    def highest_id(self) -> int:
+        ids = [int(f.stem[3:]) for f in self.dir["status"].glob("cd_*.status") if f.stem[3:].isdigit()]
+        return max(ids, default=0)
+
     def register_next_id(self) -> int:
-        num = 1
+        counter = voidrip.RipIdCounter(self.dir["status"] / "last_id", self.highest_id)
         while True:
+            num = counter.next()
             filename = self.dir["status"] / self.id_to_name(num).with_suffix(".status")
             try:
                 with open(filename, "x") as statusfile:
                     statusfile.write("")
                 return num
             except FileExistsError:
-                num += 1
+                # created by someone who doesn't use the counter; take the next one
                 continue
 
     def create_dir_phase1(self, cdrom_path: Path) -> Path:
@@ -105,40 +141,35 @@ class RipStatus:
     def status_file(self) -> Path:
         return self.dir["status"] / self.name.with_suffix(".status")
 
-    def read_statusfile(self) -> tuple[RipStatusCode, Optional[str], Optional[str]]:
-        try:
-            with open(self.status_file, "r") as statusfile:
-                s = statusfile.readline().rstrip()
-                status = RipStatusCode[s] if s else None
-                artist = statusfile.readline().rstrip()
-                album = statusfile.readline().rstrip()
-        except ValueError:
-            raise Exception(f"Invalid status '{s}' in {self.status_file}")
+    @classmethod
+    def states(cls) -> voidrip.RipStateStore:
+        if cls._states is None:
+            cls._states = voidrip.RipStateStore(cls.dir["status"] / "rips.sqlite", status_dir=cls.dir["status"])
+        return cls._states
 
-        if artist == '':
-            artist = None
-        if album == '':
-            album = None
+    # the names of all rips with the given status
+    @classmethod
+    def find_by_status(cls, status: RipStatusCode) -> List[Path]:
+        return [Path(rip) for rip in cls.states().query(status.name)]
 
-        return status, artist, album
+    def read_statusfile(self) -> tuple[RipStatusCode, Optional[str], Optional[str]]:
+        state = self.states().get(str(self.name))
+        if state is None:
+            raise FileNotFoundError(f"No status for {self.name}")
+        try:
+            status = RipStatusCode[state.status] if state.status else None
+        except KeyError:
+            raise Exception(f"Invalid status '{state.status}' in {self.status_file}")
+        return status, state.artist, state.album
 
+    # The state is kept in the state store; the status file is written as well, for everything that still reads it.
     def write_statusfile(self, status: Optional[RipStatusCode] = None,
                          artist: Optional[str] = None, album: Optional[str] = None) -> None:
-        try:
-            old_status, old_artist, old_album = self.read_statusfile()
-        except FileNotFoundError:
-            old_status, old_artist, old_album = (RipStatusCode.INITIALIZING, None, None)
-
-        new_status = status if status else old_status
-        new_artist = artist if artist else old_artist
-        new_album  = album  if album  else old_album
-
-        with open(self.status_file, "w") as statusfile:
-            print(new_status.name, file=statusfile)
-            print(new_artist if new_artist else '', file=statusfile)
-            print(new_album  if new_album  else '', file=statusfile)
-
-        return
+        if status is None and self.states().get(str(self.name)) is None:
+            status = RipStatusCode.INITIALIZING
+        state = self.states().update(str(self.name), status=status.name if status else None,
+                                     artist=artist, album=album)
+        voidrip.ripdb.write_status_file(self.status_file, state)
 
     @property
     def status(self) -> RipStatusCode:
@@ -156,6 +187,14 @@ class RipStatus:
     def set_artist_album(self, artist: Optional[str] = None, album: Optional[str] = None) -> None:
         self.write_statusfile(artist=artist, album=album)
 
+    # forget all about this rip, and release its id
+    def discard(self) -> None:
+        with self.disc_ids() as ids:
+            ids.remove(str(self.name))
+        self.states().remove(str(self.name))
+        shutil.rmtree(self._work_dir, ignore_errors=True)
+        self.status_file.unlink(missing_ok=True)
+
     @property
     def work_dir_phase1(self):
         if self._work_dir is None:
@@ -166,33 +205,21 @@ class RipStatus:
     def id_file(self) -> Path:
         return self.dir["status"] / "disc_ids.txt"
 
-    def find_duplicates(self, disc: cd.Disc) -> Optional[List[str]]:
-        with filelock.FileLock(str(self.id_file.with_name(".lock"))):
-            try:
-                with open(self.id_file) as fd:
-                    csvfile = csv.reader(fd, delimiter=" ")
-                    #results = [f[0] for f in fd.readline().split(None, 2) if f[1] == disc.id_musicbrainz()]
-                    #bla = [(f[0],f[1]) for f in csvfile ]
-
-                    results = [f[0] for f in csvfile if f[1] == disc.id_musicbrainz()]
-            except FileNotFoundError:
-                results = []
-
-            if not results:
-                with open(self.id_file, "a") as f:
-                    print(f"{self.name} {disc.id_musicbrainz()}", file=f)
-                return None
-        return results
-
-    def save_id(self, disc: cd.Disc) -> None:
-        with filelock.FileLock(str(self.id_file.with_name(".lock"))):
-            with open(self.id_file, "a") as f:
-                print(f"{self.name} {disc.id_musicbrainz()}", file=f)
-        return None
+    @property
+    def id_db(self) -> Path:
+        return self.dir["status"] / "disc_ids.sqlite"
 
+    def disc_ids(self) -> voidrip.DiscIdStore:
+        # the old text file is imported when the database is created
+        return voidrip.DiscIdStore(self.id_db, legacy_file=self.id_file)
 
-def input_yes_no(prompt: str, default=True) -> bool:
-    answer = input(prompt)
+    # register the disc for this rip, and return the earlier rips of the same disc
+    def register_disc(self, disc: cd.Disc) -> List[str]:
+        with self.disc_ids() as ids:
+            return ids.add(str(self.name), disc)
+
+
+def parse_yes_no(answer: str, default=True) -> bool:
     if len(answer) == 0:
         return default
     first = answer.lower()[0]
@@ -203,68 +230,262 @@ def input_yes_no(prompt: str, default=True) -> bool:
     return default
 
 
-def rip_cd(options: Options) -> None:
-    print(f"using cdrom {options.cdrom}")
-
-    cdplayer = voidrip.CDPlayer(options.cdrom)
-    cdplayer.tray_open()
-
-    input("Insert CD and press Enter...")
-    cdplayer.tray_close()
-
-    print("Waiting for cd...")
-    cdplayer.wait_for_disc()
-    print("Found media")
-
-    rip_status = RipStatus(cdplayer)
-    print(f"CD rip will have number {rip_status.id}")
-
-    print("Reading TOC")
-    disc = cdplayer.get_disc()
-    pprint(disc)
-
-    print("Looking for duplicates...", end="")
-    if duplicates := rip_status.find_duplicates(disc):
-        print(f"\nThis disc seems to have been ripped already as {','.join(duplicates)}")
-        answer = input_yes_no("Do you wish to continue? (no) ", default=False)
-        if not answer:
+@dataclass
+class Question:
+    drive: str
+    prompt: str
+    answer: asyncio.Future[str]
+
+
+# Questions for the operator.  Drives put their questions in the queue and carry on with their work; the questions
+# are asked one at a time, in order, and every answer goes back to the drive that asked.  A drive that doesn't need
+# the answer anymore can cancel the question; the next one is asked right away.
+# There is a single reader of stdin, which gives every line to the question that is being asked (lines typed while
+# there is none are dropped), so a cancelled question doesn't hold on to the next line.
+class OperatorQueue:
+    def __init__(self):
+        self._queue: asyncio.Queue[Question] = asyncio.Queue()
+        self._current: Optional[Question] = None
+        self._buffer = b""
+        self._closed: Optional[asyncio.Future[None]] = None
+
+    def ask(self, drive: str, prompt: str) -> asyncio.Future[str]:
+        answer = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(Question(drive, prompt, answer))
+        return answer
+
+    async def ask_yes_no(self, drive: str, prompt: str, default=True) -> bool:
+        return parse_yes_no(await self.ask(drive, prompt), default)
+
+    def _read_stdin(self) -> None:
+        data = os.read(sys.stdin.fileno(), 4096)
+        if not data:
+            if not self._closed.done():
+                self._closed.set_result(None)
             return
-    else:
-        print("none found")
-    rip_status.save_id(disc)
+        self._buffer += data
+        while b"\n" in self._buffer:
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            question = self._current
+            if question is not None and not question.answer.done():
+                question.answer.set_result(line.decode(errors="replace").rstrip("\r"))
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._closed = loop.create_future()
+        loop.add_reader(sys.stdin.fileno(), self._read_stdin)
+        try:
+            while True:
+                question = await self._queue.get()
+                if question.answer.done():
+                    continue
+                self._current = question
+                print(f"[{question.drive}] {question.prompt}", end="", flush=True)
+                await asyncio.wait({question.answer, self._closed}, return_when=asyncio.FIRST_COMPLETED)
+                self._current = None
+                if self._closed.done():
+                    raise EOFError("stdin was closed")
+                if question.answer.cancelled():
+                    print(f"\n[{question.drive}] (never mind, that was already taken care of)")
+        finally:
+            loop.remove_reader(sys.stdin.fileno())
+
+
+# Ask the operator about the disc.  Returns the artist and album, or None if the rip is to be discarded.
+async def confirm_disc(operator: OperatorQueue, drive: str, disc: voidrip.Disc,
+                       rip_status: RipStatus) -> Optional[Tuple[str, str]]:
+    # the disc id database is on NFS, so it is kept out of the event loop like everything else that blocks
+    if duplicates := await asyncio.to_thread(rip_status.register_disc, disc):
+        answer = await operator.ask_yes_no(drive, f"This disc seems to have been ripped already as "
+                                                  f"{','.join(duplicates)}.  Do you wish to continue? (no) ",
+                                           default=False)
+        if not answer:
+            return None
 
     artist, album = disc.get_performer_title()
     if artist and album:
-        answer = input_yes_no(f"CD claims to be `{album}` by `{artist}`, is that correct? (yes) ", default=True)
+        answer = await operator.ask_yes_no(drive, f"CD claims to be `{album}` by `{artist}`, "
+                                                  f"is that correct? (yes) ", default=True)
         if not answer:
             artist, album = (None, None)
     # get user input, if necessary
     if not (artist and album):
-        print("Please input Artist and Album title manually; this will not be used in actual metadata.")
-        artist = input("Artist: ")
-        album = input("Album title: ")
-    rip_status.set_artist_album(artist=artist, album=album)
+        artist = await operator.ask(drive, "Please input the Artist manually (this will not be used in actual "
+                                           "metadata): ")
+        album = await operator.ask(drive, "Album title: ")
+    return artist, album
+
+
+# Open the tray, and wait until there is a disc in it.
+async def insert_disc(cddrive: voidrip.Drive, operator: OperatorQueue) -> None:
+    drive = cddrive.name
+    await cddrive.open_tray()
+
+    # the operator can either push the tray in, or tell us to close it
+    insert = operator.ask(drive, "Insert CD and press Enter...")
+    closed = asyncio.create_task(cddrive.wait_for(voidrip.DriveState.NO_DISC, voidrip.DriveState.SPINNING_UP,
+                                                  voidrip.DriveState.DISC_OK))
+    await asyncio.wait({insert, closed}, return_when=asyncio.FIRST_COMPLETED)
+    if closed.done():
+        insert.cancel()
+    else:
+        closed.cancel()
+        await cddrive.close_tray()
+
+    print(f"[{drive}] Waiting for cd...")
+    await cddrive.wait_for_disc()
+    print(f"[{drive}] Found media")
+
+
+# Rip a single disc.  Everything that blocks (the drive, icedax, the encoders) runs outside of the event loop, so
+# all drives can be busy at the same time; the cpu-heavy work goes to the pool that is shared by all drives.
+# The drive never waits for the operator: ripping starts as soon as the toc is read, while the questions about the
+# disc are still in the queue.  Once the disc has been read, the drive is free for the next one; the returned task
+# does the rest (encoding, and saving the rip once the operator has answered).
+async def rip_cd(options: Options, cddrive: voidrip.Drive, operator: OperatorQueue,
+                 executor: Optional[Executor] = None) -> Optional[asyncio.Task]:
+    drive = cddrive.name
+    await insert_disc(cddrive, operator)
+
+    # the status dir is on NFS; a slow write there shouldn't hold up the other drives
+    rip_status = await asyncio.to_thread(RipStatus, cddrive.cdplayer)
+    print(f"[{drive}] CD rip will have number {rip_status.id}")
+    rip: Optional[voidrip.AudioRipper] = None
+    reading: Optional[asyncio.Task] = None
+    confirmed: Optional[asyncio.Task] = None
+
+    # release the id (and the work dir and the registration of the disc), so the disc can be ripped again
+    async def discard() -> None:
+        print(f"[{drive}] Discarding rip {rip_status.name}")
+        if rip is not None:
+            rip.abort()
+        if reading is not None:
+            await asyncio.gather(reading, return_exceptions=True)
+        await asyncio.to_thread(rip_status.discard)
+
+    try:
+        print(f"[{drive}] Reading TOC")
+        disc = await cddrive.read_disc()
+        pprint(disc)
+
+        # start the remote lookups now, so they're done by the time the rip is
+        ar_cache = voidrip.AccurateRipCache(ACCURATERIP_CACHE, offline=options.offline)
+        prefetch = await asyncio.to_thread(voidrip.Prefetch, disc, ar_cache=ar_cache,
+                                           musicbrainz=not options.offline)
+
+        print(f"[{drive}] Starting rip")
+        rip = await asyncio.to_thread(voidrip.AudioRipper, disc, rip_status.work_dir_phase1, ar_cache=ar_cache,
+                                      prefetch=prefetch, streaming=options.stream, keep_wav=options.keep_wav,
+                                      executor=executor)
+        reading = asyncio.create_task(asyncio.to_thread(rip.read))
+        confirmed = asyncio.create_task(confirm_disc(operator, drive, disc, rip_status))
+
+        await asyncio.wait({reading, confirmed}, return_when=asyncio.FIRST_COMPLETED)
+        if not (confirmed.done() and confirmed.result() is None):
+            await reading
+    except BaseException:
+        # failed or aborted: nothing of the rip is kept
+        if confirmed is not None:
+            confirmed.cancel()
+        await discard()
+        raise
+
+    if confirmed.done() and confirmed.result() is None:
+        await discard()
+        return None
 
-    print("Starting rip")
-    rip = voidrip.AudioRipper(disc, rip_status.work_dir_phase1)
-    rip.rip()
+    print(f"[{drive}] Disc read")
+    await cddrive.open_tray()
 
-    print("Rip done")
-    rip.save(rip_status.dir[RipStatusCode.RIP_DONE], rip_status.name)
+    async def finish() -> None:
+        try:
+            await asyncio.to_thread(rip.finish)
+            answer = await confirmed
+            if answer is None:
+                await discard()
+                return
+            await asyncio.to_thread(rip_status.set_artist_album, *answer)
+
+            print(f"[{drive}] Rip {rip_status.name} done")
+            await asyncio.to_thread(rip.save, rip_status.dir[RipStatusCode.RIP_DONE], rip_status.name)
+            print(rip.as_json())
+        except Exception as e:
+            confirmed.cancel()
+            print(f"[{drive}] Rip {rip_status.name} failed: {e!r}")
+            await discard()
+
+    return asyncio.create_task(finish())
+
+
+async def run_drive(options: Options, cdrom: Path, operator: OperatorQueue, executor: Executor) -> None:
+    print(f"using cdrom {cdrom}")
+    # rips that are being finished while the drive is already reading the next disc
+    finishing = set()
+    async with voidrip.Drive(voidrip.CDPlayer(cdrom)) as cddrive:
+        while True:
+            try:
+                task = await rip_cd(options, cddrive, operator, executor)
+            except Exception as e:
+                # a failed rip shouldn't take the other drives down
+                print(f"[{cdrom.name}] Rip failed: {e!r}")
+                continue
+            if task is not None:
+                finishing.add(task)
+                task.add_done_callback(finishing.discard)
+
+
+# Measure the read offset of a drive on discs that are in accuraterip, until enough of them agree, and store it.
+# Only a few frames of every track are read, so this takes seconds per disc rather than a full rip.
+async def calibrate_drive(options: Options, cdrom: Path, operator: OperatorQueue,
+                          store: voidrip.DriveOffsetStore) -> None:
+    calibration = voidrip.OffsetCalibration(min_discs=options.calibrate)
+    ar_cache = voidrip.AccurateRipCache(ACCURATERIP_CACHE, offline=options.offline)
+    async with voidrip.Drive(voidrip.CDPlayer(cdrom)) as cddrive:
+        drive = cddrive.name
+        vendor, model = cddrive.cdplayer.get_model()
+        print(f"[{drive}] Calibrating read offset of `{vendor} {model}'")
+        while (offset := calibration.result()) is None:
+            await insert_disc(cddrive, operator)
+            try:
+                disc = await cddrive.read_disc()
+                with tempfile.TemporaryDirectory(prefix="calibrate_") as tmp:
+                    ripper = voidrip.AudioRipper(disc, tmp, ar_cache=ar_cache)
+                    measured = await asyncio.to_thread(ripper.measure_offset)
+            except Exception as e:
+                print(f"[{drive}] Measurement failed: {e!r}")
+                continue
+            calibration.add(measured)
+            print(f"[{drive}] Measured offset {measured}; {calibration}")
+        await cddrive.open_tray()
 
-    print(rip.as_json())
-    cdplayer.tray_open()
+    store.set(vendor, model, offset, discs=len(calibration.measurements))
+    print(f"[{drive}] Read offset of `{vendor} {model}' is {offset:+d}; saved to {store.path}")
 
-    return
 
+async def run(options: Options) -> None:
+    operator = OperatorQueue()
+    if options.calibrate is not None:
+        questions = asyncio.create_task(operator.run())
+        try:
+            await asyncio.gather(*(calibrate_drive(options, cdrom, operator, voidrip.CDPlayer.offset_store)
+                                   for cdrom in options.cdroms))
+        finally:
+            questions.cancel()
+        return
 
-def main():
-    options = parse_args()
+    # the worker processes (encoders, checksums) are shared by all drives, and reused for all discs
+    with ProcessPoolExecutor(max_workers=options.jobs) as executor:
+        await asyncio.gather(operator.run(),
+                             *(run_drive(options, cdrom, operator, executor) for cdrom in options.cdroms))
 
-    while True:
-        rip_cd(options)
 
-    # return
+def main():
+    options = parse_args()
+    if ACCURATERIP_OFFSETS.exists():
+        voidrip.CDPlayer.load_offsets(ACCURATERIP_OFFSETS)
+    # offsets of the drives that were calibrated here, before the built-in list
+    voidrip.CDPlayer.offset_store = voidrip.DriveOffsetStore.load(DRIVE_OFFSETS)
+    asyncio.run(run(options))
 
 
 if __name__ == '__main__':
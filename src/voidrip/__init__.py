@@ -1,7 +1,13 @@
 
 from .cdplayer import CDPlayer
+from .drive import Drive, DriveState
 from .cd import Disc, Track
 from .audioripper import AudioRipper
+from .accuraterip import AccurateRip, AccurateRipCache
+from .arlookup import AccurateRipClient
+from .prefetch import Prefetch
+from .ripdb import DiscIdStore, RipIdCounter, RipStateStore
+from .driveoffsets import DriveOffsetStore, OffsetCalibration
 from . import flow
 
 
@@ -19,17 +19,30 @@
 # from os import PathLike
 from __future__ import annotations
 
+import array
+import collections
+import itertools
+import operator
+import os
+import sys
+import threading
+import time
+import urllib.error
 import urllib.request
 import struct
+from datetime import timedelta
 from dataclasses import dataclass, field
 from os import PathLike
-from pathlib import PosixPath
-from typing import Dict, Tuple, Optional, List
-
-import audiotools
-import audiotools.accuraterip
+from pathlib import Path, PurePosixPath
+from concurrent.futures import Executor, Future
+from typing import Dict, Tuple, Optional, List, Sequence, Iterable, Union, TYPE_CHECKING
 
+from . import arnative
 from . import cd
+from . import pcm
+
+if TYPE_CHECKING:
+    from .arlookup import AccurateRipLookup
 
 
 # notes:
@@ -62,15 +75,24 @@ class AccurateRipID:
         }
         return self.__dict__ | extra
 
+    # location of the entry relative to the root of the accuraterip database
     @property
-    def url(self):
+    def path(self) -> PurePosixPath:
         i1 = f"{self.id1:08x}"
-        return f"{self.BASEURL}/{i1[-1]}/{i1[-2]}/{i1[-3]}/{self.id}.bin"
+        return PurePosixPath(i1[-1], i1[-2], i1[-3], f"{self.id}.bin")
+
+    @property
+    def url(self):
+        return f"{self.BASEURL}/{self.path}"
 
 
 AccurateRipTrackID1 = int
 AccurateRipTrackID2 = int
+# crc of the single frame 450 of a track, that is in the database to find the offset of a rip
+AccurateRipFrame450CRC = int
 AccurateRipConfidence = int
+# the accuraterip database contains a separate entry for every pressing of a disc; these are numbered from 0
+AccurateRipPressing = int
 
 
 # note: tracks are 1-based (first track is track 1)
@@ -78,9 +100,17 @@ AccurateRipConfidence = int
 class AccurateRipResults:
     id: AccurateRipID
     track: Dict[int, Dict[AccurateRipTrackID, AccurateRipConfidence]] = field(init=False)
+    # per track: crc1 -> list of (confidence, pressing) of all entries with that crc
+    index: Dict[int, Dict[AccurateRipTrackID1, List[Tuple[AccurateRipConfidence, AccurateRipPressing]]]] = \
+        field(init=False, repr=False)
+    # per track: frame 450 crc -> list of (confidence, pressing) of all entries with that crc
+    index450: Dict[int, Dict[AccurateRipFrame450CRC, List[Tuple[AccurateRipConfidence, AccurateRipPressing]]]] = \
+        field(init=False, repr=False)
 
     def __post_init__(self):
         self.track = {i: {} for i in range(1, self.id.num_tracks + 1)}
+        self.index = {i: {} for i in range(1, self.id.num_tracks + 1)}
+        self.index450 = {i: {} for i in range(1, self.id.num_tracks + 1)}
 
     @classmethod
     def parse_accuraterip_bin(cls, bin_data: bytes, orig_id: AccurateRipID) -> AccurateRipResults:
@@ -89,17 +119,19 @@ class AccurateRipResults:
         results = cls(id=orig_id)
 
         pos = 0
+        pressing = 0
         while pos < len(bin_data):
             accuraterip_id = AccurateRipID(*struct.unpack("<BIII", bin_data[pos:pos + 13]))
             if accuraterip_id != orig_id:
                 raise AccurateRipException(f"Mismatch in returned accurateripid: {accuraterip_id}!={orig_id}")
 
-            # print(accuraterip_id)
+            # per track: confidence, crc of the track, crc of frame 450
             it = struct.iter_unpack("<BII", bin_data[pos + 13:pos + 13 + 9 * accuraterip_id.num_tracks])
             for i, track in enumerate(it):
                 # print(f" --> {i+1} - {track}")
-                results.add_track(i + 1, crc1=track[1], crc2=track[2], confidence=track[0])
+                results.add_track(i + 1, crc1=track[1], crc450=track[2], confidence=track[0], pressing=pressing)
             pos += 13 + 9 * accuraterip_id.num_tracks
+            pressing += 1
 
         return results
 
@@ -126,13 +158,17 @@ class AccurateRipResults:
         return
 
     # add_track uses cd track numbers (first track==1)
-    def add_track(self, track_no: cd.TrackNr, crc1: AccurateRipTrackID1, crc2: AccurateRipTrackID2,
-                  confidence: AccurateRipConfidence
+    def add_track(self, track_no: cd.TrackNr, crc1: AccurateRipTrackID1, crc450: AccurateRipFrame450CRC,
+                  confidence: AccurateRipConfidence, pressing: AccurateRipPressing = 0
                   ) -> None:
         if track_no < 1 or track_no > self.id.num_tracks:
             raise AccurateRipException(f"Invalid track number {track_no}")
-        track_id = AccurateRipTrackID(crc1, crc2)
+        track_id = AccurateRipTrackID(crc1, crc450)
         self[track_no][track_id] = confidence
+        self.index[track_no].setdefault(crc1, []).append((confidence, pressing))
+        # tracks that are too short to have a frame 450 have a crc of 0
+        if crc450 != 0:
+            self.index450[track_no].setdefault(crc450, []).append((confidence, pressing))
         return
 
     def get_track_crc1(self, track_no: cd.TrackNr) -> List[Tuple[AccurateRipTrackID1, AccurateRipConfidence]]:
@@ -145,26 +181,337 @@ class AccurateRipResults:
         except KeyError:
             return None
 
+    # all (confidence, pressing) entries for a track that have the specified crc
+    def find_crc1(self, track: int, crc1: AccurateRipTrackID1) -> List[Tuple[AccurateRipConfidence,
+                                                                             AccurateRipPressing]]:
+        if track < 1 or track > self.id.num_tracks:
+            raise AccurateRipException(f"Invalid track number {track}")
+        return self.index[track].get(crc1, [])
+
+
+@dataclass(frozen=True)
+class AccurateRipMatch:
+    track: cd.TrackNr
+    offset: int
+    crc: AccurateRipTrackID1
+    version: int
+    confidence: AccurateRipConfidence
+    pressing: AccurateRipPressing
+
 
 @dataclass(frozen=True)
 class AccurateRipTrackID:
     crc1: AccurateRipTrackID1
-    crc2: AccurateRipTrackID2
+    crc450: AccurateRipFrame450CRC
 
     def __repr__(self) -> str:
-        return f"({self.crc1:08x},{self.crc2:08x})"
+        return f"({self.crc1:08x},{self.crc450:08x})"
+
+
+def pcm_samples(data: Union[bytes, bytearray, memoryview]) -> Sequence[int]:
+    # interpret 16-bit stereo little-endian PCM data as a sequence of 32-bit samples (right<<16 | left),
+    # which is what the accuraterip checksums are calculated on.  On little-endian machines this is free.
+    if sys.byteorder == "little":
+        return memoryview(data).cast("B").cast("I")
+    samples = array.array("I", bytes(data))
+    samples.byteswap()
+    return samples
+
+
+# Calculates the accuraterip v1 checksum of a single track at every offset in [min_offset, max_offset] and
+# the v2 checksum at a few selected offsets.
+#
+# The v1 checksum at offset k is sum((j+1) * x[k+j]) over the samples j of the track (excluding the skipped
+# samples of the first and last track), modulo 2^32.  Going from offset k to k+1 only shifts the weights by one,
+# so the checksum at k+1 follows from the checksum at k and the running (unweighted) sum of the window:
+#   S(k+1) = S(k) - T(k) - a*x[k+a] + b*x[k+b]
+#   T(k+1) = T(k) - x[k+a] + x[k+b]
+# where [a, b) is the range of samples that is included in the checksum.  We only need to calculate S and T for
+# the lowest offset and to remember the samples at the edges of the window; every extra offset is O(1).
+#
+# The v2 checksum adds the high 32 bits of every product to the sum, which doesn't shift along with the weights,
+# so those can only be calculated per offset.
+#
+# Samples are fed with their position relative to the start of the track; samples that are never fed
+# (before the start or after the end of the disc) count as silence.
+class TrackChecksum:
+    SKIP_SAMPLES_FIRST = 5 * 588 - 1
+    SKIP_SAMPLES_LAST = 5 * 588
+
+    def __init__(self, length: int, is_first: bool, is_last: bool, min_offset: int, max_offset: int,
+                 v2_offsets: Iterable[int] = (0,)):
+        if max_offset < min_offset:
+            raise AccurateRipException(f"Invalid offset range {min_offset}..{max_offset}")
+
+        self.min_offset = min_offset
+        self.max_offset = max_offset
+        # range [a, b) of samples in the track that are included in the checksum
+        self._a = self.SKIP_SAMPLES_FIRST if is_first else 0
+        self._b = length - self.SKIP_SAMPLES_LAST if is_last else length
+
+        # weighted and plain sum of the window at min_offset
+        self._sum_weighted = 0
+        self._sum = 0
+        # samples that enter and leave the window when we roll from min_offset to max_offset
+        self._head = [0] * (max_offset - min_offset)
+        self._tail = [0] * (max_offset - min_offset)
+        # sum of the high words of the products, per v2 offset
+        self._sum_high: Dict[int, int] = {k: 0 for k in v2_offsets}
+
+    # range of positions (relative to the start of the track) of the samples we need to see
+    @property
+    def start(self) -> int:
+        return self.min_offset + self._a
+
+    @property
+    def end(self) -> int:
+        return self.max_offset + max(self._b, self._a)
+
+    def update(self, samples: Sequence[int], pos: int) -> None:
+        end = pos + len(samples)
+
+        # the window at the lowest offset
+        lo, hi = max(pos, self.min_offset + self._a), min(end, self.min_offset + self._b)
+        if lo < hi:
+            chunk = samples[lo - pos:hi - pos]
+            weight = lo - self.min_offset + 1
+            self._sum_weighted += sum(map(operator.mul, range(weight, weight + len(chunk)), chunk))
+            self._sum += sum(chunk)
+
+        # edges of the window
+        for edge, base in ((self._head, self.min_offset + self._a), (self._tail, self.min_offset + self._b)):
+            lo, hi = max(pos, base), min(end, base + len(edge))
+            if lo < hi:
+                edge[lo - base:hi - base] = samples[lo - pos:hi - pos]
+
+        # v2 checksums
+        for k in self._sum_high:
+            lo, hi = max(pos, k + self._a), min(end, k + self._b)
+            if lo < hi:
+                weight = lo - k + 1
+                products = map(operator.mul, range(weight, weight + hi - lo), samples[lo - pos:hi - pos])
+                self._sum_high[k] += sum(map(operator.rshift, products, itertools.repeat(32)))
+
+    def checksums_v1(self) -> Dict[int, AccurateRipTrackID1]:
+        a, b = self._a, self._b
+        crc = self._sum_weighted & 0xffffffff
+        total = self._sum & 0xffffffff
+        checksums = {self.min_offset: crc}
+        for i, (head, tail) in enumerate(zip(self._head, self._tail), self.min_offset + 1):
+            crc = (crc - total - a * head + b * tail) & 0xffffffff
+            total = (total - head + tail) & 0xffffffff
+            checksums[i] = crc
+        return checksums
+
+    def checksums_v2(self) -> Dict[int, AccurateRipTrackID2]:
+        v1 = self.checksums_v1()
+        return {k: (v1[k] + high) & 0xffffffff for k, high in self._sum_high.items() if k in v1}
+
+
+@dataclass
+class TrackWindow:
+    track: cd.Track
+    # range of samples in the disc image [start, end) that is needed to calculate the checksums of all offsets
+    start: int
+    end: int
+    checksummer: TrackChecksum
+
+
+# calculates the checksums of a number of tracks (at all offsets) in a single sequential pass over the disc image
+# every chunk of samples is fed to the checksummers of all tracks whose window covers them; near the track
+# boundaries, this means that the same samples end up in the windows of both neighbouring tracks
+class DiscChecksum:
+    BYTES_PER_SAMPLE = 4
+    CHUNK_SAMPLES = 75 * 588  # 1 second
+
+    def __init__(self, tracks: List[cd.Track], previous_samples: int, next_samples: int,
+                 v2_offsets: Iterable[int] = (0,), start: Optional[int] = None):
+        self._windows: List[TrackWindow] = []
+        for track in tracks:
+            checksummer = TrackChecksum(
+                length=track.length_samples,
+                is_first=track.is_first,
+                is_last=track.is_last,
+                min_offset=-previous_samples,
+                max_offset=next_samples,
+                v2_offsets=v2_offsets
+            )
+            self._windows.append(TrackWindow(track, track.first_sample + checksummer.start,
+                                             track.first_sample + checksummer.end, checksummer))
+
+        # position in the disc image of the next sample that is expected in update()
+        # by default, the caller only feeds the part of the image that is actually needed, but a stream can also
+        # just start at the start of the image
+        self._pos = start if start is not None else self.first_sample
+
+    @property
+    def first_sample(self) -> int:
+        return max(0, min(w.start for w in self._windows))
+
+    @property
+    def last_sample(self) -> int:
+        return max(w.end for w in self._windows)
+
+    def update(self, data: Union[bytes, bytearray, memoryview]) -> None:
+        samples = pcm_samples(data)
+        chunk_start = self._pos
+        chunk_end = self._pos + len(samples)
+
+        for window in self._windows:
+            start = max(window.start, chunk_start)
+            end = min(window.end, chunk_end)
+            if start < end:
+                window.checksummer.update(samples[start - chunk_start:end - chunk_start],
+                                          start - window.track.first_sample)
+
+        self._pos = chunk_end
+
+    # samples beyond the end of the image are silence, so they don't need to be fed
+    def finish(self) -> Dict[cd.TrackNr, Dict[int, AccurateRipTrackID1]]:
+        return {w.track.num: w.checksummer.checksums_v1() for w in self._windows}
+
+    def finish_v2(self) -> Dict[cd.TrackNr, Dict[int, AccurateRipTrackID2]]:
+        return {w.track.num: w.checksummer.checksums_v2() for w in self._windows}
+
+
+# The crc of frame 450 of a track, at every offset in [-max_offset, max_offset].  This is the same weighted sum as the
+# track checksum, but over a single frame, so for a wide range of offsets only a few thousand samples are needed.
+# The image doesn't need to be the whole disc; image_start is the position on the disc of its first sample.
+def frame450_checksums(image: pcm.PCMView, track: cd.Track, frame: int, max_offset: int,
+                       image_start: int = 0) -> Dict[int, AccurateRipFrame450CRC]:
+    frame_start = track.first_sample + frame * cd.CDA_SAMPLES_PER_FRAME
+    checksummer = TrackChecksum(cd.CDA_SAMPLES_PER_FRAME, False, False, -max_offset, max_offset, ())
+    start = max(frame_start + checksummer.start, image_start)
+    data = image.read(start - image_start, frame_start + checksummer.end - image_start)
+    checksummer.update(pcm_samples(data), start - frame_start)
+    return checksummer.checksums_v1()
+
+
+# Local copy of the accuraterip database.
+# Entries are stored in the same directory layout as on the accuraterip server (see AccurateRipID.path), so a
+# plain mirror of (part of) the database can be used as a cache, and vice versa.  Discs that are not in the
+# database are remembered by an empty "<id>.bin.missing" file.  In offline mode, the network is never used, and
+# expired entries are used anyway.
+class AccurateRipCache:
+    DEFAULT_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"), "voidrip", "accuraterip")
+    MISSING_SUFFIX = ".missing"
+
+    def __init__(self, directory: Optional[PathLike] = None,
+                 ttl: Optional[timedelta] = timedelta(days=30),
+                 negative_ttl: Optional[timedelta] = timedelta(days=1),
+                 offline: bool = False,
+                 base_url: str = AccurateRipID.BASEURL):
+        self.directory = Path(directory) if directory is not None else self.DEFAULT_DIR
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.offline = offline
+        self.base_url = base_url
+
+    def path(self, accuraterip_id: AccurateRipID) -> Path:
+        return self.directory / accuraterip_id.path
+
+    def path_missing(self, accuraterip_id: AccurateRipID) -> Path:
+        path = self.path(accuraterip_id)
+        return path.with_name(path.name + self.MISSING_SUFFIX)
+
+    def url(self, accuraterip_id: AccurateRipID) -> str:
+        return f"{self.base_url}/{accuraterip_id.path}"
+
+    def _is_fresh(self, path: Path, ttl: Optional[timedelta]) -> bool:
+        if self.offline or ttl is None:
+            return True
+        return time.time() - path.stat().st_mtime < ttl.total_seconds()
+
+    # returns the cached entry, or None if the disc is known not to be in the database
+    # raises KeyError if the disc is not in the cache (or the cached entry has expired)
+    def get(self, accuraterip_id: AccurateRipID) -> Optional[bytes]:
+        path = self.path(accuraterip_id)
+        if path.exists() and self._is_fresh(path, self.ttl):
+            return path.read_bytes()
+        path = self.path_missing(accuraterip_id)
+        if path.exists() and self._is_fresh(path, self.negative_ttl):
+            return None
+        raise KeyError(accuraterip_id.id)
+
+    # store an entry in the cache; None means the disc is not in the database
+    def put(self, accuraterip_id: AccurateRipID, data: Optional[bytes]) -> None:
+        path = self.path(accuraterip_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if data is None:
+            self.path_missing(accuraterip_id).touch()
+            return
+
+        # write atomically, so concurrent readers never see a partial file; the temporary file is per thread, as the
+        # same entry can be stored by several drives at once
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            tmp.write_bytes(data)
+            tmp.replace(path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        self.path_missing(accuraterip_id).unlink(missing_ok=True)
+
+    def download(self, accuraterip_id: AccurateRipID) -> Optional[bytes]:
+        try:
+            with urllib.request.urlopen(self.url(accuraterip_id)) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise AccurateRipException(f"Couldn't fetch accuraterip entry: {e.code}: {e.reason}")
+        except urllib.error.URLError as e:
+            # file:// urls (local mirrors) report missing entries like this
+            if isinstance(e.reason, FileNotFoundError):
+                return None
+            raise AccurateRipException(f"Couldn't fetch accuraterip entry: {e.reason}")
+
+    # fetch an entry from the cache or, if necessary and allowed, from the accuraterip server
+    def fetch(self, accuraterip_id: AccurateRipID) -> Optional[bytes]:
+        try:
+            return self.get(accuraterip_id)
+        except KeyError:
+            pass
+        if self.offline:
+            return None
+        data = self.download(accuraterip_id)
+        self.put(accuraterip_id, data)
+        return data
 
 
 class AccurateRip:
-    # BINARY = PosixPath("/home/bas/NerdProjecten/cdrip/accuraterip/accuraterip")
-    BINARY = PosixPath("/home/bas/pycharm/cdrip/accuraterip/accuraterip")
+    # Checksums at a single offset can be calculated by the C implementation in accuraterip/ ("native", see arnative),
+    # or in python ("python").  The native backend falls back to python if the library hasn't been built.
+    BACKENDS = ("native", "python")
+    CHECKSUM_BACKEND = "native"
     PREVIOUS_TRACK_FRAMES = (5880 // 2)
     NEXT_TRACK_FRAMES = (5880 // 2)
-
-    def __init__(self, disc: cd.Disc, wav_file: PathLike):
+    # offsets at which the (more expensive) v2 checksums are calculated
+    V2_OFFSETS = (0,)
+    # the frame of which the database has a separate crc, and the range of offsets in which we look for it
+    FRAME450 = 450
+    FRAME450_MAX_OFFSET = 10 * 588
+
+    def __init__(self, disc: cd.Disc, wav_file: Optional[PathLike], cache: Optional[AccurateRipCache] = None,
+                 prefetched: Optional[Future[AccurateRipLookup]] = None, checksum: Optional[DiscChecksum] = None,
+                 backend: Optional[str] = None):
+        backend = backend if backend is not None else self.CHECKSUM_BACKEND
+        if backend not in self.BACKENDS:
+            raise AccurateRipException(f"Unknown checksum backend `{backend}'")
+        self._backend = backend
         self._ar_results: Optional[AccurateRipResults] = None
-        if not self.BINARY.exists():
-            raise FileNotFoundError(f"Cannot find accuraterip binary at f{self.BINARY}")
+        self._cache = cache if cache is not None else AccurateRipCache()
+        # lookup that was started in the background when the disc was inserted (see Prefetch)
+        self._prefetched = prefetched
+        self._checksums: Optional[Dict[cd.TrackNr, Dict[int, AccurateRipTrackID1]]] = None
+        self._checksums_v2: Optional[Dict[cd.TrackNr, Dict[int, AccurateRipTrackID2]]] = None
+        self._offsets_by_crc: Dict[cd.TrackNr, Dict[int, List[Tuple[int, int]]]] = {}
+        # the only offset at which the checksums are calculated, if the frame 450 crcs have found one
+        self._checksum_offset: Optional[int] = None
+        # checksums that were already calculated while the disc was being ripped
+        if checksum is not None:
+            self._checksums = checksum.finish()
+            self._checksums_v2 = checksum.finish_v2()
         self._disc = disc
         self._wav = wav_file
 
@@ -178,89 +525,259 @@ class AccurateRip:
             self.ar_lookup()
         return self._ar_results
 
-    def checksum_disc(self) -> Dict[cd.TrackNr, Dict[AccurateRipConfidence, AccurateRipTrackID1]]:
-        return self.checksum_disc_audiotools()
+    # checksums of all tracks at all offsets; calculated in a single pass over the image on first access
+    @property
+    def checksums(self) -> Dict[cd.TrackNr, Dict[int, AccurateRipTrackID1]]:
+        if self._checksums is None:
+            self.checksum_disc()
+        return self._checksums
 
-    def checksum_track(self, track: cd.Track) -> Dict[int, AccurateRipTrackID1]:
-        return self._checksum_track_audiotools(track)
-
-    def _checksum_track_audiotools(self, track: cd.Track) -> Dict[int, AccurateRipTrackID1]:
-        file = audiotools.open(self._wav)
-        # just doublechecking
-        if not isinstance(file, audiotools.WaveAudio) \
-           or not file.supports_to_pcm() \
-           or file.channels() != 2 \
-           or file.sample_rate() != cd.CDA_SAMLES_PER_SEC \
-           or file.bits_per_sample() != cd.CDA_BITS_PER_SAMPLE:
-            raise AccurateRipException("Input file doesn't look like a CDA rip")
-
-        # most of this is taken from https://github.com/tuffy/python-audio-tools/blob/master/trackverify#L244
-        reader = file.to_pcm()
-        if not hasattr(reader, "seek") or not callable(reader.seek):
-            raise AccurateRipException("Can't seek in file")
-
-        # we start reading a bit before the track, in order to try out different offsets for the accuraterip checksums
-        # the reader below will take care of padding if this is negative
-        offset = track.first_sample - self.PREVIOUS_TRACK_FRAMES
-
-        if offset > 0:
-            offset -= reader.seek(offset)
-
-        checksummer = audiotools.accuraterip.Checksum(
-            total_pcm_frames=track.length_samples,
-            sample_rate=cd.CDA_SAMLES_PER_SEC,
-            is_first=track.is_first,
-            is_last=track.is_last,
-            pcm_frame_range=self.PREVIOUS_TRACK_FRAMES + 1 + self.NEXT_TRACK_FRAMES,
-            accurateripv2_offset=self.PREVIOUS_TRACK_FRAMES
-        )
+    @property
+    def checksums_v2(self) -> Dict[cd.TrackNr, Dict[int, AccurateRipTrackID2]]:
+        if self._checksums_v2 is None:
+            self.checksum_disc()
+        return self._checksums_v2
 
-        window_reader = audiotools.PCMReaderWindow(
-            reader, offset,
-            self.PREVIOUS_TRACK_FRAMES + track.length_samples + self.NEXT_TRACK_FRAMES
-        )
+    # a checksum state for all tracks of a disc, that can be fed with the disc image as it is being ripped
+    @classmethod
+    def disc_checksum(cls, disc: cd.Disc, start: Optional[int] = None) -> DiscChecksum:
+        return DiscChecksum(disc.tracks, cls.PREVIOUS_TRACK_FRAMES, cls.NEXT_TRACK_FRAMES, cls.V2_OFFSETS, start)
+
+    # Calculate the checksums of all tracks.  If the frame 450 crcs tell at which offset the disc is in the image,
+    # only that offset is checksummed; otherwise all offsets in the default range are.  Tracks that don't match at
+    # the frame 450 offset (which may be that of another pressing, or the track may be partly bad) are checksummed
+    # at all offsets as well, so they are found wherever they match.
+    def checksum_disc(self, executor: Optional[Executor] = None) -> Dict[cd.TrackNr, Dict[int, AccurateRipTrackID1]]:
+        self._checksum_offset = self.find_offset_frame450()
+        # at a single offset, the C implementation takes a fraction of a second per track; not worth sending to the
+        # pool.  Tracks that it can't do (not entirely in the image) are done in python.
+        self._checksums, self._checksums_v2 = {}, {}
+        remaining = self._update_tracks_native(self._disc.tracks)
+        if remaining:
+            self._update_checksums(self._checksum_image(remaining, self._checksum_offset, executor))
+        unmatched = self._unmatched_tracks(self._disc.tracks)
+        if unmatched:
+            nums = ', '.join(str(t.num) for t in unmatched)
+            print(f"  No match at offset {self._checksum_offset} for track(s) {nums}, checksumming them at all offsets")
+            self._update_checksums(self._checksum_image(unmatched, None, executor))
+        self._offsets_by_crc = {}
+        return self._checksums
+
+    def _checksum_image(self, tracks: List[cd.Track], offset: Optional[int],
+                        executor: Optional[Executor] = None) -> DiscChecksum:
+        if executor is not None:
+            # checksumming is cpu-bound, so it can be left to a pool of worker processes
+            return executor.submit(self.checksum_image, tracks, self._wav, offset).result()
+        return self.checksum_image(tracks, self._wav, offset)
+
+    # add the checksums to those that were already calculated for the same tracks (at other offsets)
+    def _update_checksums(self, checksum: DiscChecksum) -> None:
+        for checksums, new in ((self._checksums, checksum.finish()), (self._checksums_v2, checksum.finish_v2())):
+            for track, crcs in new.items():
+                checksums.setdefault(track, {}).update(crcs)
+
+    # the tracks that have only been checksummed at the frame 450 offset, and don't match the database there
+    def _unmatched_tracks(self, tracks: List[cd.Track]) -> List[cd.Track]:
+        if self._checksum_offset is None or self.ar_results is None:
+            return []
+        return [
+            t for t in tracks
+            if not self.ar_results.index[t.num].keys() & {*self._checksums[t.num].values(),
+                                                          *self._checksums_v2[t.num].values()}
+        ]
+
+    # The checksums of a track, at all offsets in the default range, or only at the offset of the disc in the image
+    # once that is known; then the native backend can do it.
+    def checksum_track(self, track: cd.Track) -> Dict[int, AccurateRipTrackID1]:
+        native = self._checksum_track_native(track)
+        if native is not None:
+            return {self._checksum_offset: native[0]}
+        return self._checksum_tracks([track]).finish()[track.num]
+
+    # v1 and v2 checksum of a track at the offset of the disc in the image, by the C implementation; None if that
+    # can't be used (not selected or not built, offset unknown, or the track isn't entirely in the image)
+    def _checksum_track_native(self, track: cd.Track) -> Optional[Tuple[AccurateRipTrackID1, AccurateRipTrackID2]]:
+        if self._backend != "native" or self._checksum_offset is None or not arnative.available():
+            return None
+        start = track.first_sample + self._checksum_offset
+        with pcm.PCMView(self._wav) as image:
+            if start < 0 or start + track.length_samples > len(image):
+                return None
+            return self._checksum_native(track, image.read(start, start + track.length_samples))
+
+    # Store the checksums of the tracks that the native backend can do; returns the ones that are left.
+    def _update_tracks_native(self, tracks: List[cd.Track]) -> List[cd.Track]:
+        remaining = []
+        for track in tracks:
+            native = self._checksum_track_native(track)
+            if native is None:
+                remaining.append(track)
+                continue
+            self._checksums[track.num] = {self._checksum_offset: native[0]}
+            self._checksums_v2[track.num] = {self._checksum_offset: native[1]}
+        return remaining
+
+    def _checksum_native(self, track: cd.Track, data: Union[bytes, bytearray, memoryview]
+                         ) -> Optional[Tuple[AccurateRipTrackID1, AccurateRipTrackID2]]:
+        try:
+            return arnative.checksum(data, track.is_first, track.is_last)
+        except arnative.ArNativeException:
+            return None
 
-        audiotools.transfer_data(window_reader.read, checksummer.update)
+    # recalculate the checksums of some tracks, after they have been replaced in the image
+    def update_tracks(self, tracks: List[cd.Track]) -> None:
+        remaining = self._update_tracks_native(tracks)
+        if remaining:
+            checksum = self._checksum_tracks(remaining)
+            self.checksums.update(checksum.finish())
+            self.checksums_v2.update(checksum.finish_v2())
+        unmatched = self._unmatched_tracks(tracks)
+        if unmatched:
+            self._update_checksums(self._checksum_image(unmatched, None))
+        for track in tracks:
+            self._offsets_by_crc.pop(track.num, None)
+
+    # Confidence of a separately ripped track, that contains exactly the samples of the track (that is: it has
+    # been ripped with the right offset correction).
+    def verify_track(self, track: cd.Track, data: Union[bytes, bytearray, memoryview]) -> AccurateRipConfidence:
+        if self.ar_results is None:
+            return 0
+        native = None
+        size = track.length_samples * DiscChecksum.BYTES_PER_SAMPLE
+        if self._backend == "native" and memoryview(data).nbytes >= size:
+            # pass the data as is if it is exactly the track, so bytes don't need to be copied
+            native = self._checksum_native(track, data if memoryview(data).nbytes == size
+                                           else memoryview(data).cast("B")[:size])
+        if native is not None:
+            crcs = set(native)
+        else:
+            checksummer = TrackChecksum(track.length_samples, track.is_first, track.is_last, 0, 0, (0,))
+            checksummer.update(pcm_samples(data)[:track.length_samples], 0)
+            crcs = {checksummer.checksums_v1()[0], checksummer.checksums_v2()[0]}
+        return max((confidence for crc in crcs for confidence, _ in self.ar_results.find_crc1(track.num, crc)),
+                   default=0)
 
-        checksums_v1 = checksummer.checksums_v1()
+    def _checksum_tracks(self, tracks: List[cd.Track]) -> DiscChecksum:
+        return self.checksum_image(tracks, self._wav, self._checksum_offset)
 
-        crc1_by_offset: Dict[int, AccurateRipTrackID1] = {
-            i: AccurateRipTrackID1(c) for i, c in enumerate(checksums_v1, -self.PREVIOUS_TRACK_FRAMES)
-        }
+    # Calculate the checksums of tracks from a disc image, at all offsets in the default range or at a single one.
+    # This doesn't need an AccurateRip object, so it can be run on a pool of worker processes.
+    @classmethod
+    def checksum_image(cls, tracks: List[cd.Track], wav_file: PathLike, offset: Optional[int] = None) -> DiscChecksum:
+        if offset is None:
+            checksum = DiscChecksum(tracks, cls.PREVIOUS_TRACK_FRAMES, cls.NEXT_TRACK_FRAMES, cls.V2_OFFSETS)
+        else:
+            checksum = DiscChecksum(tracks, -offset, offset, (offset,))
 
-        return crc1_by_offset
+        # read the part of the image that is covered by the tracks in one sequential pass
+        with pcm.PCMView(wav_file) as image:
+            for chunk in image.chunks(checksum.first_sample, checksum.last_sample, DiscChecksum.CHUNK_SAMPLES):
+                checksum.update(chunk)
 
-    def checksum_disc_audiotools(self) -> Dict[cd.TrackNr, Dict[AccurateRipConfidence, AccurateRipTrackID1]]:
-        results_by_track = {t.num: self.checksum_track(track=t) for t in self._disc.tracks}
-        return results_by_track
+        return checksum
 
     def ar_lookup(self) -> None:
         accuraterip_id = self._disc.id_accuraterip()
 
         #print(f"Fetching {accuraterip_id.url}")
         print("  Looking up disc in accuraterip database... ", end='')
-        response = urllib.request.urlopen(accuraterip_id.url)
-        if response.status == 200:
+
+        if self._prefetched is not None:
+            lookup = self._prefetched.result()
+            self._prefetched = None
+            if lookup.error is None:
+                print("found!" if lookup.found else "not found :(")
+                self._ar_results = lookup.results
+                return
+            # background lookup failed; try again
+            print(f"prefetch failed ({lookup.error}), retrying... ", end='')
+
+        data = self._cache.fetch(accuraterip_id)
+        if data is not None:
             print("found!")
-            self._ar_results = AccurateRipResults.parse_accuraterip_bin(response.read(), accuraterip_id)
-        elif response.status == 404:
+            self._ar_results = AccurateRipResults.parse_accuraterip_bin(data, accuraterip_id)
+        else:
             print("not found :(")
             self._ar_results = None
-        else:
-            raise AccurateRipException(f"Couldn't fetch accuraterip entry: {response.status}: {response.reason}")
 
-    def find_confidence_track(self, track: cd.TrackNr) -> Tuple[AccurateRipConfidence, int]:
-        # list of (crc1,confidence) tuples
-        ar_crcs = self.ar_results.get_track_crc1(track)
-        # dict of {offset: crc1} pairs
-        track_crcs = self.checksum_track(self._disc.tracks[track-1])
+    # the tracks that have a frame 450 crc in the database
+    def frame450_tracks(self) -> List[cd.Track]:
+        if self.ar_results is None:
+            return []
+        return [t for t in self._disc.tracks if self.ar_results.index450[t.num] and t.length > self.FRAME450]
+
+    # The offset at which the disc is in the image, found with the frame 450 crcs of the database.
+    def find_offset_frame450(self) -> Optional[int]:
+        if self.ar_results is None or self._wav is None:
+            return None
+        with pcm.PCMView(self._wav) as image:
+            crcs = {t.num: frame450_checksums(image, t, self.FRAME450, self.FRAME450_MAX_OFFSET)
+                    for t in self.frame450_tracks()}
+        return self.match_offset_frame450(crcs)
+
+    # Find the offset at which the frame 450 crcs of the tracks (per track: offset -> crc) match the database.  The
+    # offset that matches on most tracks wins (and on a tie, the one with the highest confidence).
+    def match_offset_frame450(self, crcs: Dict[cd.TrackNr, Dict[int, AccurateRipFrame450CRC]]) -> Optional[int]:
+        if self.ar_results is None:
+            return None
 
-        for ar_crc1, confidence in ar_crcs:
-            for offset, track_crc in track_crcs.items():
-                if ar_crc1 == track_crc:
-                    return confidence, offset
+        tracks = collections.Counter()
+        confidence = collections.Counter()
+        for track_num, track_crcs in crcs.items():
+            index = self.ar_results.index450[track_num]
+            for offset, crc in track_crcs.items():
+                if crc in index:
+                    tracks[offset] += 1
+                    confidence[offset] += max(c for c, _ in index[crc])
+
+        if not tracks:
+            print("  No offset found with the frame 450 crcs")
+            return None
+        offset = min(tracks, key=lambda k: (-tracks[k], -confidence[k], abs(k)))
+        print(f"  Frame 450 crcs of {tracks[offset]} tracks match at offset {offset}")
+        return offset
+
+    # inverted checksum map of a track: crc -> list of (offset, version) at which the rip has that crc
+    def offsets_by_crc(self, track: cd.TrackNr) -> Dict[int, List[Tuple[int, int]]]:
+        if track not in self._offsets_by_crc:
+            inverted: Dict[int, List[Tuple[int, int]]] = {}
+            for version, checksums in ((1, self.checksums[track]), (2, self.checksums_v2[track])):
+                for offset, crc in checksums.items():
+                    inverted.setdefault(crc, []).append((offset, version))
+            self._offsets_by_crc[track] = inverted
+        return self._offsets_by_crc[track]
+
+    # all combinations of offset and accuraterip entry that match the rip, best match first
+    def find_matches_track(self, track: cd.TrackNr) -> List[AccurateRipMatch]:
+        offsets_by_crc = self.offsets_by_crc(track)
+        matches = [
+            AccurateRipMatch(track=track, offset=offset, crc=crc, version=version,
+                             confidence=confidence, pressing=pressing)
+            for crc in self.ar_results.index[track].keys() & offsets_by_crc.keys()
+            for offset, version in offsets_by_crc[crc]
+            for confidence, pressing in self.ar_results.find_crc1(track, crc)
+        ]
+        return sorted(matches, key=lambda m: (-m.confidence, abs(m.offset), m.version))
 
-        return 0, 0
+    def find_confidence_track(self, track: cd.TrackNr) -> Tuple[AccurateRipConfidence, int]:
+        matches = self.find_matches_track(track)
+        if not matches:
+            return 0, 0
+        return matches[0].confidence, matches[0].offset
+
+    # The offset at which most of the tracks (that match with at least min_confidence) are found in the image.
+    # As the image is ripped without offset correction, this is the read offset correction of the drive.
+    def find_offset(self, min_confidence: AccurateRipConfidence = 1) -> Optional[int]:
+        if self.ar_results is None:
+            return None
+        offsets = collections.Counter(
+            matches[0].offset
+            for t in self._disc.track_nums()
+            if (matches := self.find_matches_track(t)) and matches[0].confidence >= min_confidence
+        )
+        if not offsets:
+            return None
+        return offsets.most_common(1)[0][0]
 
     def find_confidence(self) -> Optional[Dict[cd.TrackNr, AccurateRipConfidence]]:
         print("Matching disc with Acucuraterip database...")
@@ -271,12 +788,15 @@ class AccurateRip:
 
         confidences: Dict[cd.TrackNr, AccurateRipConfidence] = dict()
         for t in self._disc.track_nums():
-            confidence, offset = self.find_confidence_track(t)
-            confidences[t] = confidence
+            matches = self.find_matches_track(t)
+            confidences[t] = matches[0].confidence if matches else 0
 
             print(f"  - Track {t:-2d}: ", end="")
-            if confidence > 0:
-                print(f"found matching crc at offset {offset} with confidence {confidence}")
+            if matches:
+                print(f"found matching crc at offset {matches[0].offset} with confidence {matches[0].confidence}")
+                for m in matches[1:]:
+                    print(f"              also at offset {m.offset} with confidence {m.confidence} "
+                          f"(v{m.version}, pressing {m.pressing})")
             else:
                 print(f"no matching crc found for track {t}")
 
@@ -0,0 +1,181 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from __future__ import annotations
+
+import http.client
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+
+from .accuraterip import AccurateRipCache, AccurateRipException, AccurateRipID, AccurateRipResults
+
+
+@dataclass
+class AccurateRipLookup:
+    id: AccurateRipID
+    results: Optional[AccurateRipResults] = None
+    error: Optional[Exception] = None
+
+    @property
+    def found(self) -> bool:
+        return self.results is not None
+
+
+# Looks up many discs in the accuraterip database at once.
+# Lookups run concurrently on a small number of worker threads; every worker keeps its own keep-alive connection
+# to the server, so we don't set up a new tcp connection for every disc.  When the server signals that it is
+# overloaded (429/503) or the connection breaks, the worker backs off exponentially (or as long as the server asks
+# with Retry-After) before trying again.  All workers together don't send more than one request per min_interval
+# seconds, so the server isn't hammered before it starts pushing back.  Entries go through the cache, so discs that
+# were looked up before don't cost any requests at all; failing to store an entry in the cache doesn't fail the lookup.
+class AccurateRipClient:
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, cache: Optional[AccurateRipCache] = None, max_connections: int = 4,
+                 retries: int = 5, backoff: float = 1.0, timeout: float = 30.0, min_interval: float = 0.2):
+        self.cache = cache if cache is not None else AccurateRipCache()
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.min_interval = min_interval
+
+        url = urllib.parse.urlsplit(self.cache.base_url)
+        self._scheme = url.scheme
+        self._host = url.hostname
+        self._port = url.port
+        self._base_path = url.path.rstrip("/")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # the earliest time at which the next request may be sent, by any worker
+        self._next_request = 0.0
+        self._rate_lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._scheme == "https":
+                conn = http.client.HTTPSConnection(self._host, self._port, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _reset_connection(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    # wait until the next request may be sent; every request takes the next slot, so the waiting is done in order
+    def _throttle(self) -> None:
+        with self._rate_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_request)
+            self._next_request = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def download(self, accuraterip_id: AccurateRipID) -> Optional[bytes]:
+        # only http(s) can do keep-alive; leave everything else (like file:// mirrors) to the cache
+        if self._scheme not in ("http", "https"):
+            return self.cache.download(accuraterip_id)
+
+        path = f"{self._base_path}/{accuraterip_id.path}"
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            self._throttle()
+            try:
+                conn = self._connection()
+                conn.request("GET", path)
+                response = conn.getresponse()
+                # always read the full body, otherwise the connection can't be reused
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                self._reset_connection()
+                if attempt == self.retries:
+                    raise AccurateRipException(f"Couldn't fetch accuraterip entry {accuraterip_id}: {e}")
+                time.sleep(delay)
+                delay *= 2
+                continue
+
+            if response.status == 200:
+                return data
+            if response.status == 404:
+                return None
+            if response.status not in self.RETRY_STATUS or attempt == self.retries:
+                raise AccurateRipException(f"Couldn't fetch accuraterip entry {accuraterip_id}: "
+                                           f"{response.status}: {response.reason}")
+
+            retry_after = response.getheader("Retry-After")
+            time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else delay)
+            delay *= 2
+
+        raise AccurateRipException("Never reached")
+
+    def lookup(self, accuraterip_id: AccurateRipID) -> AccurateRipLookup:
+        try:
+            try:
+                data = self.cache.get(accuraterip_id)
+            except KeyError:
+                if self.cache.offline:
+                    data = None
+                else:
+                    data = self.download(accuraterip_id)
+                    try:
+                        self.cache.put(accuraterip_id, data)
+                    except OSError as e:
+                        # we have the entry; it will just be downloaded again next time
+                        print(f"Couldn't store accuraterip entry {accuraterip_id} in the cache: {e}")
+
+            if data is None:
+                return AccurateRipLookup(accuraterip_id)
+            return AccurateRipLookup(accuraterip_id, AccurateRipResults.parse_accuraterip_bin(data, accuraterip_id))
+        except AccurateRipException as e:
+            return AccurateRipLookup(accuraterip_id, error=e)
+
+    # look up all specified discs, and yield the results in the order in which they come in
+    def lookup_many(self, accuraterip_ids: Iterable[AccurateRipID]) -> Iterator[AccurateRipLookup]:
+        unique = {i.id: i for i in accuraterip_ids}
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix="accuraterip") as pool:
+                futures = [pool.submit(self.lookup, i) for i in unique.values()]
+                try:
+                    for future in as_completed(futures):
+                        yield future.result()
+                finally:
+                    for future in futures:
+                        future.cancel()
+        finally:
+            # also when the caller stops early; the pool has waited for the lookups that were running by now
+            self.close()
+
+    # close the connections of all threads
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
@@ -0,0 +1,139 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Binding to accuraterip_checksum() from the C implementation in accuraterip/ (build it with
+# `make -f Makefile.linux libaccuraterip.so').  The checksum of a track at a single offset is calculated in-process,
+# directly on the samples in the image, without copying them.  If the library hasn't been built, available() is
+# False, and the caller should use the python implementation.
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+# see accuraterip.h
+NORMAL_TRACK = 0
+FIRST_TRACK = 1
+LAST_TRACK = 2
+
+# the C code skips these at the start of the first and the end of the last track, without checking the length
+SKIP_SAMPLES = 5 * 588
+
+BYTES_PER_SAMPLE = 4
+NUM_CHANNELS = 2
+
+ENV_LIBRARY = "VOIDRIP_ACCURATERIP_LIB"
+
+
+class ArNativeException(Exception):
+    pass
+
+
+_lib: Optional[ctypes.CDLL] = None
+_lib_loaded = False
+_lib_lock = threading.Lock()
+
+
+# the library from the environment, from the accuraterip directory in the source tree, or from the system
+def library_paths() -> Tuple[str, ...]:
+    paths = []
+    if ENV_LIBRARY in os.environ:
+        paths.append(os.environ[ENV_LIBRARY])
+    paths.append(str(Path(__file__).resolve().parents[2] / "accuraterip" / "libaccuraterip.so"))
+    system = ctypes.util.find_library("accuraterip")
+    if system is not None:
+        paths.append(system)
+    return tuple(paths)
+
+
+def _load() -> Optional[ctypes.CDLL]:
+    # the C code reads the samples as host-order 16 bit values
+    if sys.byteorder != "little":
+        return None
+    for path in library_paths():
+        try:
+            lib = ctypes.CDLL(path)
+        except OSError:
+            continue
+        lib.accuraterip_checksum.restype = ctypes.c_int
+        lib.accuraterip_checksum.argtypes = [
+            ctypes.POINTER(ctypes.c_uint32),
+            ctypes.POINTER(ctypes.c_uint32),
+            ctypes.c_void_p,
+            ctypes.c_size_t,
+            ctypes.c_ushort,
+            ctypes.c_uint,
+        ]
+        return lib
+    return None
+
+
+def library() -> Optional[ctypes.CDLL]:
+    global _lib, _lib_loaded
+    with _lib_lock:
+        if not _lib_loaded:
+            _lib = _load()
+            _lib_loaded = True
+    return _lib
+
+
+def available() -> bool:
+    return library() is not None
+
+
+# Address of the data of a buffer.  Writable buffers (an mmap, a bytearray, a numpy array) are used in place; bytes
+# can be passed as is.  Anything else (a read-only memoryview) has to be copied.
+def _pointer(data: Union[bytes, bytearray, memoryview]) -> Tuple[Union[int, bytes], object]:
+    if isinstance(data, bytes):
+        return data, data
+    view = memoryview(data).cast("B")
+    if not view.readonly:
+        buf = (ctypes.c_char * len(view)).from_buffer(view)
+        return ctypes.addressof(buf), buf
+    buf = bytes(view)
+    return buf, buf
+
+
+# v1 and v2 checksum of exactly the samples of a track (16-bit stereo little-endian)
+def checksum(data: Union[bytes, bytearray, memoryview], is_first: bool, is_last: bool) -> Tuple[int, int]:
+    lib = library()
+    if lib is None:
+        raise ArNativeException("The accuraterip library hasn't been built")
+
+    num_samples = memoryview(data).nbytes // BYTES_PER_SAMPLE
+    if num_samples <= SKIP_SAMPLES * (is_first + is_last):
+        raise ArNativeException(f"Track of {num_samples} samples is too short")
+    track_type = (FIRST_TRACK if is_first else NORMAL_TRACK) | (LAST_TRACK if is_last else NORMAL_TRACK)
+
+    crc_v1, crc_v2 = ctypes.c_uint32(), ctypes.c_uint32()
+    pointer, keep = _pointer(data)
+    try:
+        result = lib.accuraterip_checksum(ctypes.byref(crc_v1), ctypes.byref(crc_v2), pointer, num_samples,
+                                          NUM_CHANNELS, track_type)
+    finally:
+        # release the export of the buffer, so an mmap can be closed again
+        del keep
+    if result != 0:
+        raise ArNativeException(f"accuraterip_checksum() failed ({result})")
+    return crc_v1.value, crc_v2.value
@@ -19,53 +19,85 @@
 
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import io
 import json
-import os
-import os.path
+import mmap
+import struct
+import threading
+import wave
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
 from datetime import datetime
 from os import PathLike
 from pathlib import Path
 from subprocess import Popen, PIPE, STDOUT
-from typing import Union, Optional, List, Dict
+from typing import Union, Optional, List, Dict, Any, Iterable, Tuple, BinaryIO
 
 import pytz
 
 from . import cd
 from . import cdplayer
+from . import flac
+from . import pcm
 from . import tools
-from .accuraterip import AccurateRip, AccurateRipConfidence
+from .accuraterip import AccurateRip, AccurateRipCache, AccurateRipConfidence, DiscChecksum, frame450_checksums
+from .prefetch import Prefetch
 
 
 class AudioRipperException(Exception):
     pass
 
 
+class AudioRipperAborted(AudioRipperException):
+    pass
+
+
 # this class handles the actual ripping from cd to audio file
 # all intermediate files are stored as raw 16-bit signed samples (at 44.1kHz)
 class AudioRipper:
     COMMANDS = {
         'cdrdao': Path('/usr/bin/cdrdao'),
         'icedax': Path('/usr/bin/icedax'),
-        'cdparanoia': Path('/usr/bin/cdparano1ia'),
-        'sox': Path('/usr/bin/sox'),
+        'cdparanoia': Path('/usr/bin/cdparanoia'),
         'flac': Path('/usr/bin/flac')
     }
-    sox_raw_spec = ['-t', 'raw', '--endian', 'little', '-b16', '-esigned', '-c2', '-r44100']
-    sox_wav_spec = ['-t', 'wav', '--endian', 'little', '-b16', '-esigned', '-c2', '-r44100']
 
-    def __init__(self, disc : cd.Disc, destdir: PathLike) -> None:
+    # read the pipe from icedax in chunks of this many bytes (1 second of audio)
+    STREAM_CHUNK = 4 * 44100
+    # tracks with a lower accuraterip confidence are ripped again
+    MIN_CONFIDENCE = 10
+    RERIP_ATTEMPTS = 2
+
+    def __init__(self, disc : cd.Disc, destdir: PathLike, ar_cache: Optional[AccurateRipCache] = None,
+                 prefetch: Optional[Prefetch] = None, streaming: bool = False, keep_wav: bool = True,
+                 encode_jobs: Optional[int] = None, executor: Optional[Executor] = None) -> None:
         self.disc: cd.Disc = disc
+        self._ar_cache: Optional[AccurateRipCache] = ar_cache
+        self._prefetch: Optional[Prefetch] = prefetch
+        # in streaming mode, the output of icedax is checksummed and encoded while the disc is being ripped
+        self._streaming: bool = streaming
+        self._keep_wav: bool = keep_wav
+        # tracks are encoded in parallel, on the specified pool or on a pool of encode_jobs processes
+        self._encode_jobs: Optional[int] = encode_jobs
+        self._executor: Optional[Executor] = executor
         self.cdplayer: cdplayer.CDPlayer = disc.cdplayer
         self.destdir: Path = Path(destdir)
         self.wav_file: Optional[Path] = None
         self.flac_file: Optional[Path] = None
+        self.track_files: Optional[Dict[cd.TrackNr, Path]] = None
         self.rip_date: datetime = datetime.now(pytz.timezone("Europe/Amsterdam")).replace(microsecond=0)
         self.accuraterip_results: Optional[Dict[cd.TrackNr, AccurateRipConfidence]] = None
+        self.musicbrainz: Optional[Dict[str, Any]] = None
+        # set by abort(), from another thread; all running commands are killed then
+        self._aborted = threading.Event()
+        self._processes: List[Popen] = []
 
         self.destdir.mkdir(parents=True, exist_ok=True)
 
     def as_json(self) -> str:
-        return json.dumps(self.__dict__, indent=4, cls=tools.AudioRipperJSONEncoder)
+        public = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+        return json.dumps(public, indent=4, cls=tools.AudioRipperJSONEncoder)
 
     @property
     def cd(self) -> cdplayer.CDPlayer:
@@ -79,16 +111,84 @@ class AudioRipper:
         return Path(self.destdir, name)
 
     def rip(self) -> None:
-        self.wav_file = self.rip_icedax()
-        accuraterip = AccurateRip(self.disc, self.wav_file)
+        self.read()
+        self.finish()
+
+    # Stop the rip as soon as possible; the rip (running in another thread) raises AudioRipperAborted.
+    def abort(self) -> None:
+        self._aborted.set()
+        for process in self._processes:
+            if process.poll() is None:
+                process.kill()
+
+    def _check_aborted(self) -> None:
+        if self._aborted.is_set():
+            raise AudioRipperAborted("Rip was aborted")
+
+    def _popen(self, args: List[Any], **kwargs) -> Popen:
+        self._check_aborted()
+        process = Popen(args, **kwargs)
+        self._processes.append(process)
+        # abort() may have gone through the processes just before this one was added
+        if self._aborted.is_set():
+            process.kill()
+        return process
+
+    # Run cdparanoia to completion, and return its return code and stderr.  It is started through _popen(), so abort()
+    # kills it as well.
+    def _cdparanoia(self, args: List[Any]) -> Tuple[int, str]:
+        cmdline = [str(a) for a in [self.COMMANDS['cdparanoia'], *args]]
+        print(f'Running: "{" ".join(cmdline)}"')
+        process = self._popen(cmdline, cwd=self.cwd, stdout=PIPE, stderr=PIPE, encoding='utf-8')
+        _, stderr = process.communicate()
+        self._check_aborted()
+        return process.returncode, stderr
+
+    # the part of the rip that needs the drive: read the disc, verify it, and re-read anything that is wrong
+    def read(self) -> None:
+        self._read_audio()
+        self._read_subchannel()
+
+    # The slow subchannel data (isrc, mcn, preemphasis) is read once the audio has been ripped, so it doesn't get in the
+    # way of the drive streaming audio.  It only ends up in the manifest, so the rip doesn't depend on it.
+    def _read_subchannel(self) -> None:
+        self._check_aborted()
+        try:
+            self.disc.read_subchannel()
+        except Exception as e:
+            print(f"Couldn't read the subchannel (isrc, mcn) of the disc: {e}")
+
+    def _read_audio(self) -> None:
+        checksum = None
+        if self._streaming:
+            checksum = AccurateRip.disc_checksum(self.disc, start=0)
+            self.wav_file, self.flac_file = self.rip_icedax_stream(checksum)
+        else:
+            self.wav_file = self.rip_icedax()
+        prefetched = self._prefetch.accuraterip if self._prefetch is not None else None
+        accuraterip = AccurateRip(self.disc, self.wav_file, cache=self._ar_cache, prefetched=prefetched,
+                                  checksum=checksum)
+        if checksum is None and accuraterip.ar_results is not None:
+            # the frame 450 crcs tell at which offset to checksum; the checksumming itself goes to the pool, which
+            # is shared with the rips on other drives
+            accuraterip.checksum_disc(self._executor)
         confidence = accuraterip.find_confidence()
         if confidence is not None:
-            for track, conf in [(t, c) for t, c in confidence.items() if c < 10]:
-                print(accuraterip.ar_results)
-                print(f"Track {track} failed (confidence is {conf}, retrying")
-                raise AudioRipperException("Reripping tracks is not implemented yet")
+            failed = [t for t, c in confidence.items() if c < self.MIN_CONFIDENCE]
+            if failed:
+                self.repair_tracks(accuraterip, failed)
+                confidence = accuraterip.find_confidence()
         self.accuraterip_results = confidence
-        self.flac_file = self.convert_to_flac()
+        self._check_aborted()
+
+    # the part of the rip that doesn't need the drive anymore, so it can run while the next disc is being read
+    def finish(self) -> None:
+        self._check_aborted()
+        if self.flac_file is None:
+            self.track_files, self.flac_file = self.encode_flac()
+
+        if self._prefetch is not None:
+            self.musicbrainz = self._prefetch.musicbrainz_result()
 
         return
 
@@ -99,7 +199,10 @@ class AudioRipper:
             raise AudioRipperException(f"Destination id '{dest / basename}' already exists")
 
         name = dest / basename
-        self.wav_file.rename(name.with_suffix(".flac"))
+        self.flac_file.rename(name.with_suffix(".flac"))
+        if self.track_files is not None:
+            for num, track_file in self.track_files.items():
+                self.track_files[num] = track_file.rename(dest / f"{basename}_{num:02d}.flac")
         with open(name.with_suffix(".json"), "x") as fp:
             fp.write(self.as_json())
 
@@ -127,34 +230,201 @@ class AudioRipper:
             '-D', self.cd.device_name,
             '--max', '--no-infofile',
             '--output-format', 'wav',
-            '--track', f"{self.cd.firsttrack}+{self.cd.lasttrack}",
+            '--track', f"{self.disc.toc.first_track}+{self.disc.toc.last_track}",
             output_file
         ]
 
         print("Ripping disc using icedax:")
 
-        popen = Popen(args, cwd=self.cwd,
-                      stdout=PIPE, stderr=STDOUT, encoding='ascii', text=True, bufsize=0)
+        popen = self._popen(args, cwd=self.cwd,
+                            stdout=PIPE, stderr=STDOUT, encoding='ascii', text=True, bufsize=0)
+        self._icedax_progress(popen.stdout)
+        popen.wait()
 
+        if popen.returncode != 0:
+            print("Error while ripping, cleaning up")
+            output_file.unlink(missing_ok=True)
+            self._check_aborted()
+
+        return output_file
+
+    def _icedax_progress(self, lines: Iterable[str]) -> None:
         # produce some fancy output
         current_track = 0
-        while popen.poll() is None:
-            line = popen.stdout.readline().rstrip()
+        for line in lines:
+            line = line.rstrip()
 
             if current_track > 0:
                 if "%" in line:
-                    print(f"\rTrack {current_track:-2d}/{self.cd.lasttrack}: {line}", end="")
+                    print(f"\rTrack {current_track:-2d}/{self.disc.toc.last_track}: {line}", end="")
                 if "recorded successfully" in line:
                     print()
 
             if line == 'percent_done:' or line.endswith("recorded successfully"):
                 current_track += 1
 
-        if popen.returncode != 0:
-            print("Error while ripping, cleaning up")
-            output_file.unlink(missing_ok=True)
+    @staticmethod
+    def _skip_wav_header(stream: BinaryIO) -> int:
+        # we can't seek in a pipe, so walk through the chunks until we reach the audio data
+        riff = stream.read(12)
+        if len(riff) != 12 or riff[0:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise AudioRipperException("Output of icedax is not a wav stream")
+        while True:
+            header = stream.read(8)
+            if len(header) != 8:
+                raise AudioRipperException("No audio data in output of icedax")
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"data":
+                return size
+            stream.read(size + (size & 1))
+
+    # Rip the disc with icedax writing to a pipe, and feed every chunk of audio straight to the accuraterip
+    # checksums, a flac encoder and (optionally) a wav file, so the image never has to be read back from disk.
+    def rip_icedax_stream(self, checksum: DiscChecksum) -> Tuple[Optional[Path], Path]:
+        wav_file = self.path('icedax.wav') if self._keep_wav else None
+        flac_file = self.path('icedax.flac')
+        flac_file.unlink(missing_ok=True)
+
+        icedax_args = [
+            self.COMMANDS['icedax'],
+            '-D', self.cd.device_name,
+            '--max', '--no-infofile',
+            '--output-format', 'wav',
+            '--track', f"{self.disc.toc.first_track}+{self.disc.toc.last_track}",
+            '-'
+        ]
+        flac_args = [
+            self.COMMANDS['flac'],
+            "--silent",
+            "--force-raw-format", "--endian=little", "--sign=signed",
+            "--channels=2", f"--bps={cd.CDA_BITS_PER_SAMPLE}", f"--sample-rate={cd.CDA_SAMLES_PER_SEC}",
+            "-6",
+            "--output-name=" + str(flac_file),
+            "-"
+        ]
 
-        return output_file
+        print("Ripping disc using icedax (streaming):")
+
+        icedax = self._popen([str(a) for a in icedax_args], cwd=self.cwd, stdout=PIPE, stderr=PIPE)
+        flac = self._popen([str(a) for a in flac_args], cwd=self.cwd, stdin=PIPE, stderr=PIPE)
+
+        progress = threading.Thread(
+            target=self._icedax_progress,
+            args=(io.TextIOWrapper(icedax.stderr, encoding='ascii', errors='replace'),),
+            daemon=True
+        )
+        progress.start()
+
+        spill = None
+        if wav_file is not None:
+            spill = wave.open(str(wav_file), "wb")
+            spill.setnchannels(2)
+            spill.setsampwidth(cd.CDA_BITS_PER_SAMPLE // 8)
+            spill.setframerate(cd.CDA_SAMLES_PER_SEC)
+
+        try:
+            self._skip_wav_header(icedax.stdout)
+
+            # all consumers get a view on the same buffer
+            buf = bytearray(self.STREAM_CHUNK)
+            view = memoryview(buf)
+            pending = 0
+            while n := icedax.stdout.readinto(view[pending:]):
+                filled = pending + n
+                # only pass on whole samples
+                usable = filled - filled % DiscChecksum.BYTES_PER_SAMPLE
+                chunk = view[:usable]
+                checksum.update(chunk)
+                flac.stdin.write(chunk)
+                if spill is not None:
+                    spill.writeframesraw(chunk)
+                pending = filled - usable
+                view[:pending] = view[usable:filled]
+        except BrokenPipeError:
+            # flac has died; what went wrong is in its return code and stderr, below
+            flac_died = True
+            icedax.kill()
+        except BaseException:
+            # make sure nobody keeps waiting for a pipe that nobody reads/writes anymore
+            icedax.kill()
+            flac.kill()
+            raise
+        else:
+            flac_died = False
+        finally:
+            icedax.wait()
+            # if flac is gone, closing the pipe fails as well; that shouldn't hide what went wrong before
+            with contextlib.suppress(BrokenPipeError):
+                flac.stdin.close()
+            flac.wait()
+            progress.join()
+            if spill is not None:
+                spill.close()
+
+        if icedax.returncode != 0 or flac.returncode != 0 or flac_died:
+            print("Error while ripping, cleaning up")
+            flac_file.unlink(missing_ok=True)
+            if wav_file is not None:
+                wav_file.unlink(missing_ok=True)
+            self._check_aborted()
+            if flac_died or flac.returncode != 0:
+                stderr = flac.stderr.read().decode(errors='replace').strip()
+                raise AudioRipperException(f"Streaming rip failed: flac exited with {flac.returncode}: {stderr}")
+            raise AudioRipperException(f"Streaming rip failed: icedax exited with {icedax.returncode}")
+
+        return wav_file, flac_file
+
+    # Encode the rip to flac.  Every track is encoded separately, all at the same time on a pool of worker processes,
+    # and the resulting files are then joined (without encoding them again) into a single file for the whole disc.
+    def encode_flac(self) -> Tuple[Dict[cd.TrackNr, Path], Path]:
+        output_file = self.path("icedax.flac")
+        tracks = self.disc.tracks
+
+        executor = self._executor
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=self._encode_jobs)
+
+        print(f"Encoding {len(tracks)} tracks to flac")
+        futures = {}
+        try:
+            for track in tracks:
+                future = executor.submit(flac.encode, self.COMMANDS['flac'], self.wav_file,
+                                         self.path(f"track_{track.num:02d}.flac"),
+                                         track.first_sample, track.length_samples)
+                futures[future] = track.num
+
+            # the md5 sum of the audio of the whole disc can't be derived from those of the tracks, so calculate it
+            # while the tracks are being encoded
+            first_sample = tracks[0].first_sample
+            last_sample = tracks[-1].first_sample + tracks[-1].length_samples
+            md5 = self._md5_samples(first_sample, last_sample - first_sample)
+
+            track_files = {}
+            for future in as_completed(futures):
+                self._check_aborted()
+                track_files[futures[future]] = future.result()
+                print(f"\rEncoded {len(track_files)}/{len(tracks)} tracks", end="", flush=True)
+            print()
+        finally:
+            # if anything went wrong, don't bother with the tracks that haven't started yet
+            for future in futures:
+                future.cancel()
+            if executor is not self._executor:
+                executor.shutdown(cancel_futures=True)
+
+        track_files = dict(sorted(track_files.items()))
+        flac.concatenate(list(track_files.values()), output_file, md5)
+
+        return track_files, output_file
+
+    def _md5_samples(self, first_sample: int, length: int) -> bytes:
+        md5 = hashlib.md5()
+        with pcm.PCMView(self.wav_file) as image:
+            if len(image) < first_sample + length:
+                raise AudioRipperException(f"Rip '{self.wav_file}' is shorter than the disc")
+            for chunk in image.chunks(first_sample, first_sample + length):
+                md5.update(chunk)
+        return md5.digest()
 
     def convert_to_flac(self) -> PathLike:
         input_file = self.wav_file
@@ -234,45 +504,134 @@ class AudioRipper:
 
         return output_file
 
-    def rip_accurate_track(self, track: int) -> PathLike:
-        # cdparanoia
-        outputfile = Path(f'cdparanoia_{track:02d}.wav')
-        self.exec('cdparanoia', [
+    # Rip a single track with cdparanoia, which is slow, but tries a lot harder to get it right than icedax.
+    # The output contains exactly the samples of the track, corrected for the specified offset (by default the
+    # read offset of the drive).
+    def rip_accurate_track(self, track: int, sample_offset: Optional[int] = None) -> Path:
+        if sample_offset is None:
+            sample_offset = self.cd.offset
+        output_file = self.path(f'cdparanoia_{track:02d}.wav')
+        output_file.unlink(missing_ok=True)
+
+        returncode, stderr = self._cdparanoia([
             '--output-wav', '--force-cdrom-device', self.cd.device_name,
-            '--sample-offset', f'{self.cd.offset:d}', f'{track:d}',
-            outputfile
+            '--sample-offset', f'{sample_offset:d}', f'{track:d}',
+            output_file
         ])
-        return outputfile
+        if returncode != 0:
+            output_file.unlink(missing_ok=True)
+            raise AudioRipperException(f"cdparanoia failed to rip track {track}: {stderr}")
+        return output_file
 
-    def convert_to_wav(self) -> PathLike:
-        filename = 'cdrdao.wav'
-        if os.path.exists(self.path(filename)):
-            print("Wav exists, skipping")
-        else:
-            self.exec('sox',
-                      self.sox_raw_spec + ['cdrdao.raw'] +
-                      self.sox_wav_spec + [filename]
-                      )
-        self.wav_file = self.path(filename)
-        return self.wav_file
-
-    def correct_offset(self):
-        # examples:
-        #   add 294 samples at the start: sox new.wav padded1.wav  trim 0 -294s  pad 294s 0
-        #   add 294 samples at the end:   sox new.wav padded2.wav  trim    294s  pad 0 294s
-
-        # Positive correction means: drive reads samples too soon, so samples need to be shifted
-        # forwards in time
-        correction = self.cd.offset
-        if correction > 0:
-            trim_spec = ['trim', '0', f'-{correction}s',     'pad', f'{correction}s', '0']
-        elif correction < 0:
-            trim_spec = ['trim',      f'{abs(correction)}s', 'pad', '0', f'{correction}s']
-        else:
-            trim_spec = []
+    # Rip the frames first_frame up to (not including) last_frame of a track with cdparanoia, without any offset
+    # correction.  The output starts at the first sample of first_frame, as far as the drive is concerned.
+    def rip_frames(self, track: cd.Track, first_frame: int, last_frame: int) -> Path:
+        def span(frame: int) -> str:
+            seconds, frames = divmod(frame, cd.CDA_FRAMES_PER_SEC)
+            return f"{track.num:d}[{seconds // 60:d}:{seconds % 60:02d}.{frames:02d}]"
+
+        output_file = self.path(f'cdparanoia_{track.num:02d}_{first_frame:d}.wav')
+        output_file.unlink(missing_ok=True)
+
+        returncode, stderr = self._cdparanoia([
+            '--output-wav', '--force-cdrom-device', self.cd.device_name,
+            '--sample-offset', '0', f'{span(first_frame)}-{span(last_frame - 1)}',
+            output_file
+        ])
+        if returncode != 0:
+            output_file.unlink(missing_ok=True)
+            raise AudioRipperException(f"cdparanoia failed to rip track {track.num}: {stderr}")
+        return output_file
 
-        self.exec('sox',
-                  self.sox_raw_spec + ['cdrdao.raw'] +
-                  self.sox_raw_spec + ['cdrdao_shifted.raw'] +
-                  trim_spec
-                  )
+    # Measure the read offset correction of the drive with the disc in it: read a few frames around frame 450 of
+    # every track that has a frame 450 crc in AccurateRip, and find the offset at which they match.  Returns None if
+    # the disc isn't in AccurateRip or doesn't match at any offset.
+    def measure_offset(self) -> Optional[int]:
+        prefetched = self._prefetch.accuraterip if self._prefetch is not None else None
+        accuraterip = AccurateRip(self.disc, None, cache=self._ar_cache, prefetched=prefetched)
+        frame = AccurateRip.FRAME450
+        margin = -(-AccurateRip.FRAME450_MAX_OFFSET // cd.CDA_SAMPLES_PER_FRAME) + 1
+
+        crcs = dict()
+        for track in accuraterip.frame450_tracks():
+            if track.length <= frame + margin:
+                continue
+            self._check_aborted()
+            span_file = self.rip_frames(track, frame - margin, frame + margin + 1)
+            image_start = track.first_sample + (frame - margin) * cd.CDA_SAMPLES_PER_FRAME
+            with pcm.PCMView(span_file) as span:
+                crcs[track.num] = frame450_checksums(span, track, frame, AccurateRip.FRAME450_MAX_OFFSET,
+                                                     image_start=image_start)
+            span_file.unlink()
+
+        offset = accuraterip.match_offset_frame450(crcs)
+        # the frames were read without correction, so the offset at which the disc is found in them is the correction
+        return offset
+
+    # Rip tracks that failed verification again, and replace them in the image if they do verify now.
+    # This only costs a re-read of the failed tracks, rather than of the whole disc.
+    def repair_tracks(self, accuraterip: AccurateRip, track_nums: List[cd.TrackNr]) -> None:
+        if self.wav_file is None:
+            raise AudioRipperException("Can't repair tracks without a wav file of the rip")
+
+        # The image isn't corrected for the read offset of the drive, so the tracks are at the offset at which the good
+        # tracks were found (which is the correction for the drive).  Rip the tracks again with that correction, and
+        # put them back where the image has them.
+        offset = accuraterip.find_offset(self.MIN_CONFIDENCE)
+        if offset is None:
+            offset = self.cd.offset
+
+        tracks = {t.num: t for t in self.disc.tracks}
+        for num in track_nums:
+            track = tracks[num]
+            for attempt in range(1, self.RERIP_ATTEMPTS + 1):
+                self._check_aborted()
+                print(f"Track {num} failed verification, ripping it again (attempt {attempt}/{self.RERIP_ATTEMPTS})")
+                rerip_file = self.rip_accurate_track(num, sample_offset=offset)
+                with wave.open(str(rerip_file), "rb") as wav:
+                    data = wav.readframes(track.length_samples)
+                rerip_file.unlink()
+
+                confidence = accuraterip.verify_track(track, data)
+                if confidence >= self.MIN_CONFIDENCE:
+                    print(f"Track {num} verified with confidence {confidence}")
+                    self._splice_track(track, offset, data)
+                    break
+                print(f"Track {num} still doesn't verify (confidence is {confidence})")
+            else:
+                raise AudioRipperException(f"Track {num} failed verification after {self.RERIP_ATTEMPTS} attempts")
+
+        accuraterip.update_tracks([tracks[num] for num in track_nums])
+
+        # anything that was encoded while ripping contains the bad tracks
+        if self.flac_file is not None:
+            self.flac_file.unlink(missing_ok=True)
+            self.flac_file = None
+
+    # Overwrite the samples of a track in the image, which has the track at the specified offset from where the toc
+    # says it is.  Samples that end up outside of the image are dropped.
+    def _splice_track(self, track: cd.Track, offset: int, data: bytes) -> None:
+        bps = DiscChecksum.BYTES_PER_SAMPLE
+        with open(self.wav_file, "r+b") as fp:
+            image_samples = self._skip_wav_header(fp) // bps
+            data_start = fp.tell()
+
+            start = track.first_sample + offset
+            end = min(start + len(data) // bps, image_samples)
+            skip = max(0, -start)
+            if start + skip >= end:
+                return
+
+            with mmap.mmap(fp.fileno(), 0) as image:
+                image[data_start + (start + skip) * bps:data_start + end * bps] = data[skip * bps:(end - start) * bps]
+                image.flush()
+
+    # the raw image that cdrdao writes can be read as is (see pcm.PCMView), so it doesn't need a wav header
+    def convert_to_wav(self) -> pcm.PCMView:
+        self.wav_file = self.path('cdrdao.raw')
+        return pcm.PCMView(self.wav_file)
+
+    # The image, corrected for the read offset of the drive.  The samples are shifted while they are being read,
+    # rather than rewriting the whole image (see CDPlayer.OFFSETS for the sign of the correction).
+    def correct_offset(self) -> pcm.PCMView:
+        return pcm.PCMView(self.wav_file, correction=self.cd.offset)
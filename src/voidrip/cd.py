@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 # import collections
+import copy
 import enum
 import json
-from typing import List, Optional, Generator, Dict, Union, Final
+from typing import List, Optional, Generator, Dict, Final, Tuple
 #from pathlib import Path
 from dataclasses import dataclass
 from .accuraterip import AccurateRipID
@@ -11,12 +12,12 @@ from .accuraterip import AccurateRipID
 import typing
 
 from .tools import AudioRipperJSONEncoder
+from . import cdtext
+from .cdtext import CDText_type
 
 if typing.TYPE_CHECKING:
     from . import CDPlayer
 
-import chardet
-
 #import tocparser
 import pycdio
 import cdio
@@ -60,10 +61,6 @@ class DiscMode(enum.Enum):
     CD_I       = "CD-i"
 
 
-# TODO: make this a dataclass
-CDText_type = Dict[str, Union[str, Dict[int, Dict[str,  bytes]]]]
-
-
 # types for cd timings
 @dataclass
 class MSF:
@@ -155,15 +152,20 @@ class Track:
         self.channels: int = track.get_audio_channels()
         self.format: TrackFormat = TrackFormat(track.get_format())
         self.copy_permit: bool = track.get_copy_permit() == 'OK'
-        # note: we would use track.get_preemphasis, but it has a bug and doesn't currenty work
-        self.preemphasis: Optional[bool] = self.parse_preemphasis(
-            pycdio.get_track_preemphasis(track.device, track.track)
-        )
         self.is_green: bool = track.is_green()
-        self.isrc: str = track.get_isrc()
+        # these are read from the subchannel, which takes a long time on some drives; see read_subchannel()
+        self.preemphasis: Optional[bool] = None
+        self.isrc: Optional[str] = None
 
         self.verify()
 
+    # The preemphasis flag and the isrc of the track.  The device is passed in rather than kept, so a Track stays plain
+    # data that can be sent to worker processes.
+    def read_subchannel(self, device) -> Tuple[Optional[bool], Optional[str]]:
+        # note: we would use track.get_preemphasis, but it has a bug and doesn't currenty work
+        preemphasis = self.parse_preemphasis(pycdio.get_track_preemphasis(device, self.num))
+        return preemphasis, pycdio.get_track_isrc(device, self.num)
+
     def verify(self) -> None:
         # if non-audio tracks are present, calculation of track lengths is broken (see above)
         if self.format != TrackFormat.AUDIO:
@@ -171,7 +173,7 @@ class Track:
 
     def __repr__(self) -> str:
         s = f"<{self.__class__.__name__}\n"
-        for k, v in {**vars(self), **dict(length=self.length)}.items():
+        for k, v in {**self.public_vars(), **dict(length=self.length)}.items():
             s += f"  {k}: {v}\n"
         s += ">"
         return s
@@ -184,7 +186,10 @@ class Track:
             "first_lsn": lba2lsn(self.first_lba),
             "first_msf": lba2msf(self.first_lba)
         }
-        return self.__dict__ | extra
+        return self.public_vars() | extra
+
+    def public_vars(self) -> Dict:
+        return {k: v for k, v in vars(self).items() if not k.startswith("_")}
 
     @property
     def length(self) -> int:
@@ -211,22 +216,55 @@ class Track:
         return self.is_last_track
 
 
+# The table of contents of a disc, as read from the drive in one go.  It doesn't change while the disc is in the
+# drive, so it is read once per disc and shared by everything that needs it, instead of asking the drive again (which
+# would get in the way when the drive is busy ripping).
+@dataclass(frozen=True)
+class TOC:
+    first_track: TrackNr
+    last_track: TrackNr
+    tracks: Tuple[Track, ...]
+
+    @classmethod
+    def read(cls, device: cdio.Device) -> TOC:
+        first_track = pycdio.get_first_track_num(device.cd)
+        last_track = pycdio.get_last_track_num(device.cd)
+        if not 0 < first_track <= last_track <= 99:
+            raise DiscException(f"Invalid first {first_track} or last {last_track} track")
+        tracks = tuple(Track(device.get_track(t), t == last_track) for t in range(first_track, last_track + 1))
+        return cls(first_track, last_track, tracks)
+
+    @property
+    def num_tracks(self) -> int:
+        return self.last_track - self.first_track + 1
+
+    def track(self, num: TrackNr) -> Track:
+        return self.tracks[num - self.first_track]
+
+
 class Disc:
     def __init__(self, cdplayer: Optional[CDPlayer]):
         self.cdplayer = cdplayer
         device = cdplayer.device
-        self.first_track: int = pycdio.get_first_track_num(device.cd)
-        self.num_tracks: int = pycdio.get_last_track_num(device.cd)
-        if self.first_track > 100 or self.num_tracks > 100:
-            raise DiscException(f"Invalid first {self.first_track} or last {self.num_tracks} track")
-        self.last_track: int = self.first_track + self.num_tracks - 1
-        self.tracks: List[Track] = [Track(device.get_track(t), t == self.num_tracks) for t in self.track_nums()]
-        self.cdtext: List[CDText_type] = self.parse_cdtext(pycdio.get_cdtext(device.cd))
-        self.mcn: Optional[str] = self.get_mcn(device.cd)
+        self._toc: TOC = cdplayer.toc()
+        self.first_track: int = self._toc.first_track
+        self.num_tracks: int = self._toc.num_tracks
+        self.last_track: int = self._toc.last_track
+        # the TOC is shared and doesn't change; the subchannel data is only filled in on the tracks of the disc
+        self.tracks: List[Track] = [copy.copy(track) for track in self._toc.tracks]
+        self.cdtext: List[CDText_type] = self.parse_cdtext(cdplayer.read_cdtext())
+        # read from the subchannel, later; see read_subchannel()
+        self.mcn: Optional[str] = None
+        self.subchannel_read: bool = False
+        self._device = device
         self.mode: DiscMode = DiscMode(pycdio.get_disc_mode(device.cd))
         self.jolietlvl = pycdio.get_joliet_level(device.cd)
         self.verify()
 
+    @property
+    def toc(self) -> TOC:
+        return self._toc
+
     def __repr__(self) -> str:
         s = ''
         s += f"First track: {self.first_track}\n"
@@ -247,7 +285,8 @@ class Disc:
             "id_musicbrainz": self.id_musicbrainz(),
             "id_accuraterip": self.id_accuraterip()
         }
-        return self.__dict__ | extra
+        public = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+        return public | extra
 
     def as_json(self) -> str:
         return json.dumps(self.as_dict(), indent=4, cls=AudioRipperJSONEncoder)
@@ -264,11 +303,30 @@ class Disc:
                 raise DiscException(f"Found track {track.num} with unsupported mode `{track.format}'")
             if track.channels != 2:
                 raise DiscException(f"Found track {track.num} with unsupported numer of channels {track.channels}")
-            if track.preemphasis:
-                raise DiscException(f"Found track {track.num} with preemphasis.  This is not supported.")
             if track.is_green:
                 raise DiscException(f"Found track {track.num} with green=true.  This is not supported.")
 
+    # Read the MCN and the ISRCs and preemphasis flags of all tracks.  This needs subchannel scans, which can take
+    # several seconds per track, so it isn't done when the disc is inserted, but after it has been ripped.  Nothing is
+    # filled in unless all of it could be read.
+    def read_subchannel(self) -> None:
+        if self.subchannel_read:
+            return
+        mcn = self.get_mcn(self._device.cd)
+        subchannel = [track.read_subchannel(self._device.cd) for track in self.tracks]
+        self.mcn = mcn
+        for track, (preemphasis, isrc) in zip(self.tracks, subchannel):
+            track.preemphasis, track.isrc = preemphasis, isrc
+        self.subchannel_read = True
+        self.verify_subchannel()
+
+    # Preemphasis isn't undone, so the rip of such a track sounds different from the disc.  It is only known once the
+    # disc has been ripped, so it is reported (and in the manifest, with the tracks), rather than refused.
+    def verify_subchannel(self) -> None:
+        for track in self.tracks:
+            if track.preemphasis:
+                print(f"Warning: track {track.num} has preemphasis, which is kept in the rip")
+
     @staticmethod
     def get_mcn(device) -> Optional[str]:
         mcn = pycdio.get_mcn(device)
@@ -276,28 +334,14 @@ class Disc:
             return None
         return mcn
 
-    # TODO: split out cdtext to its own class
-    def parse_cdtext(self, cdtext) -> List[CDText_type]:
-        # [ - { language: "<lang>", data: { key: text, ... } ]
-        parsed: List[CDText_type] = []
-        if cdtext:
-            for lang_id in pycdio.cdtext_list_languages_v2(cdtext):
-                lang_name = pycdio.cdtext_lang2str(lang_id)
-                data: Dict[int, Dict[str, bytes]] = {}
-                if lang_id == pycdio.CDTEXT_LANGUAGE_INVALID or lang_id == pycdio.CDTEXT_LANGUAGE_BLOCK_UNUSED:
-                    continue
-
-                if not pycdio.cdtext_select_language(cdtext, lang_id):
-                    raise DiscException(f"Could not select language '{lang_name}'")
-                for t in [0] + list(self.track_nums()):
-                    data[t]: Dict[str, bytes] = {}
-                    for i in range(pycdio.MIN_CDTEXT_FIELD, pycdio.MAX_CDTEXT_FIELDS):
-                        key = pycdio.cdtext_field2str(i)
-                        if txt := pycdio.cdtext_get(cdtext, i, t):
-                            data[t][key] = txt
-
-                parsed.append({"language": lang_name, "data": data})
-        return parsed
+    @staticmethod
+    def parse_cdtext(raw: bytes) -> List[CDText_type]:
+        try:
+            return cdtext.parse(raw)
+        except cdtext.CDTextException as e:
+            # the disc is still perfectly rippable without it
+            print(f"Ignoring broken CD-Text: {e}")
+            return []
 
     def track_nums(self) -> Generator[int, None, None]:
         t = self.first_track
@@ -323,6 +367,10 @@ class Disc:
         disc = discid.put(self.first_track, self.last_track, self.num_frames(), self.tracks_lba())
         return disc.id
 
+    def toc_musicbrainz(self) -> str:
+        disc = discid.put(self.first_track, self.last_track, self.num_frames(), self.tracks_lba())
+        return disc.toc_string
+
     def id_accuraterip(self) -> AccurateRipID:
         # see https://github.com/gchudov/cuetools.net/blob/master/CUETools.AccurateRip/AccurateRip.cs#L1297
         # better use this: https://github.com/tuffy/python-audio-tools/blob/master/audiotools/accuraterip.py#L230
@@ -339,18 +387,11 @@ class Disc:
 
     def get_performer_title(self) -> tuple[Optional[str], Optional[str]]:
         title, artist = (None, None)
-        for cdtext in self.cdtext:
-            if "data" in cdtext and len(cdtext["data"]) > 0:
-                if "PERFORMER" in cdtext["data"][0]:
-                    artist = cdtext["data"][0]["PERFORMER"]
-                if "TITLE" in cdtext["data"][0]:
-                    title = cdtext["data"][0]["TITLE"]
-
-        if artist:
-            charset = chardet.detect(artist)
-            artist = artist.decode(charset["encoding"])
-        if title:
-            charset = chardet.detect(title)
-            title = title.decode(charset["encoding"])
+        for block in self.cdtext:
+            disc_text = block.get("data", {}).get(0, {})
+            if "PERFORMER" in disc_text:
+                artist = disc_text["PERFORMER"]
+            if "TITLE" in disc_text:
+                title = disc_text["TITLE"]
 
         return artist, title
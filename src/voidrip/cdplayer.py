@@ -1,18 +1,20 @@
 from __future__ import annotations
 
+import ctypes
 import os
+import struct
 from pathlib import Path
 import fcntl
-from typing import Tuple, Optional, Dict, List, Any
+import threading
+from typing import Tuple, Optional, Dict, List, Iterator
 from os import PathLike
 #import enum
 import time
 import pyudev
-import yaml
 
-from . import tools
 from . import cd
 from .cd import Track
+from .driveoffsets import DriveModel, DriveOffsetStore, normalise_drive, read_accuraterip_offsets
 
 # todo: replace low-level ioctls by udev calls or cdio
 import cdio
@@ -23,6 +25,44 @@ class CDPlayerException(Exception):
     pass
 
 
+# Delays for polling the drive: start short, so a change is noticed as soon as it happens, and back off, so a drive
+# that takes its time isn't hammered.  Stops when the timeout (if any) has passed.
+def backoff(timeout: Optional[float], first: float = 0.02, maximum: float = 1.0) -> Iterator[float]:
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    delay = first
+    while deadline is None or time.monotonic() < deadline:
+        yield delay
+        delay = min(delay * 2, maximum)
+
+
+# from <scsi/sg.h>
+class SgIoHdr(ctypes.Structure):
+    _fields_ = [
+        ("interface_id", ctypes.c_int),
+        ("dxfer_direction", ctypes.c_int),
+        ("cmd_len", ctypes.c_ubyte),
+        ("mx_sb_len", ctypes.c_ubyte),
+        ("iovec_count", ctypes.c_ushort),
+        ("dxfer_len", ctypes.c_uint),
+        ("dxferp", ctypes.c_void_p),
+        ("cmdp", ctypes.c_void_p),
+        ("sbp", ctypes.c_void_p),
+        ("timeout", ctypes.c_uint),
+        ("flags", ctypes.c_uint),
+        ("pack_id", ctypes.c_int),
+        ("usr_ptr", ctypes.c_void_p),
+        ("status", ctypes.c_ubyte),
+        ("masked_status", ctypes.c_ubyte),
+        ("msg_status", ctypes.c_ubyte),
+        ("sb_len_wr", ctypes.c_ubyte),
+        ("host_status", ctypes.c_ushort),
+        ("driver_status", ctypes.c_ushort),
+        ("resid", ctypes.c_int),
+        ("duration", ctypes.c_uint),
+        ("info", ctypes.c_uint),
+    ]
+
+
 def msn(lsn: int) -> str:
     blk_per_sec = 75
     sam_per_sec = 44100
@@ -49,6 +89,8 @@ class CDPlayer:
         'CDROM_DRIVE_STATUS' : 0x5326,
         'CDROM_LOCKDOOR'     : 0x5329
     }
+    # from <scsi/sg.h>
+    SG_IO = 0x2285
 
     STATUS = {
         'CDS_NO_INFO'        : 0,
@@ -58,8 +100,14 @@ class CDPlayer:
         'CDS_DISC_OK'        : 4
     }
 
-    # list read offset _corrections_ (in samples==4 bytes)
-    # Positive means: drive reads samples too soon, so samples need to be shifted forwards in time
+    # list read offset _corrections_ (in samples==4 bytes) of the drives we use; these take precedence over the
+    # AccurateRip list (see load_offsets)
+    # All read offsets in voidrip follow AccurateRip and cdparanoia's --sample-offset: with a correction c, sample p
+    # of the corrected audio is sample p + c of what the drive returned:
+    #   corrected[p] = raw[p + c]
+    # so positive means: the drive returns every sample c samples late, and the corrected audio is read c samples
+    # further on.  This is also the offset at which AccurateRip finds a disc in an uncorrected image (see
+    # AccurateRip.find_offset), and the correction of pcm.PCMView.
     # see http://www.accuraterip.com/driveoffsets.htm for the list
     # see https://hydrogenaud.io/index.php/topic,47862.msg425948.html#msg425948 for explanation
     OFFSETS = {
@@ -71,13 +119,27 @@ class CDPlayer:
         ('HL-DT-ST', 'DVDRAM GH24NSD1' ):   6
     }
 
+    # offsets of drives that were calibrated here (see OffsetCalibration); these take precedence over OFFSETS
+    offset_store: Optional[DriveOffsetStore] = None
+
+    # all known offsets, on normalised (vendor, model)
+    _offsets: Dict[DriveModel, int] = {normalise_drive(*drive): offset for drive, offset in OFFSETS.items()}
+
     def __init__(self, device: PathLike = '/dev/cdrom') -> None:
         self._dev_path: Path = Path(device).resolve()
         self._udev_context: pyudev.Context = pyudev.Context()
         self._udev_device: pyudev.Device = pyudev.Devices.from_device_file(self._udev_context, str(self._dev_path))
 
         self._device: Optional[cdio.Device] = None
-        self._cdinfo = None
+        # (vendor, model) from sysfs; the drive behind a device doesn't change
+        self._model: Optional[Tuple[str, str]] = None
+        # toc of the disc in the drive, read once per disc; _disc_generation changes whenever the disc might have
+        # changed
+        self._toc: Optional[cd.TOC] = None
+        self._disc_generation: int = 0
+        # fd for ioctls; kept open, as the drive is polled often
+        self._fd: Optional[int] = None
+        self._fd_lock = threading.RLock()
 
         # sanity checks
         try:
@@ -108,35 +170,108 @@ class CDPlayer:
             self._device = cdio.Device(str(self._dev_path))
         return self._device
 
+    # Index the published AccurateRip drive offset list (see driveoffsets.read_accuraterip_offsets), so drives that
+    # aren't in OFFSETS can be used as well.  Called once, at startup.
+    @classmethod
+    def load_offsets(cls, accuraterip_offsets: PathLike) -> None:
+        builtin = {normalise_drive(*drive): offset for drive, offset in cls.OFFSETS.items()}
+        cls._offsets = read_accuraterip_offsets(accuraterip_offsets) | builtin
+
     @property
     def offset(self) -> int:
         vendor, model = self.get_model()
         #print(f'Found vendor="{vendor}", model="{model}"')
         if vendor is None:
             return 0
-        if (vendor, model) in self.OFFSETS:
-            #print(f'Found offset={self.OFFSETS[(vendor,model)]}')
-            return self.OFFSETS[(vendor, model)]
-        else:
-            raise CDPlayerException("Unknown drive; unable to get drive offset")
+        if self.offset_store is not None:
+            offset = self.offset_store.get(vendor, model)
+            if offset is not None:
+                return offset
+        try:
+            return self._offsets[normalise_drive(vendor, model)]
+        except KeyError:
+            raise CDPlayerException(f"Unknown drive `{vendor} {model}'; unable to get drive offset")
 
     def open(self) -> int:
-        fd = os.open(self.device_name, os.O_RDONLY | os.O_NONBLOCK)
-        return fd
+        with self._fd_lock:
+            if self._fd is None:
+                self._fd = os.open(self.device_name, os.O_RDONLY | os.O_NONBLOCK)
+            return self._fd
+
+    def close(self) -> None:
+        with self._fd_lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
 
     def ioctl(self, ioctl_id: int, param: int) -> int:
-        cdrom = self.open()
-        status = fcntl.ioctl(cdrom, ioctl_id, param)
-        os.close(cdrom)
-        return status
+        with self._fd_lock:
+            try:
+                return fcntl.ioctl(self.open(), ioctl_id, param)
+            except OSError:
+                # the fd might not survive everything the drive goes through; try again with a fresh one
+                self.close()
+                return fcntl.ioctl(self.open(), ioctl_id, param)
 
     def status(self) -> int:
         return self.ioctl(CDPlayer.IOCTL['CDROM_DRIVE_STATUS'], 0)
 
+    # Send a scsi command that reads data from the drive; returns the data, or None if the command failed.
+    def scsi_read(self, cdb: bytes, length: int, timeout_ms: int = 10000) -> Optional[bytes]:
+        cmd = ctypes.create_string_buffer(cdb, len(cdb))
+        data = ctypes.create_string_buffer(length)
+        sense = ctypes.create_string_buffer(32)
+        hdr = SgIoHdr(interface_id=ord('S'), dxfer_direction=-3,  # SG_DXFER_FROM_DEV
+                      cmd_len=len(cdb), mx_sb_len=len(sense), dxfer_len=length,
+                      dxferp=ctypes.addressof(data), cmdp=ctypes.addressof(cmd), sbp=ctypes.addressof(sense),
+                      timeout=timeout_ms)
+        with self._fd_lock:
+            fcntl.ioctl(self.open(), CDPlayer.SG_IO, hdr)
+        if hdr.status != 0 or hdr.host_status != 0 or hdr.driver_status & 0x0f:
+            return None
+        return data.raw[:length - hdr.resid]
+
+    # The raw CD-Text packs, read in one go (READ TOC/PMA/ATIP, format 5); empty if the disc has no CD-Text, or if the
+    # drive can't be asked for it (no SG_IO, or the ioctl fails).
+    def read_cdtext(self) -> bytes:
+        def read_toc_cdtext(length: int) -> Optional[bytes]:
+            try:
+                return self.scsi_read(struct.pack(">BBBxxxxHx", 0x43, 0x00, 0x05, length), length)
+            except OSError:
+                return None
+
+        # first ask for the size, then for all of it
+        header = read_toc_cdtext(4)
+        if header is None or len(header) < 4:
+            return b""
+        size, = struct.unpack(">H", header[0:2])
+        if size <= 2:
+            return b""
+        raw = read_toc_cdtext(min(size + 2, 0xffff))
+        return raw if raw is not None else b""
+
+    # the toc of the disc in the drive; only read from the drive the first time after a disc was inserted
+    def toc(self) -> cd.TOC:
+        toc = self._toc
+        if toc is None:
+            generation = self._disc_generation
+            toc = cd.TOC.read(self.device)
+            # don't keep it if the disc was changed while we were reading
+            if generation == self._disc_generation:
+                self._toc = toc
+        return toc
+
+    # to be called when the media has changed (or might have)
+    def forget_disc(self) -> None:
+        self._disc_generation += 1
+        self._toc = None
+
     def is_open(self) -> bool:
         return self.status() == CDPlayer.STATUS['CDS_TRAY_OPEN']
 
     def has_disc(self) -> bool:
+        # the properties of a udev device are a snapshot, so get a fresh one
+        self._udev_device = pyudev.Devices.from_device_file(self._udev_context, str(self._dev_path))
         if self._udev_device.properties.get('ID_CDROM_MEDIA_CD'):
             return True
         return False
@@ -161,28 +296,48 @@ class CDPlayer:
             if self._dev_path == Path(dev.device_node) \
                and dev.properties.get('DISK_MEDIA_CHANGE') \
                and dev.properties.get('ID_CDROM_MEDIA_CD'):
-                time.sleep(0.1)
+                self.forget_disc()
+                break
+
+        # udev may be a bit ahead of the drive
+        for delay in backoff(30):
+            if self.status() == CDPlayer.STATUS['CDS_DISC_OK']:
                 return
+            time.sleep(delay)
 
     def tray_open(self) -> None:
         #self.ioctl(CDPlayer.IOCTL['CDROM_LOCKDOOR'], 0)
         #self.ioctl(CDPlayer.IOCTL['CDROM_EJECT'], 0)
         # Note: when we open the tray, the handle doesn't work anymore; we need to open it again when a disk is present
-        self.device.eject_media()
+        # The kernel refuses to eject while the drive is opened more than once, so our own fd needs to go too.
+        with self._fd_lock:
+            self.close()
+            self.device.eject_media()
         self._device = None
+        # the next disc will be a different one
+        self.forget_disc()
 
     def tray_close(self) -> None:
         #self.ioctl(CDPlayer.IOCTL['CDROM_LOCKDOOR'], 0)
         #self.ioctl(CDPlayer.IOCTL['CDROM_CLOSETRAY'], 0)
-        cdio.close_tray(str(self.device_name))
-        for i in range(0, 195):
+        self.request_tray_close()
+        for delay in backoff(195):
             if not self.is_open():
                 break
-            time.sleep(1)
+            time.sleep(delay)
         else:
             raise CDPlayerException('Could not close tray')
 
+    # start closing the tray, without waiting for it
+    def request_tray_close(self) -> None:
+        cdio.close_tray(str(self.device_name))
+
     def get_model(self) -> Optional[Tuple[str, str]]:
+        if self._model is None:
+            self._model = self._read_model()
+        return self._model
+
+    def _read_model(self) -> Tuple[str, str]:
         fullpath = os.path.realpath(self.device_name)
         devname = os.path.basename(fullpath)
         syspath = os.path.join('/sys/block', devname, 'device')
@@ -196,7 +351,7 @@ class CDPlayer:
         return vendor, model
 
     def get_drive_info(self) -> Dict[str, str]:
-        model, vendor = self.get_model()
+        vendor, model = self.get_model()
         return {
             "model"  : model,
             "vendor" : vendor,
@@ -205,52 +360,39 @@ class CDPlayer:
 
     @property
     def firsttrack(self):
-        track_first = self.device.get_first_track().track
+        track_first = self.toc().first_track
         if track_first != 1:
             raise CDPlayerException(f"First track is not 1 but `{track_first}'")
         return track_first
 
     @property
     def lasttrack(self):
-        return self.device.get_last_track().track
+        return self.toc().last_track
 
     @property
     def tracks(self):
         return list(range(self.firsttrack, self.lasttrack+1))
 
     def get_tracks(self) -> List[Track]:
-        tracks = []
-        for t in self.tracks:
-            try:
-                track = self.device.get_track(t)
-            except Exception:
-                raise CDPlayerException(f"Failed to fetch track {t}")
-            tracks.append(Track(track, t == self.lasttrack))
-        return tracks
-
-    @property
-    def info(self) -> Dict[str, Any]:
-        if self._cdinfo is None:
-            yml = tools.execcmd(Path(tools.script_dir().parent, "cd-info", "cd-info"), [str(self._dev_path)]).stdout
-            self._cdinfo = yaml.safe_load(yml)
-        return self._cdinfo
+        try:
+            return list(self.toc().tracks)
+        except Exception:
+            raise CDPlayerException("Failed to fetch tracks")
 
     def get_disc_mcn(self) -> Optional[str]:
         mcn = self.device.get_mcn()
         return mcn if mcn else None
 
     def get_track_info(self, track_num: int) -> Track:
-        track = self.device.get_track(track_num)
-        return Track(track, track_num == self.lasttrack)
+        return self.toc().track(track_num)
 
-    def get_disc(self, timeout: int = 30) -> cd.Disc:
-        while timeout > 0:
+    def get_disc(self, timeout: float = 30) -> cd.Disc:
+        for delay in backoff(timeout):
             try:
                 disc = cd.Disc(self)
                 return disc
             except cd.DiscException:
-                timeout -= 1
-                time.sleep(1.0)
+                time.sleep(delay)
                 continue
 
         raise CDPlayerException("Can't read disc")
@@ -0,0 +1,189 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+# Decoding of raw CD-Text, as returned by READ TOC/PMA/ATIP format 5 (see MMC-3, annex J).
+# The CD-Text is a list of 18-byte packs:
+#   byte 0:      pack type (0x80 title, 0x81 performer, ..., 0x8f size info)
+#   byte 1:      track number (bit 7: extension flag)
+#   byte 2:      sequence number
+#   byte 3:      bit 7: double byte characters, bits 6-4: block number, bits 3-0: character position
+#   byte 4-15:   text (or binary data)
+#   byte 16-17:  crc
+# The text packs of a type in a block together form a list of null-terminated strings, one for every track, starting
+# at the track in byte 1 of the first pack.  A tab means: the same as the previous track.
+# There are up to 8 blocks, all in a different language; the size info packs of a block hold its character set.
+
+from __future__ import annotations
+
+import struct
+from collections import defaultdict
+from typing import Dict, List, Optional, Union
+
+import chardet
+
+
+# [ { block: <n>, language: "<lang>", charset: "<codec>", data: { track: { key: text, ... } } }, ... ]
+CDText_type = Dict[str, Union[int, str, Dict[int, Dict[str, str]]]]
+
+
+class CDTextException(Exception):
+    pass
+
+
+PACK_SIZE = 18
+HEADER_SIZE = 4
+
+PACK_SIZE_INFO = 0x8f
+PACK_GENRE = 0x87
+PACK_UPC_ISRC = 0x8e
+
+# pack types with text, and the names libcdio uses for them
+TEXT_FIELDS = {
+    0x80: "TITLE",
+    0x81: "PERFORMER",
+    0x82: "SONGWRITER",
+    0x83: "COMPOSER",
+    0x84: "ARRANGER",
+    0x85: "MESSAGE",
+    0x86: "DISC_ID",
+    PACK_GENRE: "GENRE",
+    PACK_UPC_ISRC: "ISRC",
+}
+
+# the character codes from the size info
+CHARSETS = {
+    0x00: "iso8859_1",
+    0x01: "ascii",      # ISO 646
+    0x80: "shift_jis",  # MS-JIS
+    0x81: "euc_kr",     # Korean
+    0x82: "gb2312",     # Mandarin Chinese
+}
+
+# EBU Tech 3258 language codes, with the names libcdio uses
+LANGUAGES = dict(enumerate([
+    "Unknown", "Albanian", "Breton", "Catalan", "Croatian", "Welsh", "Czech", "Danish", "German", "English",
+    "Spanish", "Esperanto", "Estonian", "Basque", "Faroese", "French", "Frisian", "Irish", "Gaelic", "Galician",
+    "Icelandic", "Italian", "Lappish", "Latin", "Latvian", "Luxembourgian", "Lithuanian", "Hungarian", "Maltese",
+    "Dutch", "Norwegian", "Occitan", "Polish", "Portuguese", "Romanian", "Romansh", "Serbian", "Slovak",
+    "Slovenian", "Finnish", "Swedish", "Turkish", "Flemish", "Wallon"
+])) | dict(enumerate([
+    "Zulu", "Vietnamese", "Uzbek", "Urdu", "Ukrainian", "Thai", "Telugu", "Tatar", "Tamil", "Tadzhik", "Swahili",
+    "Sranan Tongo", "Somali", "Sinhalese", "Shona", "Serbo-croat", "Ruthenian", "Russian", "Quechua", "Pushtu",
+    "Punjabi", "Persian", "Papamiento", "Oriya", "Nepali", "Ndebele", "Marathi", "Moldavian", "Malaysian",
+    "Malagasay", "Macedonian", "Laotian", "Korean", "Khmer", "Kazakh", "Kannada", "Japanese", "Indonesian", "Hindi",
+    "Hebrew", "Hausa", "Gurani", "Gujurati", "Greek", "Georgian", "Fulani", "Dari", "Churash", "Chinese", "Burmese",
+    "Bulgarian", "Bengali", "Bielorussian", "Bambora", "Azerbaijani", "Assamese", "Armenian", "Arabic", "Amharic"
+], start=0x45))
+
+
+# CRC-16/CCITT over the first 16 bytes of a pack, stored inverted
+def pack_crc(pack: bytes) -> int:
+    crc = 0
+    for byte in pack[:16]:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xffff
+    return crc ^ 0xffff
+
+
+def decode_text(text: bytes, charset: Optional[str]) -> str:
+    if charset is not None:
+        try:
+            return text.decode(charset)
+        except UnicodeDecodeError:
+            pass
+    # the disc doesn't do what it says; guess
+    guess = chardet.detect(text)["encoding"]
+    if guess is not None:
+        try:
+            return text.decode(guess)
+        except (UnicodeDecodeError, LookupError):
+            pass
+    return text.decode("iso8859_1")
+
+
+# Split the concatenated text of a pack type into the strings for the tracks, starting at first_track
+def split_strings(text: bytes, first_track: int, double_byte: bool) -> Dict[int, bytes]:
+    terminator = b"\0\0" if double_byte else b"\0"
+    repeat = b"\t\t" if double_byte else b"\t"
+
+    strings: Dict[int, bytes] = dict()
+    track = first_track
+    pos = 0
+    while pos < len(text):
+        end = text.find(terminator, pos)
+        # double byte strings are aligned on 2 bytes
+        while double_byte and end != -1 and (end - pos) % 2:
+            end = text.find(terminator, end + 1)
+        if end == -1:
+            # the last string doesn't fit in the last pack; it is incomplete, so leave it out
+            break
+        string = text[pos:end]
+        if string == repeat:
+            string = strings.get(track - 1, b"")
+        if string:
+            strings[track] = string
+        track += 1
+        pos = end + len(terminator)
+    return strings
+
+
+# Parse raw CD-Text (with or without the 4-byte header of the READ TOC response)
+def parse(raw: bytes) -> List[CDText_type]:
+    if len(raw) % PACK_SIZE == HEADER_SIZE:
+        raw = raw[HEADER_SIZE:]
+
+    # (block, pack type) -> [(sequence number, pack)]
+    packs: Dict[int, Dict[int, List[bytes]]] = defaultdict(lambda: defaultdict(list))
+    for pos in range(0, len(raw) - PACK_SIZE + 1, PACK_SIZE):
+        pack = raw[pos:pos + PACK_SIZE]
+        crc, = struct.unpack(">H", pack[16:18])
+        # some drives check the crc themselves, and zero it
+        if crc != 0 and crc != pack_crc(pack):
+            continue
+        block = (pack[3] >> 4) & 0x07
+        packs[block][pack[0]].append(pack)
+
+    parsed: List[CDText_type] = []
+    for block in sorted(packs):
+        block_packs = packs[block]
+        size_info = b"".join(p[4:16] for p in sorted(block_packs.get(PACK_SIZE_INFO, []), key=lambda p: p[2]))
+        if len(size_info) < 36:
+            raise CDTextException(f"CD-Text block {block} has no size information")
+        charset = CHARSETS.get(size_info[0])
+        language = LANGUAGES.get(size_info[28 + block], "Unknown")
+
+        data: Dict[int, Dict[str, str]] = defaultdict(dict)
+        for pack_type, field in TEXT_FIELDS.items():
+            if pack_type not in block_packs:
+                continue
+            type_packs = sorted(block_packs[pack_type], key=lambda p: p[2])
+            double_byte = bool(type_packs[0][3] & 0x80)
+            text = b"".join(p[4:16] for p in type_packs)
+            if pack_type == PACK_GENRE:
+                # a binary genre code, followed by the text for the disc
+                text = text[2:]
+            strings = split_strings(text, type_packs[0][1] & 0x7f, double_byte)
+            for track, string in strings.items():
+                key = "UPC_EAN" if pack_type == PACK_UPC_ISRC and track == 0 else field
+                data[track][key] = decode_text(string, charset)
+
+        parsed.append({"block": block, "language": language, "charset": charset, "data": dict(data)})
+    return parsed
@@ -0,0 +1,194 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from __future__ import annotations
+
+import asyncio
+import enum
+from pathlib import Path
+from typing import Optional
+
+import pyudev
+
+from . import cd
+from .cdplayer import CDPlayer, CDPlayerException, backoff
+
+
+class DriveException(Exception):
+    pass
+
+
+class DriveState(enum.Enum):
+    UNKNOWN = 0
+    TRAY_OPEN = 1
+    CLOSING = 2
+    NO_DISC = 3
+    SPINNING_UP = 4
+    DISC_OK = 5
+    TOC_READY = 6
+
+
+# Keeps track of the state of a drive, for use in an event loop:
+#
+#   TRAY_OPEN -> CLOSING -> SPINNING_UP -> DISC_OK -> TOC_READY
+#                       \-> NO_DISC
+#
+# The state is read from the drive (through a single fd that stays open), at short intervals just after something
+# happened, and less and less often while nothing happens.  Every udev event for the drive (like a media change)
+# triggers an immediate update.  Code that needs the drive in a certain state can simply wait for it.
+class Drive:
+    POLL_FIRST = 0.02
+    POLL_MAX = 1.0
+
+    STATES = {
+        CDPlayer.STATUS['CDS_NO_INFO']: DriveState.UNKNOWN,
+        CDPlayer.STATUS['CDS_NO_DISC']: DriveState.NO_DISC,
+        CDPlayer.STATUS['CDS_TRAY_OPEN']: DriveState.TRAY_OPEN,
+        CDPlayer.STATUS['CDS_DRIVE_NOT_READY']: DriveState.SPINNING_UP,
+        CDPlayer.STATUS['CDS_DISC_OK']: DriveState.DISC_OK,
+    }
+
+    def __init__(self, cdplayer: CDPlayer):
+        self.cdplayer = cdplayer
+        self._state = DriveState.UNKNOWN
+        self._changed: Optional[asyncio.Condition] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._monitor: Optional[pyudev.Monitor] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def name(self) -> str:
+        return self.cdplayer.device_name.name
+
+    @property
+    def state(self) -> DriveState:
+        return self._state
+
+    async def start(self) -> None:
+        self._changed = asyncio.Condition()
+        self._wakeup = asyncio.Event()
+
+        self._monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        self._monitor.filter_by('block')
+        self._monitor.start()
+        asyncio.get_running_loop().add_reader(self._monitor.fileno(), self._udev_event)
+
+        await self._update()
+        self._task = asyncio.create_task(self._poll(), name=f"drive-{self.name}")
+
+    async def stop(self) -> None:
+        if self._monitor is not None:
+            asyncio.get_running_loop().remove_reader(self._monitor.fileno())
+            self._monitor = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.cdplayer.close()
+
+    async def __aenter__(self) -> Drive:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.stop()
+
+    def _udev_event(self) -> None:
+        # read all pending events; only those for our drive are interesting
+        while (device := self._monitor.poll(timeout=0)) is not None:
+            if device.device_node and Path(device.device_node) == self.cdplayer.device_name:
+                if device.properties.get('DISK_MEDIA_CHANGE'):
+                    self.cdplayer.forget_disc()
+                self._wakeup.set()
+
+    async def _set_state(self, state: DriveState) -> None:
+        async with self._changed:
+            self._state = state
+            self._changed.notify_all()
+
+    async def _update(self) -> bool:
+        status = await asyncio.to_thread(self.cdplayer.status)
+        state = self.STATES.get(status, DriveState.UNKNOWN)
+
+        # states that the drive itself doesn't know about
+        if self._state == DriveState.CLOSING and state == DriveState.TRAY_OPEN:
+            return False
+        if self._state == DriveState.TOC_READY and state == DriveState.DISC_OK:
+            return False
+
+        if state == self._state:
+            return False
+        if state in (DriveState.TRAY_OPEN, DriveState.NO_DISC):
+            self.cdplayer.forget_disc()
+        await self._set_state(state)
+        return True
+
+    async def _poll(self) -> None:
+        while True:
+            for delay in backoff(None, self.POLL_FIRST, self.POLL_MAX):
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                    woken = True
+                except asyncio.TimeoutError:
+                    woken = False
+                self._wakeup.clear()
+                if await self._update() or woken:
+                    # something happened, so more is likely to happen soon
+                    break
+
+    # wait until the drive is in one of the specified states, and return that state
+    async def wait_for(self, *states: DriveState, timeout: Optional[float] = None) -> DriveState:
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self._state in states), timeout)
+            except asyncio.TimeoutError:
+                raise DriveException(f"Drive {self.name} didn't get to {'/'.join(s.name for s in states)} "
+                                     f"in {timeout}s (it is {self._state.name})")
+            return self._state
+
+    async def open_tray(self, timeout: float = 30) -> None:
+        await asyncio.to_thread(self.cdplayer.tray_open)
+        self._wakeup.set()
+        await self.wait_for(DriveState.TRAY_OPEN, timeout=timeout)
+
+    async def close_tray(self, timeout: float = 195) -> DriveState:
+        await self._set_state(DriveState.CLOSING)
+        await asyncio.to_thread(self.cdplayer.request_tray_close)
+        self._wakeup.set()
+        return await self.wait_for(DriveState.NO_DISC, DriveState.SPINNING_UP, DriveState.DISC_OK,
+                                   DriveState.TOC_READY, timeout=timeout)
+
+    async def wait_for_disc(self) -> None:
+        await self.wait_for(DriveState.DISC_OK, DriveState.TOC_READY)
+
+    # Read the toc of the disc.  Even when the drive says the disc is ok, the first attempts can fail.
+    async def read_disc(self, timeout: float = 30) -> cd.Disc:
+        await self.wait_for_disc()
+        for delay in backoff(timeout, self.POLL_FIRST, self.POLL_MAX):
+            try:
+                disc = await asyncio.to_thread(cd.Disc, self.cdplayer)
+            except cd.DiscException:
+                await asyncio.sleep(delay)
+                continue
+            await self._set_state(DriveState.TOC_READY)
+            return disc
+        raise CDPlayerException("Can't read disc")
@@ -0,0 +1,198 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from __future__ import annotations
+
+import collections
+import json
+import os
+import re
+import struct
+from html.parser import HTMLParser
+from datetime import datetime
+from os import PathLike
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+class DriveOffsetException(Exception):
+    pass
+
+
+DriveModel = Tuple[str, str]
+
+
+# Drives are compared on their (vendor, model), without case and with all whitespace collapsed: the kernel pads
+# them with spaces, and the AccurateRip list isn't consistent about case and spacing.
+def normalise_drive(vendor: str, model: str) -> DriveModel:
+    return " ".join(vendor.split()).upper(), " ".join(model.split()).upper()
+
+
+# AccurateRip names drives `VENDOR - MODEL'
+def split_drive_name(name: str) -> DriveModel:
+    vendor, sep, model = name.partition(" - ")
+    if not sep:
+        return "", name
+    return vendor, model
+
+
+# DriveOffsets.bin, as distributed by AccurateRip: records of 69 bytes, with the offset (int16), the drive name and
+# the name of whoever submitted it (both null-padded)
+OFFSETS_BIN_RECORD = struct.Struct("<h33s34s")
+
+
+def parse_offsets_bin(data: bytes) -> Dict[DriveModel, int]:
+    if len(data) % OFFSETS_BIN_RECORD.size:
+        raise DriveOffsetException(f"Size {len(data)} isn't a multiple of {OFFSETS_BIN_RECORD.size}")
+    offsets: Dict[DriveModel, int] = dict()
+    for offset, name, _ in OFFSETS_BIN_RECORD.iter_unpack(data):
+        name = name.split(b"\0", 1)[0].decode("latin-1").strip()
+        if name:
+            offsets.setdefault(normalise_drive(*split_drive_name(name)), offset)
+    return offsets
+
+
+# the table rows of driveoffsets.htm
+class _TableParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.rows: List[List[str]] = []
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.rows.append([])
+        elif tag == "td":
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag == "td" and self._cell is not None:
+            if self.rows:
+                self.rows[-1].append("".join(self._cell).strip())
+            self._cell = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+OFFSET_RE = re.compile(r"^[+-]?\d+$")
+
+
+# driveoffsets.htm, as published on accuraterip.com: a table of drive name, offset, submitter and agreement.  Purged
+# drives have no offset, and are skipped.
+def parse_offsets_html(text: str) -> Dict[DriveModel, int]:
+    parser = _TableParser()
+    parser.feed(text)
+    parser.close()
+    offsets: Dict[DriveModel, int] = dict()
+    for row in parser.rows:
+        if len(row) < 2 or not OFFSET_RE.match(row[1]):
+            continue
+        offsets.setdefault(normalise_drive(*split_drive_name(row[0])), int(row[1]))
+    return offsets
+
+
+# The published AccurateRip drive offset list (DriveOffsets.bin, or a saved copy of driveoffsets.htm), indexed on
+# normalised (vendor, model).  A drive that is in there more than once gets the offset of its first entry.
+def read_accuraterip_offsets(path: PathLike) -> Dict[DriveModel, int]:
+    path = Path(path)
+    try:
+        if path.suffix.lower() == ".bin":
+            return parse_offsets_bin(path.read_bytes())
+        return parse_offsets_html(path.read_text(encoding="latin-1"))
+    except DriveOffsetException as e:
+        raise DriveOffsetException(f"Can't parse drive offsets in `{path}': {e}")
+
+
+# Read offset corrections of drives that have been calibrated here (see OffsetCalibration), per (vendor, model).
+# The store is a small json file, that is read once at startup, and rewritten (atomically) when a drive is added.
+class DriveOffsetStore:
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+        self._drives: Dict[DriveModel, Dict] = dict()
+
+    @classmethod
+    def load(cls, path: PathLike) -> DriveOffsetStore:
+        store = cls(path)
+        try:
+            with open(store.path) as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            return store
+        except ValueError as e:
+            raise DriveOffsetException(f"Can't parse drive offsets in `{store.path}': {e}")
+        for drive in data.get("drives", []):
+            store._drives[normalise_drive(drive["vendor"], drive["model"])] = drive
+        return store
+
+    def save(self) -> None:
+        data = {"drives": sorted(self._drives.values(), key=lambda d: (d["vendor"], d["model"]))}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+        with open(tmp, "w") as fp:
+            json.dump(data, fp, indent=4)
+        tmp.replace(self.path)
+
+    def get(self, vendor: str, model: str) -> Optional[int]:
+        drive = self._drives.get(normalise_drive(vendor, model))
+        return drive["offset"] if drive is not None else None
+
+    def set(self, vendor: str, model: str, offset: int, discs: int) -> None:
+        self._drives[normalise_drive(vendor, model)] = {
+            "vendor": vendor,
+            "model": model,
+            "offset": offset,
+            "discs": discs,
+            "calibrated": datetime.now().replace(microsecond=0).isoformat(),
+        }
+        self.save()
+
+    def __contains__(self, drive: DriveModel) -> bool:
+        return normalise_drive(*drive) in self._drives
+
+
+# Collects the offsets measured on a number of discs (see AudioRipper.measure_offset), and decides on the offset of
+# the drive once enough of them agree.  Different pressings of a disc can be shifted with respect to each other, so a
+# single disc isn't enough; the offset of the drive is the one that most discs agree on.
+class OffsetCalibration:
+    def __init__(self, min_discs: int = 3):
+        self.min_discs = min_discs
+        self.measurements: List[Optional[int]] = []
+
+    def add(self, offset: Optional[int]) -> None:
+        self.measurements.append(offset)
+
+    @property
+    def votes(self) -> collections.Counter:
+        return collections.Counter(m for m in self.measurements if m is not None)
+
+    # the offset, once at least min_discs discs agree on it, and they are a majority of the discs that had a result
+    def result(self) -> Optional[int]:
+        votes = self.votes
+        if not votes:
+            return None
+        offset, count = votes.most_common(1)[0]
+        if count < self.min_discs or 2 * count <= sum(votes.values()):
+            return None
+        return offset
+
+    def __str__(self) -> str:
+        votes = ", ".join(f"{offset:+d}: {count}" for offset, count in self.votes.most_common())
+        return f"{len(self.measurements)} discs measured ({votes or 'no results'})"
@@ -0,0 +1,419 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from __future__ import annotations
+
+import functools
+import mmap
+import struct
+import subprocess
+from dataclasses import dataclass
+from os import PathLike
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from . import cd
+from . import pcm
+
+
+class FlacException(Exception):
+    pass
+
+
+FLAC_MAGIC = b"fLaC"
+BLOCK_STREAMINFO = 0
+STREAMINFO_SIZE = 34
+
+# Every flac frame holds this many samples (7 cd sectors).  Tracks always contain a whole number of sectors, so
+# the last frame of a track is never shorter than a sector, which keeps the concatenated stream valid (a flac
+# stream may only have a tiny block at the very end).  It also is within the "subset" limits for 44.1kHz.
+BLOCKSIZE = 7 * cd.CDA_SAMPLES_PER_FRAME
+
+
+# Encode part of a disc image (see pcm.PCMView) to flac.  This runs in a worker process, so it must be a plain
+# module-level function.
+def encode(flac: PathLike, image: PathLike, output: PathLike, first_sample: int, length: int,
+           correction: int = 0, compression: int = 6) -> Path:
+    args = [
+        str(flac),
+        "--silent", "--force",
+        "--force-raw-format", "--endian=little", "--sign=signed",
+        "--channels=2", f"--bps={cd.CDA_BITS_PER_SAMPLE}", f"--sample-rate={cd.CDA_SAMLES_PER_SEC}",
+        f"-{compression}",
+        f"--blocksize={BLOCKSIZE}",
+        "--output-name=" + str(output),
+        "-"
+    ]
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        with pcm.PCMView(image, correction) as view:
+            for chunk in view.chunks(first_sample, first_sample + length):
+                process.stdin.write(chunk)
+    except BrokenPipeError:
+        # flac gave up; its output tells why
+        pass
+    # this also closes stdin
+    _, stderr = process.communicate()
+
+    if process.returncode != 0:
+        Path(output).unlink(missing_ok=True)
+        raise FlacException(f"Encoding samples {first_sample}+{length} of '{image}' failed: "
+                            f"{stderr.decode(errors='replace')}")
+    return Path(output)
+
+
+@dataclass
+class StreamInfo:
+    min_blocksize: int
+    max_blocksize: int
+    min_framesize: int
+    max_framesize: int
+    sample_rate: int
+    channels: int
+    bits_per_sample: int
+    total_samples: int
+    md5: bytes
+
+    @classmethod
+    def parse(cls, data: bytes) -> StreamInfo:
+        if len(data) != STREAMINFO_SIZE:
+            raise FlacException(f"STREAMINFO block has wrong size {len(data)}")
+        min_blocksize, max_blocksize = struct.unpack(">HH", data[0:4])
+        min_framesize = int.from_bytes(data[4:7], "big")
+        max_framesize = int.from_bytes(data[7:10], "big")
+        # 20 bits sample rate, 3 bits channels-1, 5 bits bits_per_sample-1, 36 bits total samples
+        bits = int.from_bytes(data[10:18], "big")
+        return cls(
+            min_blocksize=min_blocksize,
+            max_blocksize=max_blocksize,
+            min_framesize=min_framesize,
+            max_framesize=max_framesize,
+            sample_rate=bits >> 44,
+            channels=((bits >> 41) & 0x07) + 1,
+            bits_per_sample=((bits >> 36) & 0x1f) + 1,
+            total_samples=bits & 0xfffffffff,
+            md5=bytes(data[18:34])
+        )
+
+    def pack(self) -> bytes:
+        bits = (self.sample_rate << 44) | ((self.channels - 1) << 41) | ((self.bits_per_sample - 1) << 36) | \
+            self.total_samples
+        return struct.pack(">HH", self.min_blocksize, self.max_blocksize) \
+            + self.min_framesize.to_bytes(3, "big") + self.max_framesize.to_bytes(3, "big") \
+            + bits.to_bytes(8, "big") + self.md5
+
+
+# the location of a single frame in a flac file
+@dataclass
+class FlacFrame:
+    offset: int
+    size: int
+    header_size: int
+    # offset and size of the frame/sample number in the header
+    number_offset: int
+    number_size: int
+    number: int
+    blocksize: int
+
+
+# crc-8 (polynomial x^8 + x^2 + x + 1) protects the frame header
+@functools.cache
+def _crc8_table() -> Tuple[int, ...]:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xff if crc & 0x80 else (crc << 1) & 0xff
+        table.append(crc)
+    return tuple(table)
+
+
+def crc8(data: bytes) -> int:
+    table = _crc8_table()
+    crc = 0
+    for b in data:
+        crc = table[crc ^ b]
+    return crc
+
+
+# crc-16 (polynomial x^16 + x^15 + x^2 + 1) protects the whole frame
+@functools.cache
+def _crc16_table() -> Tuple[int, ...]:
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xffff if crc & 0x8000 else (crc << 1) & 0xffff
+        table.append(crc)
+    return tuple(table)
+
+
+def crc16(data: bytes) -> int:
+    table = _crc16_table()
+    crc = 0
+    for b in data:
+        crc = ((crc << 8) & 0xffff) ^ table[(crc >> 8) ^ b]
+    return crc
+
+
+def _gf2_mulmod16(a: int, b: int) -> int:
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        b >>= 1
+        a <<= 1
+        if a & 0x10000:
+            a ^= 0x18005
+    return result
+
+
+# Multiplying by x^(8*2^k) mod P is linear, so it can be done with two lookups (high and low byte).
+@functools.cache
+def _crc16_shift_table(k: int) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    factor = 0x0100  # x^8
+    for _ in range(k):
+        factor = _gf2_mulmod16(factor, factor)
+    low = tuple(_gf2_mulmod16(i, factor) for i in range(256))
+    high = tuple(_gf2_mulmod16(i << 8, factor) for i in range(256))
+    return high, low
+
+
+# The crc of a message with n zero bytes appended, given the crc of the message.
+# crc16(A || B) == crc16_shift(crc16(A), len(B)) ^ crc16(B), so if a part of a frame changes, the crc of the whole
+# frame can be fixed up without having to read the (unchanged) rest of the frame.
+def crc16_shift(crc: int, n: int) -> int:
+    k = 0
+    while n and crc:
+        if n & 1:
+            high, low = _crc16_shift_table(k)
+            crc = high[crc >> 8] ^ low[crc & 0xff]
+        n >>= 1
+        k += 1
+    return crc
+
+
+# flac encodes frame/sample numbers like utf-8, but with up to 36 bits
+def encode_number(n: int) -> bytes:
+    if n < 0x80:
+        return bytes([n])
+    for extra in range(1, 7):
+        if n < 1 << (5 * extra + 6) or extra == 6:
+            break
+    if n >= 1 << 36:
+        raise FlacException(f"Number {n} doesn't fit in a frame header")
+    first = ((0xff << (7 - extra)) & 0xff) | (n >> (6 * extra))
+    return bytes([first] + [0x80 | ((n >> (6 * i)) & 0x3f) for i in reversed(range(extra))])
+
+
+def decode_number(data: bytes, pos: int) -> Optional[Tuple[int, int]]:
+    first = data[pos]
+    if first < 0x80:
+        return first, 1
+    extra = 0
+    while extra < 7 and first & (0x40 >> extra):
+        extra += 1
+    if extra == 0 or extra > 6:
+        return None
+    n = first & (0x3f >> extra)
+    for i in range(1, extra + 1):
+        b = data[pos + i]
+        if b & 0xc0 != 0x80:
+            return None
+        n = (n << 6) | (b & 0x3f)
+    return n, extra + 1
+
+
+class FlacFile:
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+        with open(self.path, "rb") as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[0:4] != FLAC_MAGIC:
+            raise FlacException(f"'{self.path}' is not a flac file")
+
+        # walk the metadata blocks
+        self.streaminfo: Optional[StreamInfo] = None
+        pos = 4
+        while True:
+            header = self.data[pos:pos + 4]
+            if len(header) != 4:
+                raise FlacException(f"'{self.path}' has no audio frames")
+            block_type = header[0] & 0x7f
+            size = int.from_bytes(header[1:4], "big")
+            if block_type == BLOCK_STREAMINFO:
+                self.streaminfo = StreamInfo.parse(self.data[pos + 4:pos + 4 + size])
+            pos += 4 + size
+            if header[0] & 0x80:
+                break
+        if self.streaminfo is None:
+            raise FlacException(f"'{self.path}' has no STREAMINFO block")
+        self.audio_offset: int = pos
+
+    def close(self) -> None:
+        self.data.close()
+
+    def __enter__(self) -> FlacFile:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _parse_header(self, pos: int, template: Optional[bytes] = None) -> Optional[FlacFrame]:
+        data = self.data
+        if pos + 6 > len(data):
+            return None
+        if data[pos] != 0xff or data[pos + 1] & 0xfe != 0xf8:
+            return None
+        # sample rate, channel assignment and sample size never change within a stream
+        if template is not None and (data[pos + 2] & 0x0f != template[2] & 0x0f or data[pos + 3] != template[3]):
+            return None
+        if data[pos + 3] & 0x01 or data[pos + 3] >> 4 > 10:
+            return None
+
+        number = decode_number(data, pos + 4)
+        if number is None:
+            return None
+        number, number_size = number
+
+        blocksize_code = data[pos + 2] >> 4
+        samplerate_code = data[pos + 2] & 0x0f
+        end = pos + 4 + number_size
+        if blocksize_code == 0 or samplerate_code == 0x0f:
+            return None
+        elif blocksize_code == 1:
+            blocksize = 192
+        elif blocksize_code <= 5:
+            blocksize = 576 << (blocksize_code - 2)
+        elif blocksize_code == 6:
+            blocksize = data[end] + 1
+            end += 1
+        elif blocksize_code == 7:
+            blocksize = int.from_bytes(data[end:end + 2], "big") + 1
+            end += 2
+        else:
+            blocksize = 256 << (blocksize_code - 8)
+        if samplerate_code == 12:
+            end += 1
+        elif samplerate_code in (13, 14):
+            end += 2
+
+        if end >= len(data) or crc8(data[pos:end]) != data[end]:
+            return None
+        return FlacFrame(offset=pos, size=0, header_size=end + 1 - pos, number_offset=pos + 4,
+                         number_size=number_size, number=number, blocksize=blocksize)
+
+    # Find all frames in the file.  Frames have no length field, so the end of a frame is found by looking for the
+    # header of the next one: a sync code followed by a header with a valid crc and the expected frame number.
+    def frames(self) -> Iterator[FlacFrame]:
+        data = self.data
+        frame = self._parse_header(self.audio_offset)
+        if frame is None:
+            raise FlacException(f"'{self.path}' has no valid frame at the start of the audio")
+        if data[frame.offset + 1] & 0x01:
+            raise FlacException(f"'{self.path}' has a variable blocksize, which is not supported")
+        template = bytes(data[frame.offset:frame.offset + 4])
+
+        samples = 0
+        while frame is not None:
+            following = None
+            pos = frame.offset + frame.header_size
+            while (pos := data.find(b"\xff\xf8", pos)) >= 0:
+                following = self._parse_header(pos, template)
+                if following is not None and following.number == frame.number + 1:
+                    break
+                following = None
+                pos += 1
+
+            frame.size = (following.offset if following is not None else len(data)) - frame.offset
+            samples += frame.blocksize
+            yield frame
+            frame = following
+
+        if samples != self.streaminfo.total_samples:
+            raise FlacException(f"'{self.path}' has {samples} samples in its frames, "
+                                f"but {self.streaminfo.total_samples} according to STREAMINFO")
+
+
+# Join flac files into a single stream, without decoding and encoding the audio again.
+# The frames of the input files are copied as is, except for their headers: the frames of a fixed-blocksize
+# stream are numbered per file, so they are renumbered with their sample number in the joined stream, which is
+# marked as having a variable blocksize.  The frame checksums are fixed up for the changed headers.
+# The md5 of the audio can't be derived from the md5 sums of the parts, so it has to be passed in.
+def concatenate(inputs: Sequence[PathLike], output: PathLike, md5: Optional[bytes] = None) -> StreamInfo:
+    if not inputs:
+        raise FlacException("Nothing to concatenate")
+
+    blocksizes: List[int] = []
+    framesizes: List[int] = []
+    info: Optional[StreamInfo] = None
+    sample = 0
+
+    with open(output, "wb") as out:
+        # leave room for the STREAMINFO, which is only known at the end
+        out.write(FLAC_MAGIC + bytes(4 + STREAMINFO_SIZE))
+
+        for path in inputs:
+            with FlacFile(path) as flac:
+                if info is None:
+                    info = flac.streaminfo
+                elif (flac.streaminfo.sample_rate, flac.streaminfo.channels, flac.streaminfo.bits_per_sample) != \
+                        (info.sample_rate, info.channels, info.bits_per_sample):
+                    raise FlacException(f"Audio format of '{path}' doesn't match '{inputs[0]}'")
+
+                data = flac.data
+                for frame in flac.frames():
+                    old_header = data[frame.offset:frame.offset + frame.header_size - 1]
+                    header = bytearray(old_header[0:4])
+                    header[1] |= 0x01
+                    header += encode_number(sample)
+                    header += old_header[frame.number_offset + frame.number_size - frame.offset:]
+                    header.append(crc8(header))
+
+                    body_end = frame.offset + frame.size - 2
+                    body_size = body_end - frame.offset - frame.header_size
+                    stored = int.from_bytes(data[body_end:body_end + 2], "big")
+                    old_crc = crc16(data[frame.offset:frame.offset + frame.header_size])
+                    crc = stored ^ crc16_shift(old_crc ^ crc16(header), body_size)
+
+                    out.write(header)
+                    out.write(data[frame.offset + frame.header_size:body_end])
+                    out.write(crc.to_bytes(2, "big"))
+
+                    blocksizes.append(frame.blocksize)
+                    framesizes.append(len(header) + body_size + 2)
+                    sample += frame.blocksize
+
+        result = StreamInfo(
+            # the last block of a stream doesn't count for the minimum
+            min_blocksize=min(blocksizes[:-1] or blocksizes),
+            max_blocksize=max(blocksizes),
+            min_framesize=min(framesizes),
+            max_framesize=max(framesizes),
+            sample_rate=info.sample_rate,
+            channels=info.channels,
+            bits_per_sample=info.bits_per_sample,
+            total_samples=sample,
+            md5=md5 if md5 is not None else bytes(16)
+        )
+        out.seek(len(FLAC_MAGIC))
+        out.write(bytes([0x80 | BLOCK_STREAMINFO]) + STREAMINFO_SIZE.to_bytes(3, "big") + result.pack())
+
+    return result
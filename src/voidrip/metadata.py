@@ -17,13 +17,32 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 #
 
+from typing import Optional, Dict, Any
+
 import musicbrainzngs as mb
 import discid
 from pprint import pprint
 
+from . import cd
 from . import cdplayer
 
 
+USERAGENT = ("VoidRippert", "0.1", "bas@zoetekouw.net")
+
+
+# raw musicbrainz lookup of a disc by its disc id; returns None if the disc is unknown
+def lookup_musicbrainz(disc: cd.Disc) -> Optional[Dict[str, Any]]:
+    mb.set_useragent(*USERAGENT)
+    try:
+        # note: adding a toc here will add fuzzy matching if the disc id is not known
+        return mb.get_releases_by_discid(id=disc.id_musicbrainz(),
+                                         includes=["artists", "recordings"],
+                                         toc=disc.toc_musicbrainz()
+                                         )
+    except mb.ResponseError:
+        return None
+
+
 # zie https://kid3.sourceforge.io/kid3_en.html#apply-filename-format voor een lijst van mp3 tags
 
 class Metadata:
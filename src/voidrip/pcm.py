@@ -0,0 +1,126 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from __future__ import annotations
+
+import mmap
+import struct
+from os import PathLike
+from pathlib import Path
+from typing import Iterator, Optional, Tuple, Union
+
+from . import cd
+
+
+class PCMException(Exception):
+    pass
+
+
+# Find the audio data in a wav file; returns the offset and size of the data chunk.
+def wav_data_range(data: Union[bytes, mmap.mmap]) -> Tuple[int, int]:
+    if data[0:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise PCMException("Not a wav file")
+    pos = 12
+    fmt = None
+    while pos + 8 <= len(data):
+        chunk_id, size = struct.unpack("<4sI", data[pos:pos + 8])
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", data[pos + 8:pos + 24])
+        elif chunk_id == b"data":
+            # just doublechecking
+            if fmt is None or fmt[0] != 1 or fmt[1] != 2 or fmt[2] != cd.CDA_SAMLES_PER_SEC \
+               or fmt[5] != cd.CDA_BITS_PER_SAMPLE:
+                raise PCMException("Wav file doesn't look like a CDA rip")
+            return pos + 8, min(size, len(data) - pos - 8)
+        pos += 8 + size + (size & 1)
+    raise PCMException("No audio data in wav file")
+
+
+# Read-only view on a disc image (a wav file or raw 16-bit stereo little-endian samples), corrected for the read
+# offset of the drive.  The correction follows cdparanoia's --sample-offset (see CDPlayer.OFFSETS), but is applied
+# while reading, so the image never has to be rewritten:
+#   corrected[p] = image[p + correction]
+# with samples from outside the image reading as silence, and the length of the image unchanged.
+#
+# The file is memory-mapped, and parts that don't need padding are returned as views on the mapping, without
+# copying.  The mapping is copy-on-write, so the views are writable (which ctypes needs), but nothing is ever
+# written back to the file.
+class PCMView:
+    # 2 channels of 16 bits; not derived from the cd constants, as this module is imported while cd is being loaded
+    BYTES_PER_SAMPLE = 4
+    CHUNK_SAMPLES = 75 * 588  # 1 second
+
+    def __init__(self, path: PathLike, correction: int = 0):
+        self.path = Path(path)
+        self.correction = correction
+
+        with open(self.path, "rb") as fp:
+            size = self.path.stat().st_size
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY) if size else None
+
+        if self._mmap is None:
+            start, size = 0, 0
+        elif self._mmap[0:4] == b"RIFF":
+            start, size = wav_data_range(self._mmap)
+        else:
+            start, size = 0, size
+        size -= size % self.BYTES_PER_SAMPLE
+        self._data = memoryview(self._mmap)[start:start + size] if self._mmap is not None else memoryview(b"")
+        self.samples: int = size // self.BYTES_PER_SAMPLE
+
+    def __len__(self) -> int:
+        return self.samples
+
+    def close(self) -> None:
+        try:
+            self._data.release()
+            if self._mmap is not None:
+                self._mmap.close()
+        except BufferError:
+            # someone still holds a view on the data; the mapping goes away when that is released
+            pass
+
+    def __enter__(self) -> PCMView:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    # samples [start, end) of the corrected image (clipped to the length of the image), as bytes
+    def read(self, start: int, end: int) -> Union[memoryview, bytearray]:
+        bps = self.BYTES_PER_SAMPLE
+        start, end = max(start, 0), min(end, self.samples)
+        if start >= end:
+            return bytearray()
+
+        image_start, image_end = start + self.correction, end + self.correction
+        lo, hi = max(image_start, 0), min(image_end, self.samples)
+        if lo == image_start and hi == image_end:
+            return self._data[lo * bps:hi * bps]
+
+        buf = bytearray((end - start) * bps)
+        if lo < hi:
+            buf[(lo - image_start) * bps:(hi - image_start) * bps] = self._data[lo * bps:hi * bps]
+        return buf
+
+    def chunks(self, start: int = 0, end: Optional[int] = None,
+               chunk_samples: int = CHUNK_SAMPLES) -> Iterator[Union[memoryview, bytearray]]:
+        end = self.samples if end is None else min(end, self.samples)
+        for pos in range(max(start, 0), end, chunk_samples):
+            yield self.read(pos, min(pos + chunk_samples, end))
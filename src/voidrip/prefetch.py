@@ -0,0 +1,57 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from __future__ import annotations
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, Any
+
+from . import cd
+from . import metadata
+from .accuraterip import AccurateRipCache
+from .arlookup import AccurateRipClient, AccurateRipLookup
+
+
+# Starts the remote lookups for a disc in the background.
+# Everything these need is known as soon as the TOC has been read, so they can run while the disc is being ripped,
+# instead of after it.
+class Prefetch:
+    def __init__(self, disc: cd.Disc, ar_cache: Optional[AccurateRipCache] = None, musicbrainz: bool = True):
+        self.disc = disc
+        pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+        client = AccurateRipClient(ar_cache, max_connections=1)
+        self.accuraterip: Future[AccurateRipLookup] = pool.submit(client.lookup, disc.id_accuraterip())
+        # the client is only used for this one lookup
+        self.accuraterip.add_done_callback(lambda _: client.close())
+        self.musicbrainz: Optional[Future[Optional[Dict[str, Any]]]] = None
+        if musicbrainz:
+            self.musicbrainz = pool.submit(metadata.lookup_musicbrainz, disc)
+
+        # don't wait for the lookups here; the threads go away when they're done
+        pool.shutdown(wait=False)
+
+    def musicbrainz_result(self) -> Optional[Dict[str, Any]]:
+        if self.musicbrainz is None:
+            return None
+        try:
+            return self.musicbrainz.result()
+        except Exception as e:
+            print(f"Musicbrainz lookup failed: {e}")
+            return None
@@ -0,0 +1,320 @@
+#
+# <one line to give the program's name and a brief idea of what it does.>
+# Copyright (C) 2018  Bas Zoetekouw <bas.zoetekouw@surfnet.nl>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass, replace
+from os import PathLike
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Iterator, Tuple
+
+import filelock
+
+from . import cd
+
+
+class RipDBException(Exception):
+    pass
+
+
+# The ids of all discs that have been ripped, indexed by their musicbrainz, accuraterip and cddb ids.
+# The database is shared by all drives (and processes, on several hosts over NFS), so it uses the rollback journal:
+# WAL needs shared memory between all processes that use the database, which NFS can't provide.
+class DiscIdStore:
+    SCHEMA_VERSION = 1
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS discs (rip TEXT PRIMARY KEY, musicbrainz TEXT NOT NULL, accuraterip TEXT, "
+        "cddb TEXT)",
+        "CREATE INDEX IF NOT EXISTS discs_musicbrainz ON discs (musicbrainz)",
+        "CREATE INDEX IF NOT EXISTS discs_accuraterip ON discs (accuraterip)",
+        "CREATE INDEX IF NOT EXISTS discs_cddb ON discs (cddb)",
+    ]
+    TIMEOUT = 30.0
+
+    def __init__(self, path: PathLike, legacy_file: Optional[PathLike] = None):
+        self.path = Path(path)
+        try:
+            # autocommit; transactions are started explicitly
+            self._db = sqlite3.connect(self.path, timeout=self.TIMEOUT, isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=DELETE")
+            self._create(Path(legacy_file) if legacy_file else None)
+        except sqlite3.Error as e:
+            raise RipDBException(f"Can't open disc id database `{self.path}': {e}")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> DiscIdStore:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _create(self, legacy_file: Optional[Path]) -> None:
+        if self._db.execute("PRAGMA user_version").fetchone()[0] >= self.SCHEMA_VERSION:
+            return
+        # another process might be doing the same; only one of them gets to create the tables and import
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._db.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                for statement in self.SCHEMA:
+                    self._db.execute(statement)
+                if legacy_file is not None:
+                    self._import(legacy_file)
+                self._db.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    # Import the old `disc_ids.txt' (lines of "<rip> <musicbrainz id>").  That file had most rips listed twice, so
+    # only the first line for every rip is used.
+    def _import(self, legacy_file: Path) -> None:
+        def rows() -> Iterator[Tuple[str, str]]:
+            with open(legacy_file) as fd:
+                for lineno, line in enumerate(fd, 1):
+                    fields = line.split()
+                    if not fields:
+                        continue
+                    if len(fields) != 2:
+                        raise RipDBException(f"Can't parse line {lineno} of `{legacy_file}': {line!r}")
+                    yield fields[0], fields[1]
+
+        try:
+            self._db.executemany("INSERT OR IGNORE INTO discs (rip, musicbrainz) VALUES (?, ?)", rows())
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _ids(disc: cd.Disc) -> Tuple[str, str, str]:
+        return disc.id_musicbrainz(), disc.id_accuraterip().id, disc.id_cddb()
+
+    # the rips of discs with the same toc
+    def find(self, disc: cd.Disc) -> List[str]:
+        musicbrainz, accuraterip, _ = self._ids(disc)
+        return self._find(musicbrainz, accuraterip)
+
+    def _find(self, musicbrainz: str, accuraterip: str) -> List[str]:
+        rows = self._db.execute("SELECT rip FROM discs WHERE musicbrainz = ? "
+                                "UNION SELECT rip FROM discs WHERE accuraterip = ? ORDER BY rip",
+                                (musicbrainz, accuraterip))
+        return [row[0] for row in rows]
+
+    # the rips of discs with the same cddb id; this is a far weaker match than find()
+    def find_cddb(self, cddb_id: str) -> List[str]:
+        rows = self._db.execute("SELECT rip FROM discs WHERE cddb = ? ORDER BY rip", (cddb_id,))
+        return [row[0] for row in rows]
+
+    # Register the disc for a rip, and return the earlier rips of the same disc.  The lookup and insert are a single
+    # transaction, so if two drives get the same disc at the same time, one of them will see the other.
+    def add(self, rip: str, disc: cd.Disc) -> List[str]:
+        musicbrainz, accuraterip, cddb = self._ids(disc)
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                duplicates = [r for r in self._find(musicbrainz, accuraterip) if r != rip]
+                self._db.execute("INSERT OR REPLACE INTO discs (rip, musicbrainz, accuraterip, cddb) "
+                                 "VALUES (?, ?, ?, ?)", (rip, musicbrainz, accuraterip, cddb))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            raise RipDBException(f"Can't register disc for {rip}: {e}")
+        return duplicates
+
+    def remove(self, rip: str) -> None:
+        try:
+            self._db.execute("DELETE FROM discs WHERE rip = ?", (rip,))
+        except sqlite3.Error as e:
+            raise RipDBException(f"Can't remove {rip}: {e}")
+
+
+# Hands out rip ids: a counter in a file, which is incremented under a lock.  This works for several processes on
+# several hosts, as long as they share the file system (the lock is an fcntl lock, which works over NFS as well).
+# The counter starts at the highest id that is in use when the file is created, so existing gaps are left alone.
+class RipIdCounter:
+    def __init__(self, path: PathLike, highest_id: Callable[[], int]):
+        self.path = Path(path)
+        self._highest_id = highest_id
+        self._lock = filelock.FileLock(str(self.path.with_name(self.path.name + ".lock")))
+
+    def next(self) -> int:
+        with self._lock:
+            try:
+                last = int(self.path.read_text())
+            except FileNotFoundError:
+                last = self._highest_id()
+            except ValueError:
+                raise RipDBException(f"Corrupt id counter `{self.path}'")
+
+            # write to a new file and rename it, so the counter is never half-written
+            tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+            with open(tmp, "w") as fd:
+                print(last + 1, file=fd)
+                fd.flush()
+                os.fsync(fd.fileno())
+            tmp.replace(self.path)
+            return last + 1
+
+
+@dataclass(frozen=True)
+class RipState:
+    status: Optional[str] = None
+    artist: Optional[str] = None
+    album: Optional[str] = None
+
+
+# The `.status' files: three lines with the status, artist and album, empty if unknown.
+def read_status_file(path: PathLike) -> RipState:
+    with open(path, "r") as statusfile:
+        status = statusfile.readline().rstrip()
+        artist = statusfile.readline().rstrip()
+        album = statusfile.readline().rstrip()
+    return RipState(status or None, artist or None, album or None)
+
+
+# written to a new file which is then renamed, so readers never see a half-written file
+def write_status_file(path: PathLike, state: RipState) -> None:
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    with open(tmp, "w") as statusfile:
+        print(state.status or '', file=statusfile)
+        print(state.artist or '', file=statusfile)
+        print(state.album or '', file=statusfile)
+    tmp.replace(path)
+
+
+# The state of all rips.  The state of a rip is only changed by the process that does the rip, so that process keeps
+# it in memory and only writes it to the database; others (dashboards) can query the database for many rips at once.
+# The database lives on a file system that is shared by several hosts (NFS), so it uses the rollback journal rather
+# than WAL (which needs shared memory between all processes that use it), and the cache is dropped as soon as the
+# database has been changed by anyone else (PRAGMA data_version, which only reads the header of the database).
+# When the database is created, the existing status files are imported.
+class RipStateStore:
+    SCHEMA_VERSION = 1
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS rips (rip TEXT PRIMARY KEY, status TEXT, artist TEXT, album TEXT)",
+        "CREATE INDEX IF NOT EXISTS rips_status ON rips (status)",
+    ]
+    TIMEOUT = 30.0
+
+    def __init__(self, path: PathLike, status_dir: Optional[PathLike] = None):
+        self.path = Path(path)
+        self._cache: Dict[str, RipState] = dict()
+        self._data_version: Optional[int] = None
+        self._lock = threading.Lock()
+        try:
+            self._db = sqlite3.connect(self.path, timeout=self.TIMEOUT, isolation_level=None,
+                                       check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=DELETE")
+            self._create(Path(status_dir) if status_dir else None)
+        except sqlite3.Error as e:
+            raise RipDBException(f"Can't open rip state database `{self.path}': {e}")
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> RipStateStore:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _create(self, status_dir: Optional[Path]) -> None:
+        if self._db.execute("PRAGMA user_version").fetchone()[0] >= self.SCHEMA_VERSION:
+            return
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._db.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                for statement in self.SCHEMA:
+                    self._db.execute(statement)
+                if status_dir is not None:
+                    self._import(status_dir)
+                self._db.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _import(self, status_dir: Path) -> None:
+        def rows() -> Iterator[Tuple[str, Optional[str], Optional[str], Optional[str]]]:
+            for path in status_dir.glob("*.status"):
+                try:
+                    state = read_status_file(path)
+                except FileNotFoundError:
+                    continue
+                yield path.stem, state.status, state.artist, state.album
+
+        self._db.executemany("INSERT OR IGNORE INTO rips (rip, status, artist, album) VALUES (?, ?, ?, ?)", rows())
+
+    # Drop the cache if another connection has changed the database since it was filled.  The changes made through
+    # this connection don't change the data version; those are in the cache already.
+    def _revalidate(self) -> None:
+        data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._cache.clear()
+            self._data_version = data_version
+
+    def get(self, rip: str) -> Optional[RipState]:
+        with self._lock:
+            self._revalidate()
+            if rip not in self._cache:
+                row = self._db.execute("SELECT status, artist, album FROM rips WHERE rip = ?", (rip,)).fetchone()
+                if row is None:
+                    return None
+                self._cache[rip] = RipState(*row)
+            return self._cache[rip]
+
+    def set(self, rip: str, state: RipState) -> None:
+        with self._lock:
+            try:
+                self._db.execute("INSERT OR REPLACE INTO rips (rip, status, artist, album) VALUES (?, ?, ?, ?)",
+                                 (rip, state.status, state.artist, state.album))
+            except sqlite3.Error as e:
+                raise RipDBException(f"Can't save state of {rip}: {e}")
+            self._cache[rip] = state
+
+    # change only the fields that are given, and return the new state
+    def update(self, rip: str, **changes: Optional[str]) -> RipState:
+        state = self.get(rip) or RipState()
+        state = replace(state, **{k: v for k, v in changes.items() if v is not None})
+        self.set(rip, state)
+        return state
+
+    def remove(self, rip: str) -> None:
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM rips WHERE rip = ?", (rip,))
+            except sqlite3.Error as e:
+                raise RipDBException(f"Can't remove {rip}: {e}")
+            self._cache.pop(rip, None)
+
+    # the rips with the given status (or all of them), in order
+    def query(self, status: Optional[str] = None) -> Dict[str, RipState]:
+        if status is None:
+            rows = self._db.execute("SELECT rip, status, artist, album FROM rips ORDER BY rip")
+        else:
+            rows = self._db.execute("SELECT rip, status, artist, album FROM rips WHERE status = ? ORDER BY rip",
+                                    (status,))
+        return {row[0]: RipState(*row[1:]) for row in rows}
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the package isn't installed; it lives in src/, next to the daemon
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
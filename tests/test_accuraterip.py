@@ -0,0 +1,112 @@
+import random
+import struct
+import wave
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import pytest
+
+from voidrip import cd
+from voidrip.accuraterip import AccurateRip, DiscChecksum, TrackChecksum, frame450_checksums
+from voidrip.pcm import PCMView
+
+SECTOR = cd.CDA_SAMPLES_PER_FRAME
+# short tracks, but long enough for the skipped samples at the start of the first and the end of the last track
+LENGTHS = [12 * SECTOR, 9 * SECTOR, 14 * SECTOR]
+OFFSETS = 30
+
+
+# The checksums of a track at a single offset, straight from the definition: the weighted sum over the samples of
+# the track, read offset samples further on in the image, with silence outside of the image.
+def reference(samples: List[int], track: SimpleNamespace, offset: int) -> Tuple[int, int]:
+    first = TrackChecksum.SKIP_SAMPLES_FIRST if track.is_first else 0
+    last = track.length_samples - TrackChecksum.SKIP_SAMPLES_LAST if track.is_last else track.length_samples
+    v1 = v2 = 0
+    for j in range(first, last):
+        pos = track.first_sample + offset + j
+        product = (samples[pos] if 0 <= pos < len(samples) else 0) * (j + 1)
+        v1 += product & 0xffffffff
+        v2 += (product & 0xffffffff) + (product >> 32)
+    return v1 & 0xffffffff, v2 & 0xffffffff
+
+
+def make_tracks(lengths: List[int], start: int = 0) -> List[SimpleNamespace]:
+    tracks = []
+    for num, length in enumerate(lengths, 1):
+        tracks.append(SimpleNamespace(num=num, first_sample=start, length_samples=length, length=length // SECTOR,
+                                      is_first=num == 1, is_last=num == len(lengths)))
+        start += length
+    return tracks
+
+
+def write_wav(path: Path, samples: List[int]) -> Path:
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(struct.pack(f"<{len(samples)}I", *samples))
+    return path
+
+
+# the tracks fill the image, so the windows of the first and last track run off both ends
+@pytest.fixture
+def disc() -> Tuple[List[int], List[SimpleNamespace]]:
+    rng = random.Random(1)
+    return [rng.getrandbits(32) for _ in range(sum(LENGTHS))], make_tracks(LENGTHS)
+
+
+def test_rolling_checksums_match_the_definition(disc):
+    samples, tracks = disc
+    v2_offsets = (-OFFSETS, -7, 0, 13, OFFSETS)
+    checksum = DiscChecksum(tracks, OFFSETS, OFFSETS, v2_offsets)
+
+    # feed the image in chunks of all sorts of sizes, so the windows start and end anywhere in a chunk
+    rng = random.Random(2)
+    data = struct.pack(f"<{len(samples)}I", *samples)
+    pos = checksum.first_sample
+    while pos < len(samples):
+        size = rng.randint(1, 3 * SECTOR)
+        checksum.update(data[4 * pos:4 * (pos + size)])
+        pos += size
+
+    v1, v2 = checksum.finish(), checksum.finish_v2()
+    for track in tracks:
+        assert sorted(v1[track.num]) == list(range(-OFFSETS, OFFSETS + 1))
+        assert sorted(v2[track.num]) == sorted(v2_offsets)
+        for offset in range(-OFFSETS, OFFSETS + 1):
+            crc1, crc2 = reference(samples, track, offset)
+            assert v1[track.num][offset] == crc1, (track.num, offset)
+            if offset in v2_offsets:
+                assert v2[track.num][offset] == crc2, (track.num, offset)
+
+
+@pytest.mark.parametrize("offset", [-OFFSETS, 0, 17])
+def test_checksum_image_at_a_single_offset(tmp_path, disc, offset):
+    samples, tracks = disc
+    checksum = AccurateRip.checksum_image(tracks, write_wav(tmp_path / "image.wav", samples), offset)
+    for track in tracks:
+        crc1, crc2 = reference(samples, track, offset)
+        assert checksum.finish()[track.num] == {offset: crc1}
+        assert checksum.finish_v2()[track.num] == {offset: crc2}
+
+
+def test_frame450_checksums(tmp_path):
+    frame, max_offset = AccurateRip.FRAME450, 40
+    rng = random.Random(3)
+    samples = [rng.getrandbits(32) for _ in range((frame + 10) * SECTOR)]
+    # the first track is not the first one on the disc, so nothing is skipped
+    track = make_tracks([(frame + 5) * SECTOR], start=3 * SECTOR)[0]
+    track.is_first = False
+    frame_track = SimpleNamespace(first_sample=track.first_sample + frame * SECTOR, length_samples=SECTOR,
+                                  is_first=False, is_last=False)
+    expected = {k: reference(samples, frame_track, k)[0] for k in range(-max_offset, max_offset + 1)}
+
+    with PCMView(write_wav(tmp_path / "image.wav", samples)) as image:
+        assert frame450_checksums(image, track, frame, max_offset) == expected
+
+    # just a few frames around frame 450, like AudioRipper.measure_offset reads them
+    span_start = track.first_sample + (frame - 2) * SECTOR
+    span = write_wav(tmp_path / "span.wav", samples[span_start:span_start + 5 * SECTOR])
+    with PCMView(span) as image:
+        assert frame450_checksums(image, track, frame, max_offset, image_start=span_start) == expected
@@ -0,0 +1,164 @@
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import pytest
+
+from voidrip import arlookup
+from voidrip.accuraterip import AccurateRipCache, AccurateRipID
+from voidrip.arlookup import AccurateRipClient
+
+DISCS = [AccurateRipID(2, 0x100 + n, 0x200 + n, 0x300 + n) for n in range(4)]
+
+
+def entry(accuraterip_id: AccurateRipID) -> bytes:
+    header = struct.pack("<BIII", accuraterip_id.num_tracks, accuraterip_id.id1, accuraterip_id.id2,
+                         accuraterip_id.id3)
+    return header + b"".join(struct.pack("<BII", 10, 0x1000 + t, 0x2000 + t) for t in range(2))
+
+
+# A stand-in for the accuraterip server, with keep-alive connections.  Every path can be given a list of responses
+# (status, headers) to send before the entry itself.
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.entries: Dict[str, bytes] = {f"/accuraterip/{i.path}": entry(i) for i in DISCS}
+        self.failures: Dict[str, List[Tuple[int, Dict[str, str]]]] = {}
+        self.requests: List[Tuple[str, float]] = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/accuraterip"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, time.monotonic()))
+            failures = self.server.failures.get(self.path)
+            failure = failures.pop(0) if failures else None
+        if failure is not None:
+            status, headers = failure
+            body = b""
+        elif self.path in self.server.entries:
+            status, headers, body = 200, {}, self.server.entries[self.path]
+        else:
+            status, headers, body = 404, {}, b""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[Server]:
+    server = Server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> List[float]:
+    # back off without actually waiting
+    slept: List[float] = []
+    monkeypatch.setattr(arlookup.time, "sleep", slept.append)
+    return slept
+
+
+def client(server: Server, tmp_path: Path, **kwargs) -> AccurateRipClient:
+    return AccurateRipClient(AccurateRipCache(tmp_path, base_url=server.base_url), **kwargs)
+
+
+def test_lookup(server, tmp_path):
+    lookup = client(server, tmp_path, min_interval=0).lookup(DISCS[0])
+    assert lookup.found and lookup.error is None
+    assert lookup.results.find_crc1(2, 0x1001) == [(10, 0)]
+
+    # the second time, it comes from the cache
+    lookup = client(server, tmp_path, min_interval=0).lookup(DISCS[0])
+    assert lookup.found
+    assert len(server.requests) == 1
+
+
+def test_not_found(server, tmp_path):
+    lookup = client(server, tmp_path, min_interval=0).lookup(AccurateRipID(1, 1, 2, 3))
+    assert not lookup.found and lookup.error is None
+
+
+def test_retry(server, tmp_path, sleeps):
+    path = f"/accuraterip/{DISCS[0].path}"
+    server.failures[path] = [(503, {}), (500, {})]
+    lookup = client(server, tmp_path, min_interval=0, backoff=1.0).lookup(DISCS[0])
+    assert lookup.found
+    assert [p for p, _ in server.requests] == [path] * 3
+    assert sleeps == [1.0, 2.0]
+
+
+def test_retry_after(server, tmp_path, sleeps):
+    server.failures[f"/accuraterip/{DISCS[0].path}"] = [(429, {"Retry-After": "7"})]
+    lookup = client(server, tmp_path, min_interval=0, backoff=1.0).lookup(DISCS[0])
+    assert lookup.found
+    assert sleeps == [7.0]
+
+
+def test_give_up(server, tmp_path, sleeps):
+    server.failures[f"/accuraterip/{DISCS[0].path}"] = [(503, {})] * 3
+    lookup = client(server, tmp_path, min_interval=0, retries=2).lookup(DISCS[0])
+    assert not lookup.found
+    assert "503" in str(lookup.error)
+    assert len(server.requests) == 3
+
+
+def test_connection_reuse(server, tmp_path):
+    lookups = list(client(server, tmp_path, min_interval=0, max_connections=1).lookup_many(DISCS))
+    assert sorted(lookup.id.id for lookup in lookups) == sorted(i.id for i in DISCS)
+    assert all(lookup.found for lookup in lookups)
+    assert server.connections == 1
+
+
+def test_connections_closed(server, tmp_path):
+    ar_client = client(server, tmp_path, min_interval=0, max_connections=2)
+    lookups = ar_client.lookup_many(DISCS)
+    assert next(lookups).found
+    # stop after the first result
+    lookups.close()
+    assert ar_client._connections == []
+
+
+def test_rate_limit(server, tmp_path):
+    list(client(server, tmp_path, min_interval=0.05, max_connections=4).lookup_many(DISCS))
+    times = sorted(t for _, t in server.requests)
+    assert len(times) == len(DISCS)
+    assert all(b - a >= 0.04 for a, b in zip(times, times[1:]))
+
+
+def test_cache_write_failure(server, tmp_path, monkeypatch):
+    def put(*args):
+        raise PermissionError("read-only cache")
+
+    ar_client = client(server, tmp_path, min_interval=0)
+    monkeypatch.setattr(ar_client.cache, "put", put)
+    lookup = ar_client.lookup(DISCS[0])
+    assert lookup.found and lookup.error is None
@@ -0,0 +1,106 @@
+import random
+import struct
+import wave
+from concurrent.futures import Future
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import pytest
+
+from voidrip import arnative, cd
+from voidrip.accuraterip import (AccurateRip, AccurateRipCache, AccurateRipID, AccurateRipResults, TrackChecksum,
+                                 frame450_checksums, pcm_samples)
+from voidrip.arlookup import AccurateRipLookup
+from voidrip.pcm import PCMView
+
+SECTOR = cd.CDA_SAMPLES_PER_FRAME
+
+pytestmark = pytest.mark.skipif(not arnative.available(), reason="libaccuraterip.so can't be loaded")
+
+
+def python_checksum(data: bytes, is_first: bool, is_last: bool) -> Tuple[int, int]:
+    samples = pcm_samples(data)
+    checksummer = TrackChecksum(len(samples), is_first, is_last, 0, 0)
+    checksummer.update(samples, 0)
+    return checksummer.checksums_v1()[0], checksummer.checksums_v2()[0]
+
+
+def write_wav(path: Path, data: bytes) -> Path:
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(data)
+    return path
+
+
+@pytest.mark.parametrize("is_first, is_last", [(False, False), (True, False), (False, True), (True, True)])
+def test_checksum(is_first, is_last):
+    data = random.Random(1).randbytes(4 * 20 * SECTOR)
+    assert arnative.checksum(data, is_first, is_last) == python_checksum(data, is_first, is_last)
+
+
+# the samples can be passed in any buffer, also one on a mapped image
+def test_buffers(tmp_path):
+    data = random.Random(2).randbytes(4 * 12 * SECTOR)
+    expected = python_checksum(data, False, True)
+    assert arnative.checksum(bytearray(data), False, True) == expected
+    assert arnative.checksum(memoryview(data), False, True) == expected
+    with PCMView(write_wav(tmp_path / "image.wav", bytes(4 * 7) + data)) as image:
+        assert arnative.checksum(image.read(7, 7 + 12 * SECTOR), False, True) == expected
+
+
+def test_too_short():
+    with pytest.raises(arnative.ArNativeException):
+        arnative.checksum(bytes(4 * 5 * SECTOR), True, True)
+
+
+# A disc that is in the (prefetched) database, ripped with an offset: both backends find it at that offset, with
+# the same checksums.
+def test_backends_agree(tmp_path, monkeypatch):
+    offset, pregap = 13, 2 * SECTOR
+    lengths = [452 * SECTOR, 453 * SECTOR, 455 * SECTOR]
+    tracks: List[SimpleNamespace] = []
+    for num, length in enumerate(lengths, 1):
+        first_sample = tracks[-1].first_sample + tracks[-1].length_samples if tracks else pregap
+        tracks.append(SimpleNamespace(num=num, first_sample=first_sample, length_samples=length,
+                                      length=length // SECTOR, is_first=num == 1, is_last=num == len(lengths)))
+    audio = random.Random(3).randbytes(4 * (pregap + sum(lengths)))
+    accuraterip_id = AccurateRipID(len(tracks), 1, 2, 3)
+
+    # the database entry, from the audio as it should be
+    entry = struct.pack("<BIII", accuraterip_id.num_tracks, accuraterip_id.id1, accuraterip_id.id2,
+                        accuraterip_id.id3)
+    with PCMView(write_wav(tmp_path / "audio.wav", audio)) as view:
+        for track in tracks:
+            crc1, _ = python_checksum(view.read(track.first_sample, track.first_sample + track.length_samples),
+                                      track.is_first, track.is_last)
+            crc450 = frame450_checksums(view, track, AccurateRip.FRAME450, 0)[0]
+            entry += struct.pack("<BII", 5, crc1, crc450)
+
+    # the drive returns every sample offset samples late
+    image = write_wav(tmp_path / "image.wav", bytes(4 * offset) + audio[:-4 * offset])
+    disc = SimpleNamespace(tracks=tracks, cdplayer=None, id_accuraterip=lambda: accuraterip_id,
+                           track_nums=lambda: [t.num for t in tracks])
+
+    native_calls = []
+    checksum = arnative.checksum
+    monkeypatch.setattr(arnative, "checksum", lambda *args: native_calls.append(args) or checksum(*args))
+
+    results = {}
+    for backend in AccurateRip.BACKENDS:
+        prefetched = Future()
+        prefetched.set_result(AccurateRipLookup(accuraterip_id,
+                                                AccurateRipResults.parse_accuraterip_bin(entry, accuraterip_id)))
+        accuraterip = AccurateRip(disc, image, cache=AccurateRipCache(tmp_path / "cache", offline=True),
+                                  prefetched=prefetched, backend=backend)
+        accuraterip.checksum_disc()
+        results[backend] = (accuraterip.checksums, accuraterip.checksums_v2, accuraterip.find_offset(),
+                            accuraterip.find_confidence())
+
+    # at this offset, the last track runs off the end of the image, so that one is always done in python
+    assert [args[1:] for args in native_calls] == [(True, False), (False, False)]
+    assert results["native"] == results["python"]
+    assert results["native"][2] == offset
+    assert results["native"][3] == {1: 5, 2: 5, 3: 5}
@@ -0,0 +1,57 @@
+import hashlib
+import random
+import shutil
+import subprocess
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from voidrip import cd
+from voidrip.audioripper import AudioRipper
+from voidrip.flac import FlacFile
+
+FLAC = shutil.which("flac")
+SECTOR = cd.CDA_SAMPLES_PER_FRAME
+
+pytestmark = pytest.mark.skipif(FLAC is None, reason="flac is not installed")
+
+
+# a disc image with some audio before the first and after the last track, which must not end up in the flac
+@pytest.fixture
+def image(tmp_path: Path) -> Path:
+    path = tmp_path / "image.wav"
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(random.Random(1).randbytes(4 * 40 * SECTOR))
+    return path
+
+
+def test_encoded_tracks_are_joined_into_a_valid_stream(tmp_path, image, monkeypatch):
+    tracks = [
+        SimpleNamespace(num=1, first_sample=2 * SECTOR, length_samples=20 * SECTOR),
+        SimpleNamespace(num=2, first_sample=22 * SECTOR, length_samples=13 * SECTOR),
+    ]
+    monkeypatch.setitem(AudioRipper.COMMANDS, "flac", Path(FLAC))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ripper = AudioRipper(SimpleNamespace(cdplayer=None, tracks=tracks), tmp_path / "rip", executor=executor)
+        ripper.wav_file = image
+        track_files, output = ripper.encode_flac()
+    assert list(track_files) == [1, 2]
+
+    # flac checks the md5 sum in STREAMINFO against the decoded audio
+    subprocess.run([FLAC, "--silent", "-t", str(output)], check=True)
+
+    with wave.open(str(image), "rb") as wav:
+        audio = wav.readframes(wav.getnframes())[4 * 2 * SECTOR:4 * 35 * SECTOR]
+    decoded = subprocess.run([FLAC, "--silent", "-d", "-c", "--force-raw-format", "--endian=little",
+                              "--sign=signed", str(output)], check=True, stdout=subprocess.PIPE).stdout
+    assert decoded == audio
+
+    with FlacFile(output) as joined:
+        assert joined.streaminfo.total_samples == 33 * SECTOR
+        assert joined.streaminfo.md5 == ripper._md5_samples(2 * SECTOR, 33 * SECTOR) == hashlib.md5(audio).digest()
@@ -0,0 +1,55 @@
+import wave
+from pathlib import Path
+
+import pytest
+
+from voidrip import pcm
+from voidrip.pcm import PCMView
+
+SAMPLES = 1000
+
+
+# every sample holds its own number, so it's easy to see where it came from
+def sample(n: int) -> bytes:
+    return n.to_bytes(2, "little") * 2
+
+
+@pytest.fixture
+def image(tmp_path: Path) -> Path:
+    path = tmp_path / "image.wav"
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(b"".join(sample(n) for n in range(SAMPLES)))
+    return path
+
+
+def test_wav_data_range(image):
+    start, size = pcm.wav_data_range(image.read_bytes())
+    assert start == 44
+    assert size == 4 * SAMPLES
+
+
+def test_uncorrected(image):
+    with PCMView(image) as view:
+        assert len(view) == SAMPLES
+        assert bytes(view.read(10, 12)) == sample(10) + sample(11)
+
+
+# like cdparanoia --sample-offset: a positive correction reads further on in the image
+@pytest.mark.parametrize("correction", [-30, -1, 1, 30])
+def test_correction(image, correction):
+    with PCMView(image, correction) as view:
+        assert len(view) == SAMPLES
+        assert bytes(view.read(100, 102)) == sample(100 + correction) + sample(101 + correction)
+        corrected = b"".join(view.chunks(chunk_samples=64))
+
+    silence = bytes(4 * abs(correction))
+    assert len(corrected) == 4 * SAMPLES
+    if correction > 0:
+        assert corrected[0:4] == sample(correction)
+        assert corrected.endswith(sample(SAMPLES - 1) + silence)
+    else:
+        assert corrected.startswith(silence + sample(0))
+        assert corrected[-4:] == sample(SAMPLES - 1 + correction)
@@ -0,0 +1,76 @@
+import os
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+from voidrip import ripdb
+from voidrip.ripdb import RipState, RipStateStore
+
+
+@pytest.fixture
+def status_dir(tmp_path: Path) -> Path:
+    for num, status in ((1, "DONE"), (2, "METADATA"), (3, "METADATA"), (4, "RIPPING")):
+        ripdb.write_status_file(tmp_path / f"cd_{num:05d}.status", RipState(status, f"artist {num}", f"album {num}"))
+    return tmp_path
+
+
+@pytest.fixture
+def store(status_dir: Path) -> Iterator[RipStateStore]:
+    with RipStateStore(status_dir / "rips.sqlite", status_dir=status_dir) as store:
+        yield store
+
+
+# the statements that are run on the database of a store
+def trace(store: RipStateStore) -> List[str]:
+    statements: List[str] = []
+    store._db.set_trace_callback(statements.append)
+    return statements
+
+
+def test_status_files_are_imported(store):
+    assert store.get("cd_00002") == RipState("METADATA", "artist 2", "album 2")
+    assert store.get("cd_00005") is None
+
+
+def test_bulk_query_does_not_walk_the_directory(store, monkeypatch):
+    def walk(*args, **kwargs):
+        raise AssertionError("the status directory was walked")
+
+    for name in ("glob", "rglob", "iterdir"):
+        monkeypatch.setattr(Path, name, walk)
+    monkeypatch.setattr(os, "scandir", walk)
+    monkeypatch.setattr(os, "listdir", walk)
+
+    assert store.query("METADATA") == {
+        "cd_00002": RipState("METADATA", "artist 2", "album 2"),
+        "cd_00003": RipState("METADATA", "artist 3", "album 3"),
+    }
+    assert list(store.query()) == ["cd_00001", "cd_00002", "cd_00003", "cd_00004"]
+    assert store.query("INITIALIZING") == {}
+
+
+def test_state_is_cached(store):
+    store.update("cd_00004", status="RIP_DONE")
+    statements = trace(store)
+    for _ in range(10):
+        assert store.get("cd_00004") == RipState("RIP_DONE", "artist 4", "album 4")
+    assert not [s for s in statements if s.startswith("SELECT")]
+
+
+def test_cache_sees_changes_of_other_connections(store, status_dir):
+    assert store.get("cd_00001").status == "DONE"
+    with RipStateStore(status_dir / "rips.sqlite") as other:
+        other.update("cd_00001", status="METADATA")
+        other.remove("cd_00002")
+        other.set("cd_00005", RipState("RIPPING"))
+
+    assert store.get("cd_00001").status == "METADATA"
+    assert store.get("cd_00002") is None
+    assert store.get("cd_00005") == RipState("RIPPING")
+
+
+def test_removed_state_is_gone(store):
+    store.remove("cd_00003")
+    assert store.get("cd_00003") is None
+    assert "cd_00003" not in store.query()